@@ -0,0 +1,165 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+    """Request refused by admission control (HTTP status + Retry-After seconds)"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class EndpointClass:
+    """
+    Bounded concurrency + bounded FIFO queue for one class of endpoints.
+
+    A request first has to get under its user's in-flight cap (else 429), then
+    a global slot. If all slots are busy it queues; when the queue is full or
+    the request has waited longer than max_wait_seconds it is shed with 503.
+    """
+
+    def __init__(self, name, concurrency, queue_size, max_wait_seconds, per_user_limit):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait_seconds = max_wait_seconds
+        self.per_user_limit = per_user_limit
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+        self._user_inflight = {}
+
+        # Metrics
+        self._wait_ms = deque(maxlen=1000)
+        self._service_ms = deque(maxlen=200)
+        self._counts = {
+            "admitted": 0,
+            "rejected_user_limit": 0,
+            "rejected_queue_full": 0,
+            "shed_queue_timeout": 0
+        }
+        self._max_queue_depth = 0
+
+    def _retry_after(self):
+        # Rough time for the current queue to drain, at least one second
+        service_s = (sum(self._service_ms) / len(self._service_ms) / 1000) if self._service_ms else 1.0
+        drain = service_s * (len(self._waiters) + 1) / max(1, self.concurrency)
+        return max(1, math.ceil(drain))
+
+    def _acquire_user(self, user_id):
+        with self._lock:
+            inflight = self._user_inflight.get(user_id, 0)
+            if inflight >= self.per_user_limit:
+                self._counts["rejected_user_limit"] += 1
+                raise AdmissionRejected(429, f"Too many concurrent {self.name} requests for this user", self._retry_after())
+            self._user_inflight[user_id] = inflight + 1
+
+    def _release_user(self, user_id):
+        with self._lock:
+            inflight = self._user_inflight.get(user_id, 1) - 1
+            if inflight > 0:
+                self._user_inflight[user_id] = inflight
+            else:
+                self._user_inflight.pop(user_id, None)
+
+    def _acquire_slot(self):
+        start = time.perf_counter()
+        with self._lock:
+            if self._active < self.concurrency and not self._waiters:
+                self._active += 1
+                self._wait_ms.append(0.0)
+                self._counts["admitted"] += 1
+                return
+            if len(self._waiters) >= self.queue_size:
+                self._counts["rejected_queue_full"] += 1
+                raise AdmissionRejected(503, f"{self.name} queue is full", self._retry_after())
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._waiters))
+
+        waiter.event.wait(self.max_wait_seconds)
+
+        with self._lock:
+            waited_ms = (time.perf_counter() - start) * 1000
+            self._wait_ms.append(waited_ms)
+            if waiter.granted:
+                self._counts["admitted"] += 1
+                return
+            self._waiters.remove(waiter)
+            self._counts["shed_queue_timeout"] += 1
+            raise AdmissionRejected(503, f"{self.name} request waited too long in queue", self._retry_after())
+
+    def _release_slot(self):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def admit(self, user_id):
+        self._acquire_user(user_id)
+        try:
+            self._acquire_slot()
+        except AdmissionRejected:
+            self._release_user(user_id)
+            raise
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._service_ms.append((time.perf_counter() - start) * 1000)
+            self._release_slot()
+            self._release_user(user_id)
+
+    def metrics(self):
+        with self._lock:
+            waits = sorted(self._wait_ms)
+            return {
+                "in_flight": self._active,
+                "queue_depth": len(self._waiters),
+                "max_queue_depth": self._max_queue_depth,
+                "concurrency": self.concurrency,
+                "queue_size": self.queue_size,
+                "users_in_flight": len(self._user_inflight),
+                "wait_ms_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_ms_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                "wait_ms_max": waits[-1] if waits else 0.0,
+                **self._counts
+            }
+
+
+class AdmissionController:
+    """Registry of endpoint classes (e.g. chat vs ingestion)"""
+
+    def __init__(self):
+        self.classes = {}
+
+    def add_class(self, name, concurrency, queue_size, max_wait_seconds, per_user_limit):
+        self.classes[name] = EndpointClass(name, concurrency, queue_size, max_wait_seconds, per_user_limit)
+
+    def admit(self, class_name, user_id):
+        return self.classes[class_name].admit(user_id)
+
+    def metrics(self):
+        return {name: endpoint_class.metrics() for name, endpoint_class in self.classes.items()}
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import jwt
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import (
+    JWT_SECRET,
+    AUTH_KDF_WORKERS,
+    AUTH_KDF_MAX_PENDING,
+    AUTH_KDF_TIMEOUT_SECONDS,
+    AUTH_TOKEN_CACHE_SIZE
+)
+
+
+class AuthBusyError(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+# Password KDF work (pbkdf2/scrypt) runs on a small dedicated pool, so a burst of
+# logins/registrations uses at most AUTH_KDF_WORKERS cores and cannot starve
+# request threads serving chat traffic.
+_kdf_pool = ThreadPoolExecutor(max_workers=AUTH_KDF_WORKERS, thread_name_prefix="auth-kdf")
+_kdf_slots = threading.BoundedSemaphore(AUTH_KDF_WORKERS + AUTH_KDF_MAX_PENDING)
+
+
+def _run_kdf(fn, *args):
+    if not _kdf_slots.acquire(blocking=False):
+        raise AuthBusyError("Too many concurrent authentication requests")
+    try:
+        future = _kdf_pool.submit(fn, *args)
+    except Exception:
+        _kdf_slots.release()
+        raise
+    future.add_done_callback(lambda _: _kdf_slots.release())
+    return future.result(timeout=AUTH_KDF_TIMEOUT_SECONDS)
+
+
+def hash_password(password):
+    """Hash a password on the KDF pool"""
+    return _run_kdf(generate_password_hash, password, 'pbkdf2:sha256', 8)
+
+
+def check_password(password_hash, password):
+    """Check a password against its hash on the KDF pool"""
+    return _run_kdf(check_password_hash, password_hash, password)
+
+
+class TokenCache:
+    """Small LRU of verified token -> payload that never serves an expired token"""
+
+    def __init__(self, max_size=AUTH_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        with self._lock:
+            payload = self._entries.get(token)
+            if payload is None:
+                self.misses += 1
+                return None
+            if payload.get('exp', 0) <= time.time():
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return payload
+
+    def put(self, token, payload):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[token] = payload
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+# JWT Helper Functions
+def generate_jwt_token(user_id, username):
+    """Generate JWT token for authenticated user"""
+    payload = {
+        'user_id': user_id,
+        'username': username,
+        'exp': datetime.utcnow() + timedelta(hours=24)  # Token expires in 24 hours
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
+
+
+def verify_jwt_token(token):
+    """Verify and decode JWT token, serving repeat verifications from the LRU"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None  # Token expired
+    except jwt.InvalidTokenError:
+        return None  # Invalid token
+
+    token_cache.put(token, payload)
+    return payload
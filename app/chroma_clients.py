@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import chromadb
+from chromadb.api.client import SharedSystemClient
+from chromadb.config import Settings
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: no cross-process store locking
+    fcntl = None
+
+from config import CHROMA_CLIENT_RETIRE_SECONDS
+
+SQLITE_FILENAME = "chroma.sqlite3"
+LOCK_SUFFIX = ".lock"
+
+
+def open_client(path):
+    return chromadb.PersistentClient(path=path, settings=Settings(anonymized_telemetry=False))
+
+
+def detach_client(client):
+    """Drop a client's system from chromadb's per-path cache (the next open gets a new one)"""
+    return SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+
+
+def release_client(client):
+    """
+    Stop a client's system and drop it from chromadb's per-path cache, so
+    walking thousands of stores does not keep thousands of them open
+    """
+    system = detach_client(client)
+    if system is not None:
+        system.stop()
+
+
+def dir_footprint(path):
+    """(bytes, files) under a directory"""
+    total_bytes = 0
+    files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total_bytes += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                pass
+    return total_bytes, files
+
+
+def _store_generation(path):
+    # The sqlite file is replaced (new inode) when maintenance swaps in a rebuilt store
+    try:
+        return os.stat(os.path.join(path, SQLITE_FILENAME)).st_ino
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def store_lock(path, exclusive=False):
+    """
+    Lock a persist directory against being swapped: writers hold it shared,
+    tools/vectorstore_maintenance.py exclusively while it checks and swaps.
+    The lock file sits beside the directory, so it outlives the swap.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = os.path.abspath(path).rstrip(os.sep) + LOCK_SUFFIX
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+# (stop after, system) of swapped-out stores; other threads may still be using them
+_retired = []
+
+
+def close_store_client(path):
+    """Release the cached client of a persist directory (before the directory is removed)"""
+    path = os.path.abspath(path)
+    with _clients_lock:
+        cached = _clients.pop(path, None)
+    if cached is not None:
+        release_client(cached[1])
+
+
+def get_store_client(path):
+    """
+    Process-wide client for a persist directory. Reopened when the directory
+    was swapped for a rebuilt copy by tools/vectorstore_maintenance.py; the
+    old client is stopped CHROMA_CLIENT_RETIRE_SECONDS later, not while
+    requests may still be using it.
+    """
+    path = os.path.abspath(path)
+    generation = _store_generation(path)
+    with _clients_lock:
+        cached = _clients.get(path)
+        if cached is not None and (cached[0] == generation or generation is None):
+            return cached[1]
+        now = time.monotonic()
+        while _retired and _retired[0][0] <= now:
+            _retired.pop(0)[1].stop()
+        if cached is not None:
+            system = detach_client(cached[1])
+            if system is not None:
+                _retired.append((now + CHROMA_CLIENT_RETIRE_SECONDS, system))
+        client = open_client(path)
+        # Opening may have created the sqlite file
+        _clients[path] = (_store_generation(path), client)
+        return client
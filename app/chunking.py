@@ -0,0 +1,224 @@
+"""
+Token-aware chunking shared by PDF, URL and seed-corpus ingestion.
+
+Text is cut once into paragraph units (blank lines), and only paragraphs
+that exceed the chunk size are cut further (sentences, then tokens). Units
+are counted once and packed greedily, so a document is processed in linear
+time whatever its size. RecursiveCharacterTextSplitter, by contrast,
+re-scans oversized pieces once per separator level.
+
+Every chunk keeps where it came from: its page (and page_end when it spans
+pages) for PDFs, and the markdown heading path, e.g. "Setup > Install".
+"""
+import re
+
+from langchain_core.documents import Document
+
+from config import CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from tokens import count_tokens, split_by_tokens
+
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$")
+# Page markers written by pdf_converter.convert_PDF_to_markdown
+_PAGE_MARKER_RE = re.compile(r"^#{1,6}\s*Page\s+(\d+)\s*$", re.IGNORECASE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+HEADING_SEPARATOR = " > "
+
+
+class _Unit:
+    __slots__ = ("text", "tokens", "page", "headings", "is_heading", "continues")
+
+    def __init__(self, text, tokens, page, headings, is_heading=False, continues=False):
+        self.text = text
+        self.tokens = tokens
+        self.page = page
+        self.headings = headings
+        self.is_heading = is_heading
+        self.continues = continues  # a later piece of the same paragraph
+
+
+def _split_oversized(text, chunk_tokens):
+    """Sentences of an oversized paragraph, hard-cut by tokens where still too long"""
+    for sentence in _SENTENCE_RE.split(text):
+        tokens = count_tokens(sentence)
+        if tokens <= chunk_tokens:
+            yield sentence, tokens
+        else:
+            for piece in split_by_tokens(sentence, chunk_tokens):
+                yield piece, count_tokens(piece)
+
+
+class _UnitReader:
+    """Turns text into units while tracking the current page and heading path"""
+
+    def __init__(self, chunk_tokens):
+        self.chunk_tokens = chunk_tokens
+        self.page = None
+        self.headings = ()  # ((level, title), ...)
+
+    def _paragraph(self, text):
+        text = text.strip()
+        if not text:
+            return
+        tokens = count_tokens(text)
+        if tokens <= self.chunk_tokens:
+            yield _Unit(text, tokens, self.page, self.headings)
+            return
+        continues = False
+        for piece, piece_tokens in _split_oversized(text, self.chunk_tokens):
+            if piece.strip():
+                yield _Unit(piece.strip(), piece_tokens, self.page, self.headings, continues=continues)
+                continues = True
+
+    def read(self, text, page=None):
+        if page is not None:
+            self.page = page
+        for block in _PARAGRAPH_RE.split(text):
+            block = block.strip()
+            if not block:
+                continue
+            first_line, _, rest = block.partition("\n")
+
+            page_marker = _PAGE_MARKER_RE.match(first_line)
+            if page_marker:
+                self.page = int(page_marker.group(1))
+                yield from self._paragraph(rest)
+                continue
+
+            heading = _HEADING_RE.match(first_line)
+            if heading:
+                level = len(heading.group(1))
+                title = heading.group(2).strip()
+                self.headings = tuple(h for h in self.headings if h[0] < level) + ((level, title),)
+                yield _Unit(first_line.strip(), count_tokens(first_line), self.page, self.headings, is_heading=True)
+                yield from self._paragraph(rest)
+                continue
+
+            yield from self._paragraph(block)
+
+
+def _heading_path(headings):
+    return HEADING_SEPARATOR.join(title for _, title in headings)
+
+
+def _cut(unit, budget):
+    """Cut a unit into a first piece of about budget tokens and the rest, or (unit, None)"""
+    pieces = split_by_tokens(unit.text, budget) if budget > 0 else []
+    first = pieces[0].strip() if pieces else ""
+    rest = "".join(pieces[1:]).strip()
+    if not first or not rest:
+        return unit, None
+    return (
+        _Unit(first, count_tokens(first), unit.page, unit.headings, continues=unit.continues),
+        _Unit(rest, count_tokens(rest), unit.page, unit.headings, continues=True),
+    )
+
+
+def _pack(units, metadata, chunk_tokens, overlap_tokens):
+    """Greedily pack units into chunks of at most chunk_tokens, carrying overlap_tokens forward"""
+    chunks = []
+    current = []  # units of the chunk being built
+    current_tokens = 0
+    fresh = 0  # units in current that were not carried over from the previous chunk
+
+    def emit():
+        first = current[-fresh]
+        pages = [unit.page for unit in current if unit.page is not None]
+        chunk_metadata = dict(metadata)
+        if pages:
+            chunk_metadata["page"] = pages[0]
+            if pages[-1] != pages[0]:
+                chunk_metadata["page_end"] = pages[-1]
+        heading_path = _heading_path(first.headings)
+        if heading_path:
+            chunk_metadata["heading_path"] = heading_path
+        chunk_metadata["chunk_index"] = len(chunks)
+        chunk_metadata["token_count"] = current_tokens
+        chunks.append(Document(
+            page_content="".join(
+                (" " if unit.continues else "\n\n") + unit.text if i else unit.text
+                for i, unit in enumerate(current)
+            ),
+            metadata=chunk_metadata
+        ))
+
+    units = iter(units)
+    queue = []  # remainders of units cut to fit beside a heading
+    while True:
+        unit = queue.pop() if queue else next(units, None)
+        if unit is None:
+            break
+        # A new section starts a new chunk once the current one has some substance
+        section_break = (
+            unit.is_heading and fresh and not current[-1].is_heading and current_tokens >= chunk_tokens // 4
+        )
+        if fresh and (section_break or current_tokens + unit.tokens > chunk_tokens):
+            # Headings belong with the text below them, not at the end of the previous chunk
+            if current[-1].is_heading:
+                pending = []
+                while fresh and current[-1].is_heading:
+                    pending.insert(0, current.pop())
+                    fresh -= 1
+                if fresh:
+                    current_tokens -= sum(heading.tokens for heading in pending)
+                    emit()
+                current, current_tokens, fresh = pending, sum(heading.tokens for heading in pending), len(pending)
+                # Cut what does not fit beside the heading rather than leave it alone in a chunk
+                rest = None
+                if current_tokens + unit.tokens > chunk_tokens and not unit.is_heading:
+                    unit, rest = _cut(unit, chunk_tokens - current_tokens)
+                if rest is not None or current_tokens + unit.tokens <= chunk_tokens:
+                    if rest is not None:
+                        queue.append(rest)
+                    current.append(unit)
+                    current_tokens += unit.tokens
+                    fresh += 1
+                    continue
+            emit()
+            carried = []
+            carried_tokens = 0
+            if not section_break:
+                for previous in reversed(current):
+                    if carried_tokens + previous.tokens > overlap_tokens:
+                        break
+                    carried.append(previous)
+                    carried_tokens += previous.tokens
+                carried.reverse()
+            current, current_tokens, fresh = carried, carried_tokens, 0
+
+        # Drop carried overlap that would not leave room for the new unit
+        while current and fresh == 0 and current_tokens + unit.tokens > chunk_tokens:
+            current_tokens -= current.pop(0).tokens
+
+        current.append(unit)
+        current_tokens += unit.tokens
+        fresh += 1
+
+    if fresh:
+        emit()
+    return chunks
+
+
+def chunk_text(text, metadata=None, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split markdown or plain text into token-bounded Documents"""
+    reader = _UnitReader(chunk_tokens)
+    return _pack(reader.read(text), metadata or {}, chunk_tokens, overlap_tokens)
+
+
+def chunk_pages(pages, metadata=None, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Split a paged document, given as (page_number, text) pairs, into
+    token-bounded Documents that record their page numbers
+    """
+    reader = _UnitReader(chunk_tokens)
+    units = (unit for page_number, text in pages for unit in reader.read(text, page=page_number))
+    return _pack(units, metadata or {}, chunk_tokens, overlap_tokens)
+
+
+def chunk_documents(documents, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split LangChain Documents, keeping each one's metadata on its chunks"""
+    chunks = []
+    for document in documents:
+        chunks.extend(chunk_text(document.page_content, document.metadata, chunk_tokens, overlap_tokens))
+    return chunks
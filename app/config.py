@@ -6,16 +6,167 @@ load_dotenv()
 AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
+# Optional faster/cheaper deployment for question contextualization and overflow traffic
+AZURE_OPENAI_SECONDARY_ENDPOINT = os.getenv("AZURE_OPENAI_SECONDARY_ENDPOINT")
+AZURE_OPENAI_SECONDARY_API_KEY = os.getenv("AZURE_OPENAI_SECONDARY_API_KEY")
+AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME")
+AZURE_OPENAI_SECONDARY_MODEL = os.getenv("AZURE_OPENAI_SECONDARY_MODEL", "gpt-4o-mini")
 AZURE_OPENAI_EMBEDDINGS_API_KEY = os.getenv("AZURE_OPENAI_EMBEDDINGS_API_KEY")
 AZURE_OPENAI_EMBEDDINGS_ENDPOINT = os.getenv("AZURE_OPENAI_EMBEDDINGS_ENDPOINT")  
 AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+TAVILY_EXTRACT_URL = os.getenv("TAVILY_EXTRACT_URL")  # Override to point at a local fake extract service
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 JWT_SECRET = os.getenv("JWT_SECRET")
+
+# Auth hot path
+AUTH_KDF_WORKERS = int(os.getenv("AUTH_KDF_WORKERS", "2"))
+AUTH_KDF_MAX_PENDING = int(os.getenv("AUTH_KDF_MAX_PENDING", "32"))
+AUTH_KDF_TIMEOUT_SECONDS = float(os.getenv("AUTH_KDF_TIMEOUT_SECONDS", "10"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+
+# Retrieval tuning
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))
+LEXICAL_INDEX_MAX_STORES = int(os.getenv("LEXICAL_INDEX_MAX_STORES", "256"))  # BM25 indexes kept in memory per process
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_MIN_SENTENCE_OVERLAP = float(os.getenv("CONTEXT_MIN_SENTENCE_OVERLAP", "0.15"))
+
+# Chunking (in tokens of the embedding model's encoding, see tokens.py)
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))
+
+# LLM invocation policy
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "1.0"))
+LLM_CONTEXTUALIZE_ON_SECONDARY = os.getenv("LLM_CONTEXTUALIZE_ON_SECONDARY", "true").lower() == "true"
+LLM_OVERFLOW_IN_FLIGHT = int(os.getenv("LLM_OVERFLOW_IN_FLIGHT", "0"))  # 0 disables overflow routing
+CHAT_LATENCY_BUDGET_SECONDS = float(os.getenv("CHAT_LATENCY_BUDGET_SECONDS", "60"))
+
+# Response encoding
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+HISTORY_STREAM_MIN_MESSAGES = int(os.getenv("HISTORY_STREAM_MIN_MESSAGES", "2000"))
+
+# Admission control (per endpoint class: chat = /message, ingest = uploads and URL ingestion)
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "8"))
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "32"))
+CHAT_MAX_QUEUE_SECONDS = float(os.getenv("CHAT_MAX_QUEUE_SECONDS", "10"))
+CHAT_PER_USER_LIMIT = int(os.getenv("CHAT_PER_USER_LIMIT", "2"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "2"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+INGEST_MAX_QUEUE_SECONDS = float(os.getenv("INGEST_MAX_QUEUE_SECONDS", "30"))
+INGEST_PER_USER_LIMIT = int(os.getenv("INGEST_PER_USER_LIMIT", "1"))
+
+# PDF uploads
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(100 * 1024 * 1024)))  # bytes per request
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "20"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+
+# Bulk URL ingestion
+CRAWL_EXTRACT_BATCH_SIZE = int(os.getenv("CRAWL_EXTRACT_BATCH_SIZE", "20"))
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))
+CRAWL_CACHE_TTL_SECONDS = int(os.getenv("CRAWL_CACHE_TTL_SECONDS", "86400"))
+CRAWL_MAX_URLS = int(os.getenv("CRAWL_MAX_URLS", "200"))
+CRAWL_MAX_REDIRECTS = int(os.getenv("CRAWL_MAX_REDIRECTS", "5"))  # when the server fetches user URLs itself (validators, sitemaps)
+CRAWL_MAX_RESPONSE_BYTES = int(os.getenv("CRAWL_MAX_RESPONSE_BYTES", str(10 * 1024 * 1024)))
+
+# CORS (first origin is the fallback sent to unknown origins)
+CORS_ALLOWED_ORIGINS = os.getenv(
+    "CORS_ALLOWED_ORIGINS",
+    "https://ragit.netlify.app,http://localhost:5173,http://127.0.0.1:5173"
+)
+CORS_MAX_AGE_SECONDS = int(os.getenv("CORS_MAX_AGE_SECONDS", "86400"))  # Chromium caps this at 7200
+
+# Vector storage layout: "per_user" (one Chroma directory per user) or
+# "shared" (one collection for everyone, filtered by user_id metadata)
+VECTORSTORE_MODE = os.getenv("VECTORSTORE_MODE", "per_user").lower()
+VECTORSTORES_DIR = os.getenv("VECTORSTORES_DIR", "db/vectorstores")  # per-user stores, relative to app/
+SHARED_VECTORSTORE_PATH = os.getenv("SHARED_VECTORSTORE_PATH", "db/vectorstores/shared")
+SHARED_COLLECTION_NAME = os.getenv("SHARED_COLLECTION_NAME", "ragit_chunks")
+CHROMA_CLIENT_RETIRE_SECONDS = int(os.getenv("CHROMA_CLIENT_RETIRE_SECONDS", "300"))  # old client kept after a store swap
+
+# Startup
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"
+
+# Chat history cache: "version" checks the user's history version on every read
+# (one primary-key lookup); "notify" also LISTENs for changes and skips that lookup
+# while the listener is connected
+HISTORY_CACHE_MAX_USERS = int(os.getenv("HISTORY_CACHE_MAX_USERS", "1000"))
+HISTORY_CACHE_INVALIDATION = os.getenv("HISTORY_CACHE_INVALIDATION", "version").lower()
+HISTORY_WINDOW_MESSAGES = int(os.getenv("HISTORY_WINDOW_MESSAGES", "20"))  # most recent messages sent with each prompt (0 = all)
+
+# Chat retention (0 disables a limit; nothing is deleted unless RETENTION_ENABLED, but the
+# job still creates the monthly partitions of a partitioned chats table)
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() == "true"
+RETENTION_MAX_MESSAGES_PER_USER = int(os.getenv("RETENTION_MAX_MESSAGES_PER_USER", "5000"))
+RETENTION_MAX_AGE_DAYS = int(os.getenv("RETENTION_MAX_AGE_DAYS", "0"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.05"))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+CHATS_PARTITIONS_AHEAD = int(os.getenv("CHATS_PARTITIONS_AHEAD", "2"))  # monthly partitions created in advance
+
+# Prewarm on login: load the user's store, history and chain in the background
+# so the first chat turn after login takes the warm path
+PREWARM_ON_LOGIN = os.getenv("PREWARM_ON_LOGIN", "true").lower() == "true"
+PREWARM_WORKERS = int(os.getenv("PREWARM_WORKERS", "2"))
+PREWARM_MAX_PENDING = int(os.getenv("PREWARM_MAX_PENDING", "32"))  # further logins are not prewarmed
+CHAIN_CACHE_MAX_USERS = int(os.getenv("CHAIN_CACHE_MAX_USERS", "256"))
+
+# Sampling profiler (profiling.py); nothing is registered unless PROFILING_ENABLED.
+# Requests carrying X-Profile-Token: <PROFILING_TOKEN> are profiled, as are a
+# PROFILING_SAMPLE_RATE fraction of /message and upload requests
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")  # relative to app/
+PROFILING_MAX_WINDOW_SECONDS = float(os.getenv("PROFILING_MAX_WINDOW_SECONDS", "120"))
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "200"))  # newest profiles kept on disk
+
+# Sharding (sharding.py, router.py): SHARD_NODES="a=http://10.0.0.1:8123,b=http://10.0.0.2:8123"
+# places users on nodes by consistent hashing; each node sets its own NODE_NAME
+# (and a VECTORSTORES_DIR of its own when several run from one checkout).
+# Empty SHARD_NODES = a single node serving everyone.
+SHARD_NODES = os.getenv("SHARD_NODES", "")
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "128"))  # ring points per node
+NODE_NAME = os.getenv("NODE_NAME", "")
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")  # node-to-node endpoints (/internal/...) are off without it
+PORT = int(os.getenv("PORT", "8123"))
+ROUTER_PORT = int(os.getenv("ROUTER_PORT", "8080"))
+ROUTER_TIMEOUT_SECONDS = float(os.getenv("ROUTER_TIMEOUT_SECONDS", "300"))
+
+# Outbound API quotas (quota.py), shared by every worker process on the machine.
+# Per-minute limits per deployment; 0 = not limited. Interactive calls (chat,
+# query embeddings) may use the whole bucket, background calls (ingestion
+# embeddings, Tavily) stop at QUOTA_INTERACTIVE_RESERVE of it.
+QUOTA_CHAT_TPM = int(os.getenv("QUOTA_CHAT_TPM", "0"))
+QUOTA_CHAT_RPM = int(os.getenv("QUOTA_CHAT_RPM", "0"))
+QUOTA_SECONDARY_CHAT_TPM = int(os.getenv("QUOTA_SECONDARY_CHAT_TPM", "0"))
+QUOTA_SECONDARY_CHAT_RPM = int(os.getenv("QUOTA_SECONDARY_CHAT_RPM", "0"))
+QUOTA_EMBEDDINGS_TPM = int(os.getenv("QUOTA_EMBEDDINGS_TPM", "0"))
+QUOTA_EMBEDDINGS_RPM = int(os.getenv("QUOTA_EMBEDDINGS_RPM", "0"))
+QUOTA_TAVILY_RPM = int(os.getenv("QUOTA_TAVILY_RPM", "0"))
+QUOTA_INTERACTIVE_RESERVE = float(os.getenv("QUOTA_INTERACTIVE_RESERVE", "0.2"))
+QUOTA_COMPLETION_TOKENS = int(os.getenv("QUOTA_COMPLETION_TOKENS", "800"))  # charged up front per chat call, settled from usage
+QUOTA_MAX_WAIT_SECONDS = float(os.getenv("QUOTA_MAX_WAIT_SECONDS", "120"))  # background calls; chat waits within its budget
+QUOTA_SHARED_PATH = os.getenv("QUOTA_SHARED_PATH", "")  # default /dev/shm/ragit_quota; "off" = per process
+
 ####################################### ONLY NEEDED IF STORING IN AZURE DATA LAKE STORAGE #######################################
  
 # STORAGE_ACCOUNT_NAME = os.getenv("STORAGE_ACCOUNT_NAME")
@@ -0,0 +1,159 @@
+import re
+from typing import Optional, Sequence
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+
+from tokens import count_tokens
+
+# Formatting noise added by convert_PDF_to_markdown and common in crawled pages
+_PAGE_HEADER_RE = re.compile(r"^\s*#{1,6}\s*Page\s+\d+\s*$", re.MULTILINE)
+_IMAGE_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_RULE_RE = re.compile(r"^\s*([-=*_])\1{2,}\s*$", re.MULTILINE)
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+\n")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_INLINE_SPACE_RE = re.compile(r"[ \t]{2,}")
+
+_BLOCK_RE = re.compile(r"\n\s*\n")
+_ITEM_START_RE = re.compile(r"^\s*(?:[-*#>]|\d+[.)])\s")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_WORD_RE = re.compile(r"\w+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from had has have how i if in into is it its
+me my no not of on or our so than that the their them then there these they this to up us
+was we were what when where which who why will with you your
+""".split())
+
+
+def clean_text(text):
+    """Strip page headers, image links, rules and redundant whitespace"""
+    text = _PAGE_HEADER_RE.sub("", text)
+    text = _IMAGE_RE.sub("", text)
+    text = _RULE_RE.sub("", text)
+    text = _TRAILING_SPACE_RE.sub("\n", text)
+    text = _INLINE_SPACE_RE.sub(" ", text)
+    text = _BLANK_LINES_RE.sub("\n\n", text)
+    return text.strip()
+
+
+def split_sentences(text):
+    """
+    Split into sentences. Hard-wrapped lines (as PyMuPDF emits them) are joined,
+    while list items and headings stay separate.
+    """
+    sentences = []
+    for block in _BLOCK_RE.split(text):
+        lines = []
+        for line in block.split("\n"):
+            if not line.strip():
+                continue
+            if lines and not _ITEM_START_RE.match(line):
+                lines[-1] = f"{lines[-1]} {line.strip()}"
+            else:
+                lines.append(line.strip())
+        for line in lines:
+            sentences.extend(part for part in _SENTENCE_RE.split(line) if part.strip())
+    return sentences
+
+
+def content_terms(text):
+    return {word for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS}
+
+
+def strip_overlap(kept, current, min_overlap=40, max_overlap=400):
+    """
+    Remove the region of `current` that duplicates `kept` because both chunks
+    came from the same chunk_overlap window (in either order)
+    """
+    limit = min(len(kept), len(current), max_overlap)
+    for size in range(limit, min_overlap - 1, -1):
+        if kept.endswith(current[:size]):
+            return current[size:].lstrip()
+        if current.endswith(kept[:size]):
+            return current[:-size].rstrip()
+    return current
+
+
+class ContextCompressor(BaseDocumentCompressor):
+    """
+    Shrink retrieved chunks before they are stuffed into the QA prompt.
+
+    1. clean formatting noise (PDF page headers, line-break padding, images)
+    2. drop regions duplicated between overlapping chunks of the same source
+    3. drop sentences with low overlap with the question (neighbours of
+       matching sentences are kept for continuity)
+    4. enforce a token budget across all chunks, best-ranked first
+    """
+
+    token_budget: int = 1500
+    min_sentence_overlap: float = 0.15
+    neighbour_window: int = 1
+
+    def _select_sentences(self, sentences, query_terms):
+        if not query_terms:
+            return sentences
+
+        scores = [
+            len(query_terms & content_terms(sentence)) / len(query_terms)
+            for sentence in sentences
+        ]
+        keep = set()
+        for i, score in enumerate(scores):
+            if score >= self.min_sentence_overlap:
+                keep.update(range(max(0, i - self.neighbour_window), min(len(sentences), i + self.neighbour_window + 1)))
+
+        if not keep:
+            # The chunk was retrieved for a reason; keep its best sentences
+            best = sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True)[:2]
+            keep.update(best)
+
+        return [sentences[i] for i in sorted(keep)]
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        query_terms = content_terms(query)
+        seen_sentences = set()
+        kept_by_source = {}
+        compressed = []
+        remaining = self.token_budget
+
+        for doc in documents:
+            if remaining <= 0:
+                break
+
+            text = clean_text(doc.page_content)
+            source = doc.metadata.get("source")
+            for kept_text in kept_by_source.get(source, []):
+                text = strip_overlap(kept_text, text)
+
+            sentences = []
+            for sentence in split_sentences(text):
+                sentence = sentence.strip()
+                normalised = " ".join(sentence.lower().split())
+                if sentence and normalised not in seen_sentences:
+                    sentences.append(sentence)
+            sentences = self._select_sentences(sentences, query_terms) if sentences else []
+
+            kept = []
+            for sentence in sentences:
+                tokens = count_tokens(sentence)
+                if tokens > remaining:
+                    break
+                kept.append(sentence)
+                remaining -= tokens
+                seen_sentences.add(" ".join(sentence.lower().split()))
+
+            if kept:
+                kept_by_source.setdefault(source, []).append(clean_text(doc.page_content))
+                compressed.append(Document(
+                    id=getattr(doc, "id", None),
+                    page_content="\n".join(kept),
+                    metadata=doc.metadata
+                ))
+
+        return compressed
@@ -0,0 +1,52 @@
+from flask import current_app, request
+
+from config import CORS_ALLOWED_ORIGINS, CORS_MAX_AGE_SECONDS
+
+# Computed once at import; lookups per request are a frozenset membership test
+ALLOWED_ORIGINS = tuple(o.strip() for o in CORS_ALLOWED_ORIGINS.split(",") if o.strip())
+_allowed_origin_set = frozenset(ALLOWED_ORIGINS)
+DEFAULT_ORIGIN = ALLOWED_ORIGINS[0]
+
+ALLOWED_METHODS = "GET, POST, PUT, DELETE, OPTIONS"
+ALLOWED_HEADERS = "Content-Type, Authorization"
+EXPOSED_HEADERS = "Server-Timing, Retry-After"
+
+
+def get_cors_origin():
+    """Get appropriate CORS origin based on request"""
+    origin = request.headers.get('Origin')
+    if origin in _allowed_origin_set:
+        return origin
+    # Default fallback
+    return DEFAULT_ORIGIN
+
+
+def answer_preflight():
+    """
+    before_request hook: answer OPTIONS requests before routing and auth run.
+    Access-Control-Max-Age lets the browser cache the result, so the preflight
+    round trip is paid once per endpoint per session instead of per call.
+    """
+    if request.method != 'OPTIONS':
+        return None
+
+    response = current_app.response_class(status=204)
+    response.headers['Access-Control-Allow-Methods'] = ALLOWED_METHODS
+    response.headers['Access-Control-Allow-Headers'] = ALLOWED_HEADERS
+    response.headers['Access-Control-Max-Age'] = str(CORS_MAX_AGE_SECONDS)
+    return response
+
+
+def add_cors_headers(response):
+    """after_request hook: CORS headers for every response, including errors"""
+    response.headers['Access-Control-Allow-Origin'] = get_cors_origin()
+    response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.headers['Access-Control-Expose-Headers'] = EXPOSED_HEADERS
+    response.vary.add('Origin')
+    return response
+
+
+def init_cors(app):
+    # Run ahead of every other before_request hook
+    app.before_request_funcs.setdefault(None, []).insert(0, answer_preflight)
+    app.after_request(add_cors_headers)
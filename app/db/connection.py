@@ -1,6 +1,7 @@
 import psycopg2
 import psycopg2.extras
 import os 
+import threading
 from dotenv import load_dotenv
 from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
 
@@ -9,6 +10,30 @@ load_dotenv()
 # Global connection variable
 connection = None
 cursor = None
+# The cursor is shared, so execute + fetch must not interleave across threads
+_query_lock = threading.Lock()
+
+def create_connection():
+    """Open a new autocommit connection (background jobs use their own)"""
+    conn = psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        cursor_factory=psycopg2.extras.RealDictCursor,
+        sslmode='require'  # Required for Supabase
+    )
+    
+    # Option 2: Using connection string (alternative)
+    # conn = psycopg2.connect(
+    #     DATABASE_URL,
+    #     cursor_factory=psycopg2.extras.RealDictCursor,
+    #     sslmode='require'
+    # )
+    
+    conn.autocommit = True
+    return conn
 
 def get_db_connection():
     """Get database connection with error handling"""
@@ -16,25 +41,7 @@ def get_db_connection():
     
     try:
         if connection is None or connection.closed:
-            # Option 1: Using individual parameters
-            connection = psycopg2.connect(
-                dbname=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD,
-                host=DB_HOST,
-                port=DB_PORT,
-                cursor_factory=psycopg2.extras.RealDictCursor,
-                sslmode='require'  # Required for Supabase
-            )
-            
-            # Option 2: Using connection string (alternative)
-            # connection = psycopg2.connect(
-            #     DATABASE_URL,
-            #     cursor_factory=psycopg2.extras.RealDictCursor,
-            #     sslmode='require'
-            # )
-            
-            connection.autocommit = True
+            connection = create_connection()
             cursor = connection.cursor()
             print(f"⚡ Connected to Supabase DB: {connection.get_dsn_parameters()['dbname']}")
             
@@ -44,23 +51,30 @@ def get_db_connection():
         print(f"❌ Database connection error: {e}")
         return None, None
 
-def execute_query(query, params=None, fetch_one=False, fetch_all=False):
-    """Execute a query with error handling and return results"""
+def execute_query(query, params=None, fetch_one=False, fetch_all=False, raise_errors=False):
+    """Execute a query with error handling and return results
+
+    With raise_errors=True, database errors (e.g. constraint violations) are
+    re-raised so the caller can react to them instead of getting None.
+    """
     try:
-        conn, cur = get_db_connection()
-        if not conn or not cur:
-            return None
+        with _query_lock:
+            conn, cur = get_db_connection()
+            if not conn or not cur:
+                return None
+                
+            cur.execute(query, params)
             
-        cur.execute(query, params)
-        
-        if fetch_one:
-            return cur.fetchone()
-        elif fetch_all:
-            return cur.fetchall()
-        else:
-            return cur.rowcount  # For INSERT/UPDATE/DELETE
+            if fetch_one:
+                return cur.fetchone()
+            elif fetch_all:
+                return cur.fetchall()
+            else:
+                return cur.rowcount  # For INSERT/UPDATE/DELETE
             
     except psycopg2.Error as e:
+        if raise_errors:
+            raise
         print(f"❌ Query execution error: {e}")
         return None
 
@@ -7,6 +7,31 @@ def create_new_chat_message_query():
     RETURNING id;
     """
 
+# Appends after the user's last message and bumps their history version in one
+# statement; the notification tells other workers to drop their cached copy
+def append_chat_message_query():
+    return """
+    WITH next_order AS (
+        SELECT COALESCE(MAX(message_order), 0) + 1 as message_order
+        FROM chats 
+        WHERE user_id = %s
+    ), inserted AS (
+        INSERT INTO chats (user_id, message_text, sender, message_order, created_at)
+        SELECT %s, %s, %s, message_order, NOW()
+        FROM next_order
+        RETURNING id, message_order
+    ), bumped AS (
+        INSERT INTO chat_history_versions (user_id, version, updated_at)
+        VALUES (%s, 1, NOW())
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = chat_history_versions.version + 1, updated_at = NOW()
+        RETURNING version
+    )
+    SELECT inserted.id, inserted.message_order, bumped.version,
+           pg_notify('chat_history', %s::text || ':' || bumped.version)
+    FROM inserted, bumped;
+    """
+
 def create_multiple_chat_messages_query():
     return """
     INSERT INTO chats (user_id, message_text, sender, message_order, created_at)
@@ -24,6 +49,22 @@ def get_all_chats_by_user_query():
     ORDER BY message_order ASC
     """
 
+# The version and the rows in one statement, so both come from the same
+# snapshot (a write landing between two reads would be cached under the
+# old version and appended again by apply_write). A user without messages
+# gets one row with NULL sender.
+def get_chat_history_with_version_query():
+    return """
+    SELECT v.version, c.sender, c.message_text
+    FROM (
+        SELECT COALESCE(
+            (SELECT version FROM chat_history_versions WHERE user_id = %s), 0
+        ) as version
+    ) v
+    LEFT JOIN chats c ON c.user_id = %s
+    ORDER BY c.message_order ASC
+    """
+
 def get_recent_chats_by_user_query():
     return """
     SELECT id, user_id, message_text, sender, created_at, message_order
@@ -40,6 +81,13 @@ def get_chat_count_by_user_query():
     WHERE user_id = %s
     """
 
+def get_chat_history_version_query():
+    return """
+    SELECT COALESCE(
+        (SELECT version FROM chat_history_versions WHERE user_id = %s), 0
+    ) as version
+    """
+
 def get_last_message_order_by_user_query():
     return """
     SELECT COALESCE(MAX(message_order), 0) as last_order
@@ -49,6 +97,41 @@ def get_last_message_order_by_user_query():
 
 ## UPDATE
 
+def bump_chat_history_version_query():
+    return """
+    WITH bumped AS (
+        INSERT INTO chat_history_versions (user_id, version, updated_at)
+        VALUES (%s, 1, NOW())
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = chat_history_versions.version + 1, updated_at = NOW()
+        RETURNING version
+    )
+    SELECT version, pg_notify('chat_history', %s::text || ':' || version)
+    FROM bumped;
+    """
+
+# A version never goes back below one workers may have cached (e.g. when a
+# restore replaces the user's rows); users that do not exist are skipped
+def raise_chat_history_version_query():
+    return """
+    INSERT INTO chat_history_versions (user_id, version, updated_at)
+    SELECT id, %s, NOW() FROM users WHERE id = %s
+    ON CONFLICT (user_id) DO UPDATE
+    SET version = GREATEST(chat_history_versions.version, EXCLUDED.version), updated_at = NOW()
+    """
+
+# After bulk deletes that touch many users (e.g. a dropped partition)
+def bump_all_chat_history_versions_query():
+    return """
+    WITH bumped AS (
+        UPDATE chat_history_versions
+        SET version = version + 1, updated_at = NOW()
+        RETURNING user_id
+    )
+    SELECT COUNT(*) as bumped, pg_notify('chat_history', '*')
+    FROM bumped;
+    """
+
 def update_chat_message_query():
     return """
     UPDATE chats 
@@ -70,15 +153,135 @@ def delete_all_chats_by_user_query():
     WHERE user_id = %s
     """
 
-def delete_old_chats_by_user_query():
+# Clears the history and bumps its version in one statement
+def clear_chats_by_user_query():
+    return """
+    WITH deleted AS (
+        DELETE FROM chats 
+        WHERE user_id = %s
+        RETURNING 1
+    ), bumped AS (
+        INSERT INTO chat_history_versions (user_id, version, updated_at)
+        VALUES (%s, 1, NOW())
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = chat_history_versions.version + 1, updated_at = NOW()
+        RETURNING version
+    )
+    SELECT (SELECT COUNT(*) FROM deleted) as deleted_count, bumped.version,
+           pg_notify('chat_history', %s::text || ':' || bumped.version)
+    FROM bumped;
+    """
+
+# Retention deletes walk message_order in bounded ranges on idx_chats_user_id_order
+# (keyset), instead of a NOT IN over the user's whole history
+def delete_chats_by_order_range_query():
     return """
     DELETE FROM chats 
     WHERE user_id = %s 
-    AND message_order NOT IN (
-        SELECT message_order 
+    AND message_order >= %s 
+    AND message_order < %s
+    """
+
+# Oldest rows first via idx_chats_created_at, at most %s rows per statement
+def delete_chats_older_than_batch_query():
+    return """
+    DELETE FROM chats 
+    WHERE created_at < %s 
+    AND id IN (
+        SELECT id 
         FROM chats 
-        WHERE user_id = %s 
-        ORDER BY message_order DESC 
+        WHERE created_at < %s 
+        ORDER BY created_at 
         LIMIT %s
     )
-    """
\ No newline at end of file
+    RETURNING user_id
+    """
+
+## RETENTION
+
+# The newest message_order past the per-user cap (None when under the cap)
+def get_retention_cutoff_order_query():
+    return """
+    SELECT message_order as cutoff_order
+    FROM chats 
+    WHERE user_id = %s 
+    ORDER BY message_order DESC 
+    OFFSET %s 
+    LIMIT 1
+    """
+
+def get_first_message_order_by_user_query():
+    return """
+    SELECT MIN(message_order) as first_order
+    FROM chats 
+    WHERE user_id = %s
+    """
+
+def get_user_ids_after_query():
+    return """
+    SELECT id 
+    FROM users 
+    WHERE id > %s 
+    ORDER BY id 
+    LIMIT %s
+    """
+
+## PARTITIONS
+
+def get_chats_is_partitioned_query():
+    return """
+    SELECT EXISTS (
+        SELECT 1 
+        FROM pg_partitioned_table pt 
+        JOIN pg_class c ON c.oid = pt.partrelid 
+        WHERE c.relname = 'chats' AND pg_table_is_visible(c.oid)
+    ) as partitioned
+    """
+
+def get_chats_partitions_query():
+    return """
+    SELECT child.relname as partition_name
+    FROM pg_inherits i 
+    JOIN pg_class parent ON parent.oid = i.inhparent 
+    JOIN pg_class child ON child.oid = i.inhrelid 
+    WHERE parent.relname = 'chats' AND pg_table_is_visible(parent.oid)
+    ORDER BY child.relname
+    """
+
+# Partition names are generated by retention.partition_name, never user input
+def create_chats_partition_query(partition_name):
+    return f"""
+    CREATE TABLE IF NOT EXISTS {partition_name} 
+    PARTITION OF chats 
+    FOR VALUES FROM (%s) TO (%s)
+    """
+
+def get_partition_has_rows_between_query(partition_name):
+    return f"""
+    SELECT EXISTS (
+        SELECT 1 FROM {partition_name} 
+        WHERE created_at >= %s AND created_at < %s
+    ) as has_rows
+    """
+
+# One statement list, so it runs as a single transaction: a month's partition
+# cannot be created while the default partition holds rows of that month
+def create_chats_partition_from_default_query(partition_name, default_name):
+    return f"""
+    ALTER TABLE chats DETACH PARTITION {default_name};
+    CREATE TABLE {partition_name} 
+    PARTITION OF chats 
+    FOR VALUES FROM (%(start)s) TO (%(end)s);
+    INSERT INTO {partition_name} 
+    SELECT * FROM {default_name} 
+    WHERE created_at >= %(start)s AND created_at < %(end)s;
+    DELETE FROM {default_name} 
+    WHERE created_at >= %(start)s AND created_at < %(end)s;
+    ALTER TABLE chats ATTACH PARTITION {default_name} DEFAULT;
+    """
+
+def drop_chats_partition_query(partition_name):
+    return f"""
+    ALTER TABLE chats DETACH PARTITION {partition_name};
+    DROP TABLE {partition_name};
+    """
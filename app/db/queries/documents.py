@@ -0,0 +1,66 @@
+## CREATE / UPDATE
+
+# One row per (user, source); re-ingesting a source replaces its chunk ids
+def upsert_document_query():
+    return """
+    INSERT INTO documents (user_id, source, source_type, content_hash, chunk_ids, chunk_count, size_bytes, file_path, ingested_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+    ON CONFLICT (user_id, source) DO UPDATE
+    SET source_type = EXCLUDED.source_type,
+        content_hash = EXCLUDED.content_hash,
+        chunk_ids = EXCLUDED.chunk_ids,
+        chunk_count = EXCLUDED.chunk_count,
+        size_bytes = EXCLUDED.size_bytes,
+        file_path = EXCLUDED.file_path,
+        updated_at = NOW()
+    RETURNING id;
+    """
+
+## READ
+
+def get_documents_by_user_query():
+    return """
+    SELECT id, source, source_type, content_hash, chunk_count, size_bytes, ingested_at, updated_at
+    FROM documents
+    WHERE user_id = %s
+    ORDER BY ingested_at DESC
+    """
+
+def get_document_by_id_query():
+    return """
+    SELECT id, user_id, source, source_type, content_hash, chunk_ids, chunk_count, size_bytes, file_path, ingested_at, updated_at
+    FROM documents
+    WHERE id = %s AND user_id = %s
+    """
+
+def get_document_by_source_query():
+    return """
+    SELECT id, user_id, source, source_type, content_hash, chunk_ids, chunk_count, size_bytes, file_path, ingested_at, updated_at
+    FROM documents
+    WHERE user_id = %s AND source = %s
+    """
+
+def get_document_by_hash_query():
+    return """
+    SELECT id, user_id, source, source_type, content_hash, chunk_ids, chunk_count, size_bytes, file_path, ingested_at, updated_at
+    FROM documents
+    WHERE user_id = %s AND content_hash = %s
+    ORDER BY ingested_at
+    LIMIT 1
+    """
+
+def count_documents_by_file_path_query():
+    return """
+    SELECT COUNT(*) AS document_count
+    FROM documents
+    WHERE file_path = %s
+    """
+
+## DELETE
+
+def delete_document_query():
+    return """
+    DELETE FROM documents
+    WHERE id = %s AND user_id = %s
+    RETURNING id, source, chunk_ids, file_path
+    """
@@ -6,6 +6,28 @@ def create_new_user_query():
     RETURNING id;
     """
 
+# Creates the user, derives vectorstore_path from the new id and seeds the
+# greeting message in one statement (one round trip, one transaction).
+# Duplicates surface as UNIQUE violations on users_username_key / users_email_key.
+def register_user_query():
+    return """
+    WITH new_id AS (
+        SELECT nextval(pg_get_serial_sequence('users', 'id')) AS id
+    ),
+    new_user AS (
+        INSERT INTO users (id, username, email, password_hash, vectorstore_path, created_at, updated_at)
+        SELECT id, %s, %s, %s, 'db/vectorstores/user_' || id || '_vectorstore', NOW(), NOW()
+        FROM new_id
+        RETURNING id, vectorstore_path
+    ),
+    greeting AS (
+        INSERT INTO chats (user_id, message_text, sender, message_order, created_at)
+        SELECT id, %s, 'bot', 1, NOW()
+        FROM new_user
+    )
+    SELECT id, vectorstore_path FROM new_user;
+    """
+
 ## READ
 def get_all_users_query():
     return """
@@ -0,0 +1,7 @@
+-- One row per user, bumped in the same statement as every chat write or clear.
+-- Workers compare it against their cached copy of the history (history_cache.py).
+CREATE TABLE IF NOT EXISTS chat_history_versions (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
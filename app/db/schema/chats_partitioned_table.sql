@@ -0,0 +1,27 @@
+-- Alternative to chats_table.sql: the same table partitioned by month on created_at,
+-- so retention can drop whole months instead of deleting rows.
+-- Existing databases are converted with `python -m tools.partition_chats`;
+-- monthly partitions are created ahead of time by the retention job (retention.py).
+
+-- Shared with the unpartitioned table, so ids keep counting up after a migration
+CREATE SEQUENCE IF NOT EXISTS chats_id_seq;
+
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER NOT NULL DEFAULT nextval('chats_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    message_text TEXT NOT NULL,
+    sender VARCHAR(10) NOT NULL CHECK (sender IN ('user', 'bot')),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    message_order INTEGER NOT NULL,
+    -- The partition key must be part of every unique constraint
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE chats_id_seq OWNED BY chats.id;
+
+-- Catches rows outside the prepared months; kept empty by creating partitions ahead
+CREATE TABLE IF NOT EXISTS chats_default PARTITION OF chats DEFAULT;
+
+-- Create index for faster queries (created on every partition)
+CREATE INDEX IF NOT EXISTS idx_chats_user_id_order ON chats (user_id, message_order);
+CREATE INDEX IF NOT EXISTS idx_chats_created_at ON chats (created_at);
@@ -0,0 +1,19 @@
+CREATE TABLE IF NOT EXISTS documents (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    source_type VARCHAR(10) NOT NULL CHECK (source_type IN ('pdf', 'url')),
+    content_hash CHAR(64),
+    chunk_ids TEXT[] NOT NULL DEFAULT '{}',
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    size_bytes BIGINT,
+    file_path TEXT,
+    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, source)
+);
+
+-- Create index for listing a user's documents, newest first
+CREATE INDEX IF NOT EXISTS idx_documents_user_ingested ON documents (user_id, ingested_at DESC);
+-- Create index for finding content a user already uploaded (upload short-circuit)
+CREATE INDEX IF NOT EXISTS idx_documents_user_hash ON documents (user_id, content_hash);
@@ -0,0 +1,246 @@
+"""
+Chat history cache shared by the request path and the RAG chain.
+
+Each user's history has a version in chat_history_versions, bumped in the
+same statement as every chat write or clear (db/queries/chats.py). A cached
+copy is served only while its version is current, so several workers can
+cache the same users without answering from stale context:
+
+- "version" mode reads the version on every lookup (a primary-key lookup,
+  much cheaper than reloading the history);
+- "notify" mode also LISTENs on the chat_history channel and drops entries as
+  other workers write, trusting the cache while the listener is connected and
+  falling back to version checks whenever it is not.
+
+Each entry is a ChatHistory: one role byte per message and the texts in a
+list, short texts interned (greetings and one-word replies repeat across
+users). The LRU holds at most max_users histories.
+"""
+import select
+import sys
+import threading
+from collections import OrderedDict
+
+from config import HISTORY_CACHE_MAX_USERS, HISTORY_CACHE_INVALIDATION
+from db.connection import create_connection, execute_query
+from db.queries.chats import get_chat_history_with_version_query, get_chat_history_version_query
+
+NOTIFY_CHANNEL = "chat_history"  # the channel the queries in db/queries/chats.py notify on
+SENDERS = ("user", "bot")  # role code -> sender
+ROLE_CODES = {sender: code for code, sender in enumerate(SENDERS)}
+INTERN_MAX_CHARS = 128  # longer texts are rarely repeated
+
+
+def _intern(text):
+    return sys.intern(text) if len(text) <= INTERN_MAX_CHARS else text
+
+
+class ChatHistory:
+    """
+    A user's messages as role codes plus texts. Never changed once built
+    (appended returns a new one), so callers can share it without copying.
+    Iterating yields (sender, text) tuples in message order.
+    """
+
+    __slots__ = ("roles", "texts")
+
+    def __init__(self, roles=None, texts=None):
+        self.roles = roles if roles is not None else bytearray()
+        self.texts = texts if texts is not None else []
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Build from (sender, text) pairs"""
+        history = cls()
+        for sender, text in messages:
+            history.roles.append(ROLE_CODES[sender])
+            history.texts.append(_intern(text))
+        return history
+
+    def appended(self, sender, text):
+        roles = bytearray(self.roles)
+        roles.append(ROLE_CODES[sender])
+        return ChatHistory(roles, self.texts + [_intern(text)])
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        return SENDERS[self.roles[index]], self.texts[index]
+
+    def __iter__(self):
+        return zip(map(SENDERS.__getitem__, self.roles), self.texts)
+
+    def window(self, size, end=None):
+        """(sender, text) for the `size` messages before `end` (all of them when size is 0)"""
+        end = len(self) if end is None else end
+        start = max(0, end - size) if size else 0
+        return [(SENDERS[self.roles[i]], self.texts[i]) for i in range(start, end)]
+
+
+class HistoryCache:
+    def __init__(self, max_users=HISTORY_CACHE_MAX_USERS):
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> (version, ChatHistory)
+        self._loading = {}  # user_id -> changed while loading (notify mode)
+        self._lock = threading.Lock()
+        self._listening = False
+        self._listener = None
+        self._stop = threading.Event()
+        self._stats = {"hits": 0, "misses": 0, "version_checks": 0, "invalidations": 0, "evictions": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _store(self, user_id, version, messages):
+        with self._lock:
+            current = self._entries.get(user_id)
+            # A concurrent load or write may already have stored something newer
+            if current is not None and current[0] > version:
+                return
+            self._entries[user_id] = (version, messages)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get(self, user_id):
+        """The user's ChatHistory, from cache when current"""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._listening:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+
+        if entry is not None:
+            self._count("version_checks")
+            version = self.current_version(user_id)
+            if version == entry[0]:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                return entry[1]
+
+        with self._lock:
+            self._stats["misses"] += 1
+            self._loading[key] = False
+        # One statement, so the version is exactly the one of the rows read
+        rows = execute_query(get_chat_history_with_version_query(), params=(user_id, user_id), fetch_all=True) or []
+        version = rows[0]["version"] if rows else 0
+        history = ChatHistory.from_messages(
+            (row["sender"], row["message_text"]) for row in rows if row["sender"] is not None
+        )
+        with self._lock:
+            changed = self._loading.pop(key, False)
+        # A notification that raced the load would otherwise be lost
+        if not changed:
+            self._store(key, version, history)
+        return history
+
+    def current_version(self, user_id):
+        result = execute_query(get_chat_history_version_query(), params=(user_id,), fetch_one=True)
+        return result["version"] if result else -1
+
+    def apply_write(self, user_id, version, message=None):
+        """
+        Record a write this worker just made (version is what the write
+        returned, message its (sender, text)). The cached copy is extended
+        when it was exactly one version behind, and dropped otherwise.
+        """
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] >= version:
+                return
+            if message is not None and entry[0] == version - 1:
+                self._entries[key] = (version, entry[1].appended(*message))
+            else:
+                del self._entries[key]
+                self._stats["invalidations"] += 1
+
+    def invalidate(self, user_id=None, version=None):
+        """Drop one user's entry (only if older than version, when given), or everything"""
+        with self._lock:
+            if user_id is None:
+                self._stats["invalidations"] += len(self._entries)
+                self._entries.clear()
+                for key in self._loading:
+                    self._loading[key] = True
+                return
+            key = str(user_id)
+            if key in self._loading:
+                self._loading[key] = True
+            entry = self._entries.get(key)
+            if entry is not None and (version is None or entry[0] < version):
+                del self._entries[key]
+                self._stats["invalidations"] += 1
+
+    def _on_notify(self, payload):
+        user_id, _, version = payload.partition(":")
+        if user_id == "*":
+            self.invalidate()
+        else:
+            self.invalidate(user_id, int(version) if version else None)
+
+    def _listen_loop(self):
+        backoff = 1
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = create_connection()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Anything could have changed while we were not listening
+                self.invalidate()
+                with self._lock:
+                    self._listening = True
+                print(f"⚡ History cache listening on {NOTIFY_CHANNEL}")
+                backoff = 1
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._on_notify(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"❌ History cache listener error: {e}")
+            finally:
+                with self._lock:
+                    self._listening = False
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def start_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._stop.clear()
+            self._listener = threading.Thread(target=self._listen_loop, name="history-listener", daemon=True)
+            self._listener.start()
+
+    def stop_listener(self):
+        self._stop.set()
+
+    def metrics(self):
+        with self._lock:
+            return {**self._stats, "users": len(self._entries), "listening": self._listening}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_history_cache():
+    """The process-wide history cache (starts the listener in "notify" mode)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HistoryCache()
+            if HISTORY_CACHE_INVALIDATION == "notify":
+                _cache.start_listener()
+        return _cache
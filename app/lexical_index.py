@@ -0,0 +1,258 @@
+import json
+import math
+import os
+import re
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from heapq import nlargest
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: single-process locking only
+    fcntl = None
+
+from config import LEXICAL_INDEX_MAX_STORES
+
+# Words, plus compound identifiers such as part numbers ("XR-200", "v1.2.3")
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+_PART_RE = re.compile(r"[-./]")
+
+INDEX_FILENAME = "lexical_index.jsonl"
+
+
+def tokenize(text):
+    """Lowercase word tokens; compound identifiers are kept whole and also split into parts"""
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        tokens.append(match)
+        if _PART_RE.search(match):
+            tokens.extend(part for part in _PART_RE.split(match) if part)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    Incrementally maintained BM25 inverted index for one user's chunks.
+
+    Persisted as an append-only JSONL log next to the Chroma store: adding or
+    removing chunks appends records instead of rewriting the whole index.
+    Several processes can share one log: appends and compaction hold an
+    flock on a lock file beside it, and each process reads what the others
+    appended (or reloads a log that was replaced) before searching or writing.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._reset()
+        self._refresh()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _reset(self):
+        self._postings = {}      # term -> {doc_id: term frequency}
+        self._doc_lengths = {}   # doc_id -> token count
+        self._docs = {}          # doc_id -> (text, metadata)
+        self._total_length = 0
+        self._tombstones = 0
+        self._head = None        # first line of the log read so far
+        self._offset = 0         # bytes of it applied
+        self.exists = False
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        """Apply records other processes appended; reload a log that was replaced or removed"""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            if self.exists:
+                self._reset()
+            return
+        with f:
+            # The log is recognised by its first line (a random generation for
+            # logs written since compaction added one): the path can be
+            # replaced at any time, and inode numbers are reused
+            size = os.fstat(f.fileno()).st_size
+            if self._head is None or size < self._offset or f.read(len(self._head)) != self._head:
+                self._reset()
+            self.exists = True
+            if size == self._offset:
+                return
+            f.seek(self._offset)
+            data = f.read()
+        # A record being written right now ends without a newline yet
+        complete = data[:data.rfind(b"\n") + 1]
+        if self._head is None and complete:
+            self._head = complete[:complete.index(b"\n") + 1]
+        for line in complete.decode("utf-8").splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._offset += len(complete)
+
+    def _apply(self, record):
+        if record["op"] == "add":
+            self._index(record["id"], record["text"], record.get("metadata") or {})
+        elif record["op"] == "remove":
+            self._unindex(record["id"])
+            self._tombstones += 1
+
+    @staticmethod
+    def _header():
+        return (json.dumps({"op": "log", "generation": uuid.uuid4().hex}) + "\n").encode("utf-8")
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive across processes (and, with self._lock, threads) while writing the log"""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, records):
+        # Called under _file_lock, after _refresh: the log ends where we stopped reading
+        with open(self.path, "ab") as f:
+            if self._head is None:
+                self._head = self._header()
+                f.write(self._head)
+            for record in records:
+                f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            self._offset = f.tell()
+        self.exists = True
+
+    def _index(self, doc_id, text, metadata):
+        if doc_id in self._docs:
+            return False
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        length = sum(counts.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+        self._docs[doc_id] = (text, metadata)
+        return True
+
+    def _unindex(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return False
+        for term in set(tokenize(entry[0])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+        return True
+
+    def add_documents(self, ids, documents):
+        """Index new chunks (ids as returned by the vectorstore) and persist them"""
+        with self._file_lock():
+            records = []
+            for doc_id, document in zip(ids, documents):
+                if self._index(doc_id, document.page_content, document.metadata):
+                    records.append({
+                        "op": "add",
+                        "id": doc_id,
+                        "text": document.page_content,
+                        "metadata": document.metadata
+                    })
+            if records:
+                self._append(records)
+            return len(records)
+
+    def remove(self, ids):
+        """Drop chunks from the index, compacting the log once it is mostly tombstones"""
+        with self._file_lock():
+            records = [{"op": "remove", "id": doc_id} for doc_id in ids if self._unindex(doc_id)]
+            if records:
+                self._append(records)
+                self._tombstones += len(records)
+                if self._tombstones > len(self._docs):
+                    self._compact()
+            return len(records)
+
+    def compact(self):
+        """Rewrite the log with only live chunks"""
+        with self._file_lock():
+            self._compact()
+
+    def _compact(self):
+        # Called under _file_lock, so no other process appends meanwhile
+        tmp_path = self.path + ".tmp"
+        head = self._header()
+        with open(tmp_path, "wb") as f:
+            f.write(head)
+            for doc_id, (text, metadata) in self._docs.items():
+                record = {"op": "add", "id": doc_id, "text": text, "metadata": metadata}
+                f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            size = f.tell()
+        os.replace(tmp_path, self.path)
+        self._head = head
+        self._offset = size
+        self._tombstones = 0
+
+    def search(self, query, k=10):
+        """Return up to k (doc_id, bm25 score) pairs, best first"""
+        with self._lock:
+            self._refresh()
+            doc_count = len(self._docs)
+            if not doc_count:
+                return []
+            avg_length = self._total_length / doc_count
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            return nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def get(self, doc_id):
+        """Return (text, metadata) for an indexed chunk, or None"""
+        return self._docs.get(doc_id)
+
+
+# One index per persist path per process, least recently used evicted first
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def forget_lexical_index(store_path):
+    """Drop the cached index of a directory that is being removed"""
+    with _indexes_lock:
+        _indexes.pop(os.path.join(store_path, INDEX_FILENAME), None)
+
+
+def get_lexical_index(store_path):
+    """Get the (cached) lexical index stored alongside a vectorstore directory"""
+    path = os.path.join(store_path, INDEX_FILENAME)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = LexicalIndex(path)
+            _indexes[path] = index
+            while len(_indexes) > LEXICAL_INDEX_MAX_STORES:
+                _indexes.popitem(last=False)
+            return index
+        _indexes.move_to_end(path)
+    # Pick up what other processes wrote since this one last looked
+    index.refresh()
+    return index
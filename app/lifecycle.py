@@ -0,0 +1,64 @@
+import threading
+import time
+
+from config import RERANK_ENABLED, RERANK_MODEL
+from db.connection import execute_query
+
+# cold -> warming -> ready (or failed, retried on the next start_warmup)
+_state = {"status": "cold", "error": None, "seconds": None}
+_lock = threading.Lock()
+
+
+def warmup():
+    """
+    Import the heavy modules and build the API clients so the first real
+    request does not pay for them. Safe to call more than once.
+    """
+    start = time.perf_counter()
+    try:
+        import rag_chain
+        import pdf_converter  # noqa: F401 (PyMuPDF)
+        import webcrawler
+        import llm
+
+        rag_chain.get_embeddings()
+        llm.get_deployments()
+        webcrawler.get_client()
+        if RERANK_ENABLED:
+            from reranker import get_cross_encoder
+            get_cross_encoder(RERANK_MODEL)
+    except Exception as e:
+        with _lock:
+            _state.update(status="failed", error=str(e))
+        print(f"❌ Warm-up failed: {e}")
+        raise
+
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _state.update(status="ready", error=None, seconds=round(elapsed, 3))
+    print(f"⚡ Warm-up finished in {elapsed:.2f}s")
+
+
+def _warmup_quietly():
+    try:
+        warmup()
+    except Exception:
+        pass
+
+
+def start_warmup():
+    """Run warmup() on a background thread unless it is running or done"""
+    with _lock:
+        if _state["status"] in ("warming", "ready"):
+            return
+        _state["status"] = "warming"
+    threading.Thread(target=_warmup_quietly, name="warmup", daemon=True).start()
+
+
+def readiness():
+    """(ready, details): warm-up finished and the database answers"""
+    with _lock:
+        details = dict(_state)
+    database_ok = execute_query("SELECT 1 AS ok", fetch_one=True) is not None
+    details["database"] = "ok" if database_ok else "unavailable"
+    return details["status"] == "ready" and database_ok, details
@@ -0,0 +1,280 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from timing import time_stage, record_stage
+from tokens import count_tokens
+from quota import get_quota, chat_key, is_rate_limited, retry_after_seconds, QuotaWaitExceeded, INTERACTIVE
+from config import (
+    AZURE_OPENAI_ENDPOINT,
+    AZURE_OPENAI_DEPLOYMENT_NAME,
+    AZURE_OPENAI_API_KEY,
+    AZURE_OPENAI_SECONDARY_ENDPOINT,
+    AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME,
+    AZURE_OPENAI_SECONDARY_API_KEY,
+    AZURE_OPENAI_SECONDARY_MODEL,
+    LLM_TIMEOUT_SECONDS,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_DELAY_SECONDS,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_DELAY_SECONDS,
+    LLM_CONTEXTUALIZE_ON_SECONDARY,
+    LLM_OVERFLOW_IN_FLIGHT,
+    QUOTA_COMPLETION_TOKENS
+)
+
+_retryable_errors = None
+
+
+def retryable_errors():
+    # openai is imported on first LLM call, not when the server starts
+    global _retryable_errors
+    if _retryable_errors is None:
+        import openai
+        _retryable_errors = (
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+            TimeoutError,
+        )
+    return _retryable_errors
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The request's latency budget ran out before the LLM answered"""
+
+
+class LLMUnavailable(Exception):
+    """Every attempt failed with a retryable error; try again after retry_after seconds"""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Absolute deadline (time.monotonic()) for the current request, if any
+_deadline = ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def latency_budget(seconds):
+    """Give every LLM call made inside the block a share of one overall deadline"""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget():
+    """Seconds left before the current request's deadline (None when unbounded)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def estimate_tokens(messages):
+    """Prompt tokens of a chat call plus the completion allowance, for the quota"""
+    if hasattr(messages, "to_messages"):
+        messages = messages.to_messages()
+    if isinstance(messages, str):
+        return count_tokens(messages) + QUOTA_COMPLETION_TOKENS
+    # About 4 tokens of framing per message
+    return sum(count_tokens(str(message.content)) + 4 for message in messages) + QUOTA_COMPLETION_TOKENS
+
+
+class Deployment:
+    """One Azure chat deployment plus the latency statistics used for hedging"""
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.quota_key = chat_key(name)
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def p95(self):
+        with self._lock:
+            if len(self._latencies) < 20:
+                return None
+            ordered = sorted(self._latencies)
+            return ordered[int(len(ordered) * 0.95) - 1]
+
+    def _take_quota(self, messages, timeout):
+        """Charge the deployment's shared quota; returns (tokens charged, seconds left for the call)"""
+        quota = get_quota()
+        if not quota.is_limited(self.quota_key):
+            return None, timeout
+        charged = estimate_tokens(messages)
+        try:
+            waited = quota.acquire(self.quota_key, charged, priority=INTERACTIVE, max_wait=timeout)
+        except QuotaWaitExceeded as e:
+            record_stage("quota_wait", e.waited * 1000)
+            # A timeout like any other: retried on the other deployment while the budget lasts
+            raise LLMDeadlineExceeded(str(e)) from e
+        if waited:
+            record_stage("quota_wait", waited * 1000)
+        return charged, timeout - waited
+
+    def invoke(self, messages, timeout):
+        charged, timeout = self._take_quota(messages, timeout)
+        with self._lock:
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            result = self.model.invoke(messages, timeout=timeout)
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+            if charged is not None:
+                usage = getattr(result, "usage_metadata", None) or {}
+                get_quota().settle(self.quota_key, charged, usage.get("total_tokens"))
+            return result
+        except Exception as e:
+            if charged is not None and is_rate_limited(e):
+                get_quota().throttle(self.quota_key, retry_after_seconds(e))
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _build_deployment(endpoint, api_key, deployment_name, model_name):
+    from langchain_openai import AzureChatOpenAI
+
+    return Deployment(deployment_name, AzureChatOpenAI(
+        azure_endpoint=endpoint,
+        api_key=api_key,
+        api_version="2024-05-01-preview",
+        azure_deployment=deployment_name,
+        model=model_name,
+        timeout=LLM_TIMEOUT_SECONDS,
+        max_retries=0  # Retries are handled here, within the request's budget
+    ))
+
+
+# Built on first use (or by lifecycle.warmup) so importing this module stays cheap
+_deployments = None
+_deployments_lock = threading.Lock()
+
+
+def get_deployments():
+    """(primary, secondary) deployments; secondary is None when not configured"""
+    global _deployments
+    if _deployments is None:
+        with _deployments_lock:
+            if _deployments is None:
+                primary = _build_deployment(AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY, AZURE_OPENAI_DEPLOYMENT_NAME, "gpt-4o")
+                secondary = None
+                if AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME:
+                    secondary = _build_deployment(
+                        AZURE_OPENAI_SECONDARY_ENDPOINT or AZURE_OPENAI_ENDPOINT,
+                        AZURE_OPENAI_SECONDARY_API_KEY or AZURE_OPENAI_API_KEY,
+                        AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME,
+                        AZURE_OPENAI_SECONDARY_MODEL
+                    )
+                _deployments = (primary, secondary)
+    return _deployments
+
+# Hedged duplicates run here; abandoned calls finish in the background, bounded by their timeout
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+
+def route(stage):
+    """Pick (first choice, fallback) deployments for a chain stage"""
+    primary, secondary = get_deployments()
+    if secondary is None:
+        return primary, primary
+    if stage == "contextualize" and LLM_CONTEXTUALIZE_ON_SECONDARY:
+        return secondary, primary
+    if LLM_OVERFLOW_IN_FLIGHT and primary.in_flight >= LLM_OVERFLOW_IN_FLIGHT:
+        return secondary, primary
+    return primary, secondary
+
+
+def _call_timeout():
+    remaining = remaining_budget()
+    if remaining is None:
+        return LLM_TIMEOUT_SECONDS
+    if remaining <= 0:
+        raise LLMDeadlineExceeded("Latency budget exhausted before LLM call")
+    return min(LLM_TIMEOUT_SECONDS, remaining)
+
+
+def _submit(deployment, messages, timeout):
+    context = copy_context()
+    return _hedge_pool.submit(context.run, deployment.invoke, messages, timeout)
+
+
+def _invoke_hedged(target, hedge_target, messages, timeout):
+    """
+    Call `target`; if it has not answered after its p95 latency, send a
+    duplicate to `hedge_target` and take whichever answers first.
+    """
+    hedge_delay = target.p95()
+    if not LLM_HEDGE_ENABLED or hedge_delay is None:
+        return target.invoke(messages, timeout)
+
+    hedge_delay = max(LLM_HEDGE_MIN_DELAY_SECONDS, hedge_delay)
+    started = time.monotonic()
+    futures = {_submit(target, messages, timeout)}
+
+    done, _ = wait(futures, timeout=min(hedge_delay, timeout))
+    if not done and timeout - (time.monotonic() - started) > 0:
+        print(f"Hedging LLM call to {hedge_target.name} after {hedge_delay:.2f}s")
+        futures.add(_submit(hedge_target, messages, timeout - (time.monotonic() - started)))
+
+    error = None
+    pending = futures
+    while pending:
+        left = timeout - (time.monotonic() - started)
+        if left <= 0:
+            break
+        done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+
+    raise error or TimeoutError(f"LLM call did not finish within {timeout:.1f}s")
+
+
+def invoke_llm(messages, stage="answer"):
+    """
+    Invoke the chat model for a chain stage with per-call deadlines derived
+    from the request's latency budget, jittered retries and optional hedging.
+    """
+    target, fallback = route(stage)
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        timeout = _call_timeout()
+        try:
+            with time_stage(f"llm_{stage}"):
+                return _invoke_hedged(target, fallback, messages, timeout)
+        except retryable_errors() as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise LLMUnavailable(
+                    f"{stage} failed after {attempt + 1} attempts ({type(e).__name__})",
+                    retry_after_seconds(e)
+                ) from e
+            backoff = LLM_RETRY_BASE_DELAY_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+            remaining = remaining_budget()
+            if remaining is not None and remaining <= backoff:
+                raise LLMDeadlineExceeded(f"No budget left to retry {stage} after {type(e).__name__}") from e
+            print(f"LLM {stage} call to {target.name} failed ({type(e).__name__}), retrying in {backoff:.2f}s")
+            time.sleep(backoff)
+            # Retry on the other deployment when there is one
+            target, fallback = fallback, target
+
+
+def get_chat_runnable(stage):
+    """A Runnable usable anywhere LangChain expects a chat model"""
+    from langchain_core.runnables import RunnableLambda
+
+    return RunnableLambda(lambda messages: invoke_llm(messages, stage), name=f"llm_{stage}")
@@ -1,8 +1,8 @@
-from rag_chain import get_user_vectorstore
+from rag_chain import ingest_document
 import fitz  # PyMuPDF
+import hashlib
 import os
-from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from chunking import chunk_pages
 
 def convert_PDF_to_markdown(pdf_document_path):
     """Convert a single PDF to markdown content"""
@@ -22,30 +22,43 @@ def convert_PDF_to_markdown(pdf_document_path):
     pdf_document.close()
     return markdown_content
 
-def process_pdf_content(pdf_path, filename):
+def hash_file(path):
+    """sha256 and size of a file, read in blocks"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+def extract_pdf_pages(pdf_document_path):
+    """(page_number, text) for every page, with text blocks separated as paragraphs"""
+    pdf_document = fitz.open(pdf_document_path)
+    pages = []
+    
+    for page_num in range(len(pdf_document)):
+        page = pdf_document.load_page(page_num)
+        # Block type 0 is text (1 is an image)
+        blocks = [block[4].strip() for block in page.get_text("blocks") if block[6] == 0]
+        text = "\n\n".join(block for block in blocks if block).replace("•", "-")
+        pages.append((page_num + 1, text))
+    
+    pdf_document.close()
+    return pages
+
+def process_pdf_content(pdf_path, filename, content_hash=None):
     """Convert PDF to documents for vectorstore processing"""
     try:
-        # Convert PDF to markdown
-        markdown_content = convert_PDF_to_markdown(pdf_path)
+        pages = extract_pdf_pages(pdf_path)
         
-        if not markdown_content.strip():
+        if not any(text.strip() for _, text in pages):
             print(f"No content extracted from {filename}")
             return None
         
-        # Create document
-        document = Document(
-            page_content=markdown_content,
-            metadata={"source": filename, "type": "pdf"}
-        )
-        
-        # Split the document into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n## ", "\n##", "\n#", "\n\n", "\n", "  ", " ", ""]
-        )
-        
-        split_docs = text_splitter.split_documents([document])
+        # Split page by page so every chunk records the pages it came from
+        metadata = {"source": filename, "type": "pdf", "content_hash": content_hash or hash_file(pdf_path)[0]}
+        split_docs = chunk_pages(pages, metadata)
         
         print(f"Successfully processed {filename} into {len(split_docs)} chunks")
         return split_docs
@@ -54,20 +67,26 @@ def process_pdf_content(pdf_path, filename):
         print(f"Error processing PDF {filename}: {str(e)}")
         return None
 
-def add_pdf_to_vectorstore(pdf_path, filename, user_id):
-    """Convert PDF and add to user-specific vectorstore"""
+def add_pdf_to_vectorstore(pdf_path, filename, user_id, force=False, content_hash=None, size_bytes=None):
+    """Convert PDF and add to user-specific vectorstore (pass the hash if the caller already has it)"""
     try:
+        if content_hash is None or size_bytes is None:
+            content_hash, size_bytes = hash_file(pdf_path)
+        
         # Process the PDF content
-        split_docs = process_pdf_content(pdf_path, filename)
+        split_docs = process_pdf_content(pdf_path, filename, content_hash)
         
         if not split_docs:
             return False
         
-        # Get user's vectorstore
-        vectorstore = get_user_vectorstore(user_id)
-        
-        # Add to user's vectorstore
-        vectorstore.add_documents(split_docs)
+        # Add to user's vectorstore, lexical index and documents catalog
+        status = ingest_document(
+            user_id, filename, "pdf", split_docs, content_hash,
+            size_bytes=size_bytes, file_path=os.path.abspath(pdf_path), force=force
+        )
+        if status == "unchanged":
+            print(f"{filename} is unchanged for user {user_id}, skipping")
+            return True
         
         # Save markdown file to user-specific folder (optional)
         markdown_content = convert_PDF_to_markdown(pdf_path)
@@ -0,0 +1,190 @@
+"""
+Background prewarm of a user's chat state after login.
+
+The first /message after login otherwise pays for everything cold: loading
+the history, opening the user's Chroma store (and its vector index) and
+building the RAG chain. A successful login schedules rag_chain.prewarm_user
+on a small pool instead. At most one prewarm per user is in flight, and
+logins beyond PREWARM_MAX_PENDING outstanding prewarms are not prewarmed.
+In a sharded deployment a login served by a node that does not own the user
+is passed on to the owner (POST /internal/users/<id>/prewarm).
+
+The first chat turn after each login is timed and filed as "warm" (the
+prewarm had finished) or "cold", so /metrics shows what prewarming saves.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PREWARM_ON_LOGIN, PREWARM_WORKERS, PREWARM_MAX_PENDING, INTERNAL_TOKEN
+
+TRACKED_USERS = 10000  # logins remembered while waiting for their first turn
+SAMPLES = 500  # latencies kept per series
+FORWARD_TIMEOUT_SECONDS = 5
+
+
+def _summary(samples):
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "ms_p50": round(values[len(values) // 2], 1) if values else None,
+        "ms_p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1) if values else None
+    }
+
+
+class Prewarmer:
+    def __init__(self, workers=PREWARM_WORKERS, max_pending=PREWARM_MAX_PENDING, enabled=PREWARM_ON_LOGIN):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.enabled = enabled
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._warm = OrderedDict()  # user_id -> prewarm finished (since their last login)
+        self._prewarm_ms = deque(maxlen=SAMPLES)
+        self._first_turn_ms = {"warm": deque(maxlen=SAMPLES), "cold": deque(maxlen=SAMPLES)}
+        self._counts = {
+            "scheduled": 0, "deduplicated": 0, "dropped": 0, "completed": 0, "failed": 0,
+            "forwarded": 0, "forward_failed": 0
+        }
+
+    def _remember(self, key, warm):
+        self._warm[key] = warm
+        self._warm.move_to_end(key)
+        while len(self._warm) > TRACKED_USERS:
+            self._warm.popitem(last=False)
+
+    def schedule(self, user_id):
+        """
+        Note a login and prewarm the user in the background.
+        Returns True when a prewarm was queued.
+        """
+        key = str(user_id)
+        with self._lock:
+            self._remember(key, False)
+            if not self.enabled:
+                return False
+            if key in self._inflight:
+                self._counts["deduplicated"] += 1
+                return False
+            if len(self._inflight) >= self.max_pending:
+                self._counts["dropped"] += 1
+                return False
+            self._inflight.add(key)
+            self._counts["scheduled"] += 1
+            executor = self._get_executor()
+        executor.submit(self._run, user_id, key)
+        return True
+
+    def forward(self, user_id, node_url):
+        """
+        Ask the node owning the user to prewarm them, in the background.
+        Returns True when the request was queued.
+        """
+        key = f"forward:{user_id}"
+        with self._lock:
+            if not self.enabled or not INTERNAL_TOKEN:
+                return False
+            if key in self._inflight:
+                self._counts["deduplicated"] += 1
+                return False
+            if len(self._inflight) >= self.max_pending:
+                self._counts["dropped"] += 1
+                return False
+            self._inflight.add(key)
+            executor = self._get_executor()
+        executor.submit(self._forward, user_id, node_url, key)
+        return True
+
+    def _get_executor(self):
+        # Called with self._lock held
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prewarm")
+        return self._executor
+
+    def _forward(self, user_id, node_url, key):
+        import requests
+        try:
+            response = requests.post(
+                f"{node_url}/internal/users/{user_id}/prewarm",
+                headers={"X-Internal-Token": INTERNAL_TOKEN},
+                timeout=FORWARD_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+            counter = "forwarded"
+        except requests.RequestException as e:
+            print(f"❌ Forwarding prewarm of user {user_id} to {node_url} failed: {e}")
+            counter = "forward_failed"
+        with self._lock:
+            self._counts[counter] += 1
+            self._inflight.discard(key)
+
+    def _run(self, user_id, key):
+        start = time.perf_counter()
+        try:
+            import rag_chain
+            rag_chain.prewarm_user(user_id)
+        except Exception as e:
+            print(f"❌ Prewarm failed for user {user_id}: {e}")
+            with self._lock:
+                self._counts["failed"] += 1
+                self._inflight.discard(key)
+            return
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._counts["completed"] += 1
+            self._inflight.discard(key)
+            self._prewarm_ms.append(elapsed_ms)
+            # Only logins still waiting for their first turn count as warm
+            if key in self._warm:
+                self._warm[key] = True
+        print(f"⚡ Prewarmed user {user_id} in {elapsed_ms:.0f}ms")
+
+    def record_first_turn(self, user_id, elapsed_ms):
+        """Time a chat turn; only the first one after each login is recorded"""
+        key = str(user_id)
+        with self._lock:
+            warm = self._warm.pop(key, None)
+            if warm is None:
+                return
+            self._first_turn_ms["warm" if warm else "cold"].append(elapsed_ms)
+
+    def metrics(self):
+        with self._lock:
+            warm = _summary(self._first_turn_ms["warm"])
+            cold = _summary(self._first_turn_ms["cold"])
+            return {
+                "enabled": self.enabled,
+                "pending": len(self._inflight),
+                "prewarm_ms_p50": _summary(self._prewarm_ms)["ms_p50"],
+                **self._counts,
+                "first_turn": {
+                    "warm": warm,
+                    "cold": cold,
+                    "improvement_ms_p50": (
+                        round(cold["ms_p50"] - warm["ms_p50"], 1)
+                        if warm["count"] and cold["count"] else None
+                    )
+                }
+            }
+
+
+_prewarmer = Prewarmer()
+
+
+def schedule_prewarm(user_id):
+    return _prewarmer.schedule(user_id)
+
+
+def forward_prewarm(user_id, node_url):
+    return _prewarmer.forward(user_id, node_url)
+
+
+def record_first_turn(user_id, elapsed_ms):
+    _prewarmer.record_first_turn(user_id, elapsed_ms)
+
+
+def metrics():
+    return _prewarmer.metrics()
@@ -0,0 +1,322 @@
+"""
+Opt-in statistical profiler for finding where slow requests spend their time.
+
+A sampler thread reads every thread's stack with sys._current_frames() every
+PROFILING_INTERVAL_MS while at least one profile is being captured, so the
+profiled code runs unmodified. Profiles are captured for:
+
+- a request sent with X-Profile-Token: <PROFILING_TOKEN>; the response names
+  the profile in X-Profile-Id;
+- a PROFILING_SAMPLE_RATE fraction of PROFILED_ENDPOINTS requests;
+- every thread of the process for a time window (POST /admin/profile).
+
+Request profiles cover the request thread plus busy ThreadPoolExecutor
+workers, where LangChain runs parallel steps (a worker busy with another
+request at the same time shows up too). Each profile is written to
+PROFILING_DIR in collapsed-stack format (flamegraph.pl, speedscope) and as a
+speedscope JSON file, listed by GET /admin/profiles.
+
+With PROFILING_ENABLED unset, init_profiling registers nothing: no hooks,
+no routes and no thread.
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import abort, g, jsonify, request, send_from_directory
+
+from config import (
+    PROFILING_ENABLED,
+    PROFILING_TOKEN,
+    PROFILING_SAMPLE_RATE,
+    PROFILING_INTERVAL_MS,
+    PROFILING_DIR,
+    PROFILING_MAX_WINDOW_SECONDS,
+    PROFILING_KEEP
+)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_HEADER = "X-Profile-Token"
+PROFILED_ENDPOINTS = frozenset({"message", "upload_pdf", "upload_pdfs"})
+ADMIN_ENDPOINTS = frozenset({"start_window_profile", "list_profiles", "get_profile_file"})
+# The profiler's own threads
+OWN_THREADS = frozenset({"profiler", "profile-window"})
+# Helper threads whose stacks belong to the request being profiled
+WORKER_THREAD_PREFIX = "ThreadPoolExecutor-"
+# Threads parked here are idle, not working for anyone
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socketserver.py", os.path.join("concurrent", "futures", "thread.py"))
+PROFILE_NAME_RE = re.compile(r"^[\w.-]+\.(collapsed|speedscope\.json)$")
+
+
+# Longest first, so site-packages paths lose their whole prefix
+_PATH_PREFIXES = sorted((path + os.sep for path in sys.path if path), key=len, reverse=True)
+_labels = {}  # code object -> label
+
+
+def _frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        for prefix in _PATH_PREFIXES:
+            if path.startswith(prefix):
+                path = path[len(prefix):]
+                break
+        label = _labels[code] = f"{code.co_name} ({path}:{code.co_firstlineno})"
+    return label
+
+
+def _stack(frame):
+    """Frame labels from the outermost call to frame"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+def _is_idle(frame):
+    return frame.f_code.co_filename.endswith(IDLE_FILES)
+
+
+class Profile:
+    def __init__(self, kind, label, thread_id=None):
+        self.kind = kind  # "request" or "window"
+        self.label = label
+        self.thread_id = thread_id
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.samples = 0
+        self.stacks = Counter()
+
+    def sample(self, frames, thread_names):
+        """Record one tick of every thread this profile covers"""
+        self.samples += 1
+        for thread_id, frame in frames.items():
+            name = thread_names.get(thread_id, str(thread_id))
+            if name in OWN_THREADS:
+                continue
+            if self.kind == "request":
+                if thread_id == self.thread_id:
+                    self.stacks[("request",) + _stack(frame)] += 1
+                    continue
+                if not name.startswith(WORKER_THREAD_PREFIX):
+                    continue
+            if not _is_idle(frame):
+                self.stacks[(f"thread {name}",) + _stack(frame)] += 1
+
+    @property
+    def name(self):
+        return f"{self.started_at:%Y%m%d-%H%M%S-%f}-{self.kind}-{self.label}"
+
+
+class Sampler:
+    """Samples stacks for every active profile; the thread runs only while there are some"""
+
+    def __init__(self, interval_ms=PROFILING_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, profile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def stop(self, profile):
+        with self._lock:
+            self._profiles.discard(profile)
+        profile.elapsed = time.perf_counter() - profile.start
+        return profile
+
+    def _loop(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            frames.pop(own_id, None)
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for profile in profiles:
+                profile.sample(frames, thread_names)
+            del frames
+            time.sleep(self.interval)
+
+
+def _profiles_dir():
+    path = os.path.join(APP_DIR, PROFILING_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_collapsed(profile, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in profile.stacks.most_common():
+            f.write(";".join(stack) + f" {count}\n")
+
+
+def write_speedscope(profile, path, interval_ms):
+    frames = {}
+    samples = []
+    weights = []
+    for stack, count in profile.stacks.most_common():
+        samples.append([frames.setdefault(label, len(frames)) for label in stack])
+        weights.append(count * interval_ms)
+    document = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": profile.name,
+        "exporter": "ragit profiling",
+        "shared": {"frames": [{"name": label} for label in frames]},
+        "profiles": [{
+            "type": "sampled",
+            "name": profile.name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights
+        }]
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f)
+
+
+def _prune(directory, keep):
+    """Keep the newest `keep` profiles (both files of each)"""
+    names = sorted({name.split(".")[0] for name in os.listdir(directory) if PROFILE_NAME_RE.match(name)})
+    for stale in names[:-keep] if keep else names:
+        for suffix in (".collapsed", ".speedscope.json"):
+            try:
+                os.remove(os.path.join(directory, stale + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(profile, interval_ms=PROFILING_INTERVAL_MS, keep=PROFILING_KEEP):
+    directory = _profiles_dir()
+    write_collapsed(profile, os.path.join(directory, profile.name + ".collapsed"))
+    write_speedscope(profile, os.path.join(directory, profile.name + ".speedscope.json"), interval_ms)
+    _prune(directory, keep)
+    print(f"⚡ Saved profile {profile.name} ({profile.samples} samples over {profile.elapsed:.2f}s)")
+
+
+_sampler = Sampler()
+_window = None
+_window_lock = threading.Lock()
+
+
+def _authorized():
+    token = request.headers.get(PROFILE_HEADER)
+    return bool(PROFILING_TOKEN) and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def _require_token():
+    if not _authorized():
+        abort(403)
+
+
+## Request hooks
+
+def start_request_profile():
+    if request.endpoint in ADMIN_ENDPOINTS:
+        return
+    if request.headers.get(PROFILE_HEADER) is not None:
+        if not _authorized():
+            return
+    elif request.endpoint not in PROFILED_ENDPOINTS or random.random() >= PROFILING_SAMPLE_RATE:
+        return
+    g.profile = _sampler.start(Profile("request", request.endpoint or "unknown", threading.get_ident()))
+
+
+def finish_request_profile(response):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        save_profile(_sampler.stop(profile))
+        response.headers["X-Profile-Id"] = profile.name
+    return response
+
+
+def abandon_request_profile(exc=None):
+    # Requests that failed before after_request still get their profile saved
+    profile = g.pop("profile", None)
+    if profile is not None:
+        save_profile(_sampler.stop(profile))
+
+
+## Admin endpoints
+
+def _run_window(profile, seconds):
+    global _window
+    time.sleep(seconds)
+    save_profile(_sampler.stop(profile))
+    with _window_lock:
+        _window = None
+
+
+def start_window_profile():
+    """Profile every thread for ?seconds=N (default 10); the result is saved when it ends"""
+    global _window
+    _require_token()
+    seconds = min(request.args.get("seconds", default=10.0, type=float), PROFILING_MAX_WINDOW_SECONDS)
+    if seconds <= 0:
+        return jsonify({"error": "seconds must be positive"}), 400
+    with _window_lock:
+        if _window is not None:
+            return jsonify({"error": "A window profile is already running", "profile": _window.name}), 409
+        _window = _sampler.start(Profile("window", "process"))
+        profile = _window
+    threading.Thread(target=_run_window, args=(profile, seconds), name="profile-window", daemon=True).start()
+    return jsonify({"profile": profile.name, "seconds": seconds}), 202
+
+
+def list_profiles():
+    _require_token()
+    directory = _profiles_dir()
+    profiles = {}
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if not PROFILE_NAME_RE.match(filename):
+            continue
+        name = filename.split(".")[0]
+        stat = os.stat(os.path.join(directory, filename))
+        entry = profiles.setdefault(name, {"name": name, "files": {}})
+        entry["created_at"] = datetime.fromtimestamp(stat.st_mtime)
+        entry["files"]["collapsed" if filename.endswith(".collapsed") else "speedscope"] = {
+            "file": filename,
+            "size_bytes": stat.st_size
+        }
+    return jsonify({"profiles": list(profiles.values())})
+
+
+def get_profile_file(filename):
+    _require_token()
+    if not PROFILE_NAME_RE.match(filename):
+        abort(404)
+    return send_from_directory(_profiles_dir(), filename, as_attachment=True)
+
+
+def init_profiling(app):
+    """Register the profiling hooks and admin routes (only when PROFILING_ENABLED)"""
+    if not PROFILING_ENABLED:
+        return
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
+    app.teardown_request(abandon_request_profile)
+    app.add_url_rule("/admin/profile", "start_window_profile", start_window_profile, methods=["POST"])
+    app.add_url_rule("/admin/profiles", "list_profiles", list_profiles, methods=["GET"])
+    app.add_url_rule("/admin/profiles/<path:filename>", "get_profile_file", get_profile_file, methods=["GET"])
+    print(f"⚡ Profiling enabled (sample rate {PROFILING_SAMPLE_RATE:g}, every {PROFILING_INTERVAL_MS:g}ms)")
@@ -0,0 +1,405 @@
+"""
+Outbound API quotas (Azure chat, Azure embeddings, Tavily) shared by every
+worker process on the machine.
+
+Each worker used to call the APIs on its own, so together they ran past the
+deployments' tokens-per-minute and requests-per-minute limits and got 429s,
+with chat paying the retries. Calls now take tokens and a request from a
+token bucket per deployment first, refilled continuously at the configured
+per-minute rate, and wait when it is empty.
+
+The buckets live in a small memory-mapped file (QUOTA_SHARED_PATH, in
+/dev/shm by default) updated under flock, so all workers draw on the same
+quota and nothing has to be running for it: a worker that dies only leaves
+its last update behind. Where that is unavailable the buckets are per
+process.
+
+Interactive calls (chat turns, query embeddings) may empty a bucket.
+Background calls (ingestion embeddings, Tavily extraction) stop at
+QUOTA_INTERACTIVE_RESERVE of it and hold off entirely while an interactive
+call is waiting, so ingestion never makes a chat turn wait. A 429 pauses
+the bucket for every worker until its Retry-After has passed.
+
+metrics() reports each bucket's headroom and the time calls spent waiting.
+"""
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+
+from config import (
+    AZURE_OPENAI_DEPLOYMENT_NAME,
+    AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME,
+    AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME,
+    QUOTA_CHAT_TPM,
+    QUOTA_CHAT_RPM,
+    QUOTA_SECONDARY_CHAT_TPM,
+    QUOTA_SECONDARY_CHAT_RPM,
+    QUOTA_EMBEDDINGS_TPM,
+    QUOTA_EMBEDDINGS_RPM,
+    QUOTA_TAVILY_RPM,
+    QUOTA_INTERACTIVE_RESERVE,
+    QUOTA_MAX_WAIT_SECONDS,
+    QUOTA_SHARED_PATH
+)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+TAVILY_KEY = "tavily"
+
+MAX_POLL_SECONDS = 1.0  # waiters look again at least this often (others refund unused tokens)
+MIN_POLL_SECONDS = 0.01
+SAMPLES = 500  # waits kept per bucket and priority
+
+# File layout: header, then fixed slots of
+# key, tokens, requests, updated, interactive_until, blocked_until, granted, waited, timed_out, wait_ms_total
+HEADER = struct.Struct("<8sI")
+MAGIC = b"RGQUOTA1"
+SLOT = struct.Struct("<64sdddddqqqd")
+MAX_SLOTS = 64
+FILE_SIZE = HEADER.size + SLOT.size * MAX_SLOTS
+
+
+def chat_key(deployment_name):
+    return f"chat:{deployment_name}"
+
+
+def embeddings_key(deployment_name=AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME):
+    return f"embeddings:{deployment_name}"
+
+
+def configured_limits():
+    """{bucket key: (tokens per minute, requests per minute)} for the limited buckets"""
+    limits = {}
+    if AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME:
+        limits[chat_key(AZURE_OPENAI_SECONDARY_DEPLOYMENT_NAME)] = (QUOTA_SECONDARY_CHAT_TPM, QUOTA_SECONDARY_CHAT_RPM)
+    limits[chat_key(AZURE_OPENAI_DEPLOYMENT_NAME)] = (QUOTA_CHAT_TPM, QUOTA_CHAT_RPM)
+    limits[embeddings_key()] = (QUOTA_EMBEDDINGS_TPM, QUOTA_EMBEDDINGS_RPM)
+    limits[TAVILY_KEY] = (0, QUOTA_TAVILY_RPM)
+    return {key: limit for key, limit in limits.items() if limit[0] > 0 or limit[1] > 0}
+
+
+class QuotaWaitExceeded(Exception):
+    """A call could not get its quota within the time it was allowed to wait"""
+
+    def __init__(self, key, waited):
+        super().__init__(f"No {key} quota after waiting {waited:.1f}s")
+        self.key = key
+        self.waited = waited
+
+
+class _Slot:
+    """One bucket's shared state"""
+
+    __slots__ = (
+        "tokens", "requests", "updated", "interactive_until", "blocked_until",
+        "granted", "waited", "timed_out", "wait_ms_total"
+    )
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def reset(self, limit, now):
+        self.__init__(float(limit[0]), float(limit[1]), now, 0.0, 0.0, 0, 0, 0, 0.0)
+
+    def refill(self, limit, now):
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(limit[0], self.tokens + elapsed * limit[0] / 60)
+        self.requests = min(limit[1], self.requests + elapsed * limit[1] / 60)
+        self.updated = now
+
+
+class _LocalState:
+    """Buckets for this process only"""
+
+    backend = "local"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def transact(self, key, limit, fn):
+        with self._lock:
+            now = time.time()
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slot()
+                slot.reset(limit, now)
+            slot.refill(limit, now)
+            return fn(slot, now)
+
+
+class _SharedState:
+    """Buckets in a memory-mapped file, updated under an exclusive flock"""
+
+    backend = "shared"
+
+    def __init__(self, path):
+        import fcntl
+        import mmap
+
+        self._fcntl = fcntl
+        self.path = path
+        self._lock = threading.Lock()  # flock does not exclude threads sharing the descriptor
+        self._index = {}
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != FILE_SIZE or os.pread(self._fd, HEADER.size, 0) != HEADER.pack(MAGIC, MAX_SLOTS):
+                    # New file, or one written with another layout
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, FILE_SIZE)
+                    os.pwrite(self._fd, HEADER.pack(MAGIC, MAX_SLOTS), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(self._fd, FILE_SIZE)
+        except OSError:
+            os.close(self._fd)
+            raise
+        self._overflow = _LocalState()
+
+    def _find(self, key):
+        """Offset of the key's slot, claiming a free one if needed (None when full)"""
+        encoded = key.encode("utf-8")[:64]
+        offset = self._index.get(key)
+        if offset is not None:
+            return offset, False
+        for index in range(MAX_SLOTS):
+            offset = HEADER.size + index * SLOT.size
+            stored = self._map[offset:offset + 64].rstrip(b"\0")
+            if stored == encoded:
+                self._index[key] = offset
+                return offset, False
+            if not stored:
+                self._map[offset:offset + 64] = encoded.ljust(64, b"\0")
+                self._index[key] = offset
+                return offset, True
+        return None, False
+
+    def transact(self, key, limit, fn):
+        with self._lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                offset, created = self._find(key)
+                if offset is not None:
+                    now = time.time()
+                    slot = _Slot(*SLOT.unpack_from(self._map, offset)[1:])
+                    if created:
+                        slot.reset(limit, now)
+                    slot.refill(limit, now)
+                    result = fn(slot, now)
+                    SLOT.pack_into(self._map, offset, key.encode("utf-8")[:64], *slot.values())
+                    return result
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+        print(f"❌ No free shared quota slot for {key}, limiting it per process")
+        return self._overflow.transact(key, limit, fn)
+
+
+def _open_state(path=QUOTA_SHARED_PATH):
+    if path.lower() == "off":
+        return _LocalState()
+    if not path:
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        path = os.path.join(directory, "ragit_quota")
+    try:
+        return _SharedState(path)
+    except (ImportError, OSError) as e:
+        print(f"❌ Shared quota state unavailable at {path} ({e}), limiting per process")
+        return _LocalState()
+
+
+class QuotaManager:
+    def __init__(self, limits, state, reserve=QUOTA_INTERACTIVE_RESERVE, max_wait=QUOTA_MAX_WAIT_SECONDS):
+        self.limits = dict(limits)
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self._state = state
+        self._lock = threading.Lock()
+        self._waits = {}  # (key, priority) -> recent waits in ms, this process only
+
+    def is_limited(self, key):
+        return key in self.limits
+
+    def background_capacity(self, key):
+        """Most tokens one background call can take from the key's bucket (None when unlimited)"""
+        limit = self.limits.get(key)
+        if limit is None or not limit[0]:
+            return None
+        return max(1, int(limit[0] * (1 - self.reserve)))
+
+    def _take(self, limit, tokens, requests, priority, waited_ms):
+        """Transaction: take the amounts and return 0, or return the seconds to wait"""
+        def take(slot, now):
+            if slot.blocked_until > now:
+                return slot.blocked_until - now
+            if priority == BACKGROUND and slot.interactive_until > now:
+                return slot.interactive_until - now
+
+            wait = 0.0
+            charges = []
+            for level, capacity, amount in ((slot.tokens, limit[0], tokens), (slot.requests, limit[1], requests)):
+                if not capacity:
+                    charges.append(0)
+                    continue
+                floor = capacity * self.reserve if priority == BACKGROUND else 0.0
+                # Interactive calls bigger than the bucket go through once it is full, leaving it
+                # in debt; background calls are capped at the usable part and never dip into the
+                # reserve (callers split their work with background_capacity())
+                if priority == BACKGROUND:
+                    amount = min(amount, capacity - floor)
+                charges.append(amount)
+                needed = floor + min(amount, capacity - floor)
+                if level < needed:
+                    wait = max(wait, (needed - level) * 60 / capacity)
+
+            if wait:
+                if priority == INTERACTIVE:
+                    slot.interactive_until = max(slot.interactive_until, now + wait)
+                return wait
+
+            slot.tokens -= charges[0]
+            slot.requests -= charges[1]
+            slot.granted += 1
+            if waited_ms:
+                slot.waited += 1
+                slot.wait_ms_total += waited_ms
+            return 0.0
+        return take
+
+    def acquire(self, key, tokens=0, requests=1, priority=INTERACTIVE, max_wait=None):
+        """
+        Take `tokens` and `requests` from the key's bucket, waiting up to
+        max_wait seconds (QUOTA_MAX_WAIT_SECONDS by default) for them.
+        Returns the seconds waited; raises QuotaWaitExceeded.
+        """
+        limit = self.limits.get(key)
+        if limit is None:
+            return 0.0
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        waited = 0.0
+        while True:
+            wait = self._state.transact(key, limit, self._take(limit, tokens, requests, priority, waited * 1000))
+            if not wait:
+                self._record(key, priority, waited * 1000)
+                return waited
+            left = max_wait - waited
+            if left <= 0:
+                self._state.transact(key, limit, self._count_timeout)
+                self._record(key, priority, waited * 1000)
+                raise QuotaWaitExceeded(key, waited)
+            time.sleep(max(MIN_POLL_SECONDS, min(wait, left, MAX_POLL_SECONDS)))
+            waited = time.monotonic() - start
+
+    @staticmethod
+    def _count_timeout(slot, now):
+        slot.timed_out += 1
+
+    def settle(self, key, charged, used):
+        """Refund (or charge) the difference between tokens taken up front and tokens used"""
+        limit = self.limits.get(key)
+        if limit is None or not limit[0] or used is None or used == charged:
+            return
+
+        def settle(slot, now):
+            slot.tokens = min(limit[0], slot.tokens + charged - used)
+        self._state.transact(key, limit, settle)
+
+    def throttle(self, key, seconds):
+        """Pause the bucket for every worker (the API answered 429 with Retry-After)"""
+        limit = self.limits.get(key)
+        if limit is None or seconds <= 0:
+            return
+
+        def block(slot, now):
+            slot.blocked_until = max(slot.blocked_until, now + seconds)
+        self._state.transact(key, limit, block)
+        print(f"⚡ {key} quota paused for {seconds:.1f}s after a 429")
+
+    def _record(self, key, priority, waited_ms):
+        with self._lock:
+            self._waits.setdefault((key, priority), deque(maxlen=SAMPLES)).append(waited_ms)
+
+    def _wait_summary(self, key, priority):
+        with self._lock:
+            values = sorted(self._waits.get((key, priority), ()))
+        return {
+            "calls": len(values),
+            "wait_ms_p50": round(values[len(values) // 2], 1) if values else None,
+            "wait_ms_p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1) if values else None,
+            "wait_ms_max": round(values[-1], 1) if values else None
+        }
+
+    def metrics(self):
+        buckets = {}
+        for key, limit in self.limits.items():
+            state, now = self._state.transact(key, limit, lambda slot, now: (_Slot(*slot.values()), now))
+            buckets[key] = {
+                "tokens_per_minute": limit[0] or None,
+                "requests_per_minute": limit[1] or None,
+                "tokens_available": round(state.tokens) if limit[0] else None,
+                "requests_available": round(state.requests, 1) if limit[1] else None,
+                "headroom": round(min(
+                    state.tokens / limit[0] if limit[0] else 1.0,
+                    state.requests / limit[1] if limit[1] else 1.0
+                ), 3),
+                "paused_seconds": round(max(0.0, state.blocked_until - now), 1),
+                # Counters cover every worker; the wait percentiles this one
+                "granted": state.granted,
+                "waited": state.waited,
+                "timed_out": state.timed_out,
+                "wait_ms_mean": round(state.wait_ms_total / state.waited, 1) if state.waited else None,
+                INTERACTIVE: self._wait_summary(key, INTERACTIVE),
+                BACKGROUND: self._wait_summary(key, BACKGROUND)
+            }
+        return {
+            "backend": self._state.backend,
+            "path": getattr(self._state, "path", None),
+            "interactive_reserve": self.reserve,
+            "buckets": buckets
+        }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_quota():
+    """The process's quota manager, attached to the shared buckets on first use"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                limits = configured_limits()
+                # Nothing to share when nothing is limited
+                _manager = QuotaManager(limits, _open_state() if limits else _LocalState())
+    return _manager
+
+
+def retry_after_seconds(error, default=1.0):
+    """Retry-After of a 429 from openai or requests, in seconds"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if name.endswith("-ms") else seconds
+    return default
+
+
+def is_rate_limited(error):
+    response = getattr(error, "response", None)
+    return getattr(error, "status_code", None) == 429 or getattr(response, "status_code", None) == 429
@@ -1,47 +1,141 @@
 import os
+import hashlib
+import shutil
+import threading
+from collections import OrderedDict
 import chromadb
 chromadb.telemetry.ENABLED = False
 
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_chroma import Chroma
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from webcrawler import webcrawl
+from langchain_openai import AzureOpenAIEmbeddings
+from webcrawler import webcrawl, webcrawl_many
+from lexical_index import get_lexical_index, forget_lexical_index
+from chunking import chunk_text, chunk_documents
+from retrieval import HybridRetriever, StagedRetriever
+from reranker import CrossEncoderReranker
+from context_compression import ContextCompressor
+from timing import reset_stage_timings, get_stage_timings, time_stage, record_stage
+from llm import get_chat_runnable, remaining_budget, LLMDeadlineExceeded
+from quota import get_quota, embeddings_key, is_rate_limited, retry_after_seconds, QuotaWaitExceeded, INTERACTIVE, BACKGROUND
+from tokens import count_tokens
+from tenant_store import TenantVectorStore, get_shared_store, tenant_filter
+from chroma_clients import get_store_client, close_store_client, store_lock
+from history_cache import get_history_cache
 from config import (
-    AZURE_OPENAI_ENDPOINT,
-    AZURE_OPENAI_DEPLOYMENT_NAME,
-    AZURE_OPENAI_API_KEY,
     AZURE_OPENAI_EMBEDDINGS_API_KEY,
     AZURE_OPENAI_EMBEDDINGS_ENDPOINT,
-    AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME
+    AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME,
+    RETRIEVAL_K,
+    HYBRID_RETRIEVAL,
+    HYBRID_FETCH_K,
+    RERANK_ENABLED,
+    RERANK_MODEL,
+    RERANK_FETCH_K,
+    RERANK_BATCH_SIZE,
+    RERANK_BUDGET_MS,
+    CONTEXT_COMPRESSION,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_MIN_SENTENCE_OVERLAP,
+    VECTORSTORE_MODE,
+    VECTORSTORES_DIR,
+    SHARED_VECTORSTORE_PATH,
+    SHARED_COLLECTION_NAME,
+    CHAIN_CACHE_MAX_USERS,
+    HISTORY_WINDOW_MESSAGES
 )
 from db.connection import get_db_connection, execute_query, close_connection
 from db.queries.chats import get_all_chats_by_user_query
-
-# Create an AzureOpenAIEmbeddings instance
-embeddings = AzureOpenAIEmbeddings(
-    azure_endpoint=AZURE_OPENAI_EMBEDDINGS_ENDPOINT,
-    api_key=AZURE_OPENAI_EMBEDDINGS_API_KEY,
-    azure_deployment=AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME,
-    model="text-embedding-3-small",
-    openai_api_version="2024-05-01-preview"
+from db.queries.documents import (
+    upsert_document_query,
+    get_document_by_id_query,
+    get_document_by_source_query,
+    delete_document_query
 )
 
-# Create an AzureChatOpenAI model instance
-model = AzureChatOpenAI(
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version="2024-05-01-preview",
-    azure_deployment=AZURE_OPENAI_DEPLOYMENT_NAME,
-    model="gpt-4o"
-)
+class QuotaLimitedEmbeddings(Embeddings):
+    """
+    Embeddings that take their tokens from the shared quota (quota.py) first:
+    queries are interactive (a chat turn is waiting), documents are background
+    ingestion and leave the interactive reserve alone
+    """
+
+    def __init__(self, embeddings, quota_key):
+        self.embeddings = embeddings
+        self.quota_key = quota_key
+
+    def embed_documents(self, texts):
+        quota = get_quota()
+        if not quota.is_limited(self.quota_key) or not texts:
+            return self._call(self.embeddings.embed_documents, texts)
+        # One embeddings request at a time, each paid for just before it is sent, so
+        # a large ingest drains the bucket gradually and never below the reserve
+        vectors = []
+        for batch, tokens in self._requests(texts, quota.background_capacity(self.quota_key)):
+            quota.acquire(self.quota_key, tokens, priority=BACKGROUND)
+            vectors.extend(self._call(self.embeddings.embed_documents, batch))
+        return vectors
+
+    def _requests(self, texts, max_tokens):
+        """(texts, tokens) batches of at most chunk_size texts (one client request) and max_tokens"""
+        chunk_size = getattr(self.embeddings, "chunk_size", None) or len(texts)
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if batch and (len(batch) >= chunk_size or (max_tokens and batch_tokens + tokens > max_tokens)):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def embed_query(self, text):
+        quota = get_quota()
+        if quota.is_limited(self.quota_key):
+            remaining = remaining_budget()
+            try:
+                waited = quota.acquire(self.quota_key, count_tokens(text), priority=INTERACTIVE, max_wait=remaining)
+            except QuotaWaitExceeded as e:
+                if remaining is None:
+                    raise
+                raise LLMDeadlineExceeded(str(e)) from e
+            if waited:
+                record_stage("quota_wait", waited * 1000)
+        return self._call(self.embeddings.embed_query, text)
+
+    def _call(self, method, argument):
+        try:
+            return method(argument)
+        except Exception as e:
+            if is_rate_limited(e):
+                get_quota().throttle(self.quota_key, retry_after_seconds(e))
+            raise
 
-# Store chat histories per user (in-memory cache)
-user_chat_histories = {}
+# AzureOpenAIEmbeddings instance, created on first use (or by lifecycle.warmup)
+embeddings = None
+
+def get_embeddings():
+    global embeddings
+    if embeddings is None:
+        embeddings = QuotaLimitedEmbeddings(AzureOpenAIEmbeddings(
+            azure_endpoint=AZURE_OPENAI_EMBEDDINGS_ENDPOINT,
+            api_key=AZURE_OPENAI_EMBEDDINGS_API_KEY,
+            azure_deployment=AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME,
+            model="text-embedding-3-small",
+            openai_api_version="2024-05-01-preview"
+        ), embeddings_key())
+    return embeddings
+
+# Chat model calls go through the LLM invocation layer (deadlines, retries,
+# hedging, secondary deployment routing)
+contextualize_model = get_chat_runnable("contextualize")
+answer_model = get_chat_runnable("answer")
 
 # Contextualize question prompt
 contextualized_system_prompt = (
@@ -78,59 +172,170 @@ qa_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
+def get_user_vectorstore_path(user_id):
+    """
+    Get the persist directory of a user-specific vectorstore
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, VECTORSTORES_DIR, f"user_{user_id}_vectorstore")
+
+def get_user_lexical_path(user_id):
+    """
+    Get the directory holding a user's lexical index
+    """
+    if VECTORSTORE_MODE == "shared":
+        return os.path.join(get_shared_vectorstore_path(), "lexical", f"user_{user_id}")
+    return get_user_vectorstore_path(user_id)
+
+def get_shared_vectorstore_path():
+    """
+    Get the persist directory of the shared (multi-tenant) vectorstore
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, SHARED_VECTORSTORE_PATH)
+
+def get_user_store_path(user_id):
+    """
+    Get the persist directory holding a user's vectors (the shared one in shared mode)
+    """
+    if VECTORSTORE_MODE == "shared":
+        return get_shared_vectorstore_path()
+    return get_user_vectorstore_path(user_id)
+
+def load_seed_documents():
+    """
+    Split the markdown files every new vectorstore is initialized with
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    markdown_folder_path = os.path.join(current_dir, "markdown")
+    if not os.path.exists(markdown_folder_path):
+        return []
+    
+    markdown_documents = []
+    for filename in os.listdir(markdown_folder_path):
+        if filename.lower().endswith(".md"):
+            full_path = os.path.join(markdown_folder_path, filename)
+            with open(full_path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+                if content:
+                    markdown_documents.append(Document(
+                        page_content=content,
+                        metadata={"source": filename}
+                    ))
+    
+    return chunk_documents(markdown_documents)
+
+def seed_user_vectorstore(user_id, vectorstore):
+    """
+    Add the markdown seed corpus to a new user's vectorstore and lexical index
+    """
+    documents = load_seed_documents()
+    if documents:
+        print(f"Initializing user {user_id} vectorstore with {len(documents)} markdown chunks...")
+        with store_lock(get_user_store_path(user_id)):
+            ids = vectorstore.add_documents(documents)
+            get_lexical_index(get_user_lexical_path(user_id)).add_documents(ids, documents)
+
+# Tenants of the shared collection known to be initialized in this process
+_seeded_tenants = set()
+_seeded_tenants_lock = threading.Lock()
+
+# Per-user store directories being created; concurrent uploads for a new user
+# would otherwise all find the directory empty and seed it again
+_store_creation_locks = {}
+_store_creation_locks_lock = threading.Lock()
+
+def _store_creation_lock(path):
+    with _store_creation_locks_lock:
+        return _store_creation_locks.setdefault(path, threading.Lock())
+
 def get_user_vectorstore(user_id):
     """
     Get or create a user-specific vectorstore
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    db_folder_path = os.path.join(current_dir, "db", "vectorstores", f"user_{user_id}_vectorstore")
+    if VECTORSTORE_MODE == "shared":
+        vectorstore = TenantVectorStore(
+            get_shared_store(get_shared_vectorstore_path(), SHARED_COLLECTION_NAME, get_embeddings()),
+            user_id
+        )
+        if user_id not in _seeded_tenants:
+            with _seeded_tenants_lock:
+                if user_id not in _seeded_tenants:
+                    if vectorstore.is_empty():
+                        print(f"Creating new vectorstore partition for user {user_id}...")
+                        seed_user_vectorstore(user_id, vectorstore)
+                    _seeded_tenants.add(user_id)
+        return vectorstore
     
-    # Ensure the directory exists
-    os.makedirs(db_folder_path, exist_ok=True)
+    db_folder_path = get_user_vectorstore_path(user_id)
     
     # Check if vectorstore already exists
-    if os.path.exists(db_folder_path) and os.listdir(db_folder_path):
+    if os.path.isdir(db_folder_path) and os.listdir(db_folder_path):
         print(f"Loading existing vectorstore for user {user_id}...")
-        vectorstore = Chroma(
-            persist_directory=db_folder_path,
-            embedding_function=embeddings
+        return Chroma(
+            client=get_store_client(db_folder_path),
+            embedding_function=get_embeddings()
         )
-    else:
-        print(f"Creating new vectorstore for user {user_id}...")
-        # Create empty vectorstore
+    
+    # Creating and seeding happen under the directory's lock; whoever waited
+    # on it finds the store created and loads it
+    with _store_creation_lock(db_folder_path):
+        os.makedirs(db_folder_path, exist_ok=True)
+        is_new = not os.listdir(db_folder_path)
+        print(f"{'Creating new' if is_new else 'Loading existing'} vectorstore for user {user_id}...")
         vectorstore = Chroma(
-            persist_directory=db_folder_path,
-            embedding_function=embeddings
+            client=get_store_client(db_folder_path),
+            embedding_function=get_embeddings()
         )
         
-        # Check for markdown files in the general markdown folder to initialize with
-        markdown_folder_path = os.path.join(current_dir, "markdown")
-        if os.path.exists(markdown_folder_path):
-            markdown_documents = []
-            for filename in os.listdir(markdown_folder_path):
-                if filename.lower().endswith(".md"):
-                    full_path = os.path.join(markdown_folder_path, filename)
-                    with open(full_path, "r", encoding="utf-8") as f:
-                        content = f.read().strip()
-                        if content:
-                            markdown_documents.append(Document(
-                                page_content=content,
-                                metadata={"source": filename}
-                            ))
-            
-            # Add markdown documents to the new user's vectorstore if any exist
-            if markdown_documents:
-                print(f"Initializing user {user_id} vectorstore with {len(markdown_documents)} markdown files...")
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=1000,
-                    chunk_overlap=200,
-                    separators=["\n\n## ", "\n##", "\n#", "\n\n", "\n", "  ", " ", ""]
-                )
-                documents = text_splitter.split_documents(markdown_documents)
-                vectorstore.add_documents(documents)
+        # Initialize with the markdown files in the general markdown folder
+        if is_new:
+            seed_user_vectorstore(user_id, vectorstore)
     
     return vectorstore
 
+def get_user_lexical_index(user_id, vectorstore):
+    """
+    Get the user's BM25 index, backfilling it from the vectorstore for stores
+    that were created before the index existed
+    """
+    index = get_lexical_index(get_user_lexical_path(user_id))
+    
+    if not index.exists and len(index) == 0:
+        stored = vectorstore.get(include=["documents", "metadatas"])
+        if stored["ids"]:
+            print(f"Building lexical index for user {user_id} from {len(stored['ids'])} chunks...")
+            documents = [
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(stored["documents"], stored["metadatas"])
+            ]
+            index.add_documents(stored["ids"], documents)
+    
+    return index
+
+def add_documents_to_user_vectorstore(user_id, documents):
+    """
+    Add chunks to the user's vectorstore and keep the lexical index in step
+    """
+    # Under the store lock, so maintenance cannot swap the store mid-write
+    with store_lock(get_user_store_path(user_id)):
+        vectorstore = get_user_vectorstore(user_id)
+        ids = vectorstore.add_documents(documents)
+        get_user_lexical_index(user_id, vectorstore).add_documents(ids, documents)
+    return ids
+
+def to_langchain_messages(history):
+    """
+    Convert (sender, text) history entries to LangChain messages
+    """
+    chat_history = []
+    for sender, text in history:
+        if sender == 'user':
+            chat_history.append(HumanMessage(content=text))
+        else:
+            chat_history.append(AIMessage(content=text))
+    return chat_history
+
 def get_user_chat_history_from_db(user_id):
     """
     Get chat history for a specific user from the database and convert to LangChain format
@@ -138,39 +343,26 @@ def get_user_chat_history_from_db(user_id):
     try:
         query = get_all_chats_by_user_query()
         messages = execute_query(query, params=(user_id,), fetch_all=True)
-        
-        # Convert to LangChain message format
-        chat_history = []
-        if messages:
-            for msg in messages:
-                if msg['sender'] == 'user':
-                    chat_history.append(HumanMessage(content=msg['message_text']))
-                else:
-                    chat_history.append(SystemMessage(content=msg['message_text']))
-        
-        return chat_history
+        return to_langchain_messages((msg['sender'], msg['message_text']) for msg in messages or [])
     except Exception as e:
         print(f"Error retrieving chat history from DB: {str(e)}")
         return []
 
-def get_user_chat_history(user_id):
-    """
-    Get or create chat history for a specific user from database cache
-    """
-    if user_id not in user_chat_histories:
-        # Load from database
-        user_chat_histories[user_id] = get_user_chat_history_from_db(user_id)
-    return user_chat_histories[user_id]
-
-def update_user_chat_history_cache(user_id, human_message, system_message):
+def get_user_chat_history(user_id, prompt=None):
     """
-    Update the in-memory chat history cache
+    Get the last HISTORY_WINDOW_MESSAGES messages of a user's chat history,
+    through the versioned history cache. Only these are turned into LangChain
+    messages; a trailing user message equal to prompt (the input itself) is left out.
     """
-    if user_id not in user_chat_histories:
-        user_chat_histories[user_id] = []
-    
-    user_chat_histories[user_id].append(HumanMessage(content=human_message))
-    user_chat_histories[user_id].append(SystemMessage(content=system_message))
+    try:
+        history = get_history_cache().get(user_id)
+        end = len(history)
+        if end and history[end - 1] == ('user', prompt):
+            end -= 1
+        return to_langchain_messages(history.window(HISTORY_WINDOW_MESSAGES, end))
+    except Exception as e:
+        print(f"Error retrieving chat history: {str(e)}")
+        return []
 
 def create_rag_chain_for_user(user_id):
     """
@@ -178,22 +370,219 @@ def create_rag_chain_for_user(user_id):
     """
     vectorstore = get_user_vectorstore(user_id)
     
-    retriever = vectorstore.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 3}
-    )
+    # Over-fetch candidates when a rerank stage will narrow them down to RETRIEVAL_K
+    candidate_k = RERANK_FETCH_K if RERANK_ENABLED else RETRIEVAL_K
+    
+    if HYBRID_RETRIEVAL:
+        candidate_retriever = HybridRetriever(
+            vector_retriever=vectorstore.as_retriever(
+                search_type="similarity",
+                search_kwargs={"k": max(HYBRID_FETCH_K, candidate_k)}
+            ),
+            lexical_index=get_user_lexical_index(user_id, vectorstore),
+            k=candidate_k,
+            fetch_k=max(HYBRID_FETCH_K, candidate_k)
+        )
+    else:
+        candidate_retriever = vectorstore.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": candidate_k}
+        )
+    
+    stages = []
+    if RERANK_ENABLED:
+        stages.append(("rerank", CrossEncoderReranker(
+            model_name=RERANK_MODEL,
+            top_n=RETRIEVAL_K,
+            batch_size=RERANK_BATCH_SIZE,
+            budget_ms=RERANK_BUDGET_MS
+        )))
+    if CONTEXT_COMPRESSION:
+        stages.append(("compress", ContextCompressor(
+            token_budget=CONTEXT_TOKEN_BUDGET,
+            min_sentence_overlap=CONTEXT_MIN_SENTENCE_OVERLAP
+        )))
+    
+    retriever = StagedRetriever(base_retriever=candidate_retriever, stages=stages, k=RETRIEVAL_K)
     
     history_aware_retriever = create_history_aware_retriever(
-        model, retriever, contextualize_prompt
+        contextualize_model, retriever, contextualize_prompt
     )
     
-    question_answer_chain = create_stuff_documents_chain(model, qa_prompt)
+    question_answer_chain = create_stuff_documents_chain(answer_model, qa_prompt)
     
     rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
     
     return rag_chain
 
-def url_to_vectorstore(url, user_id):
+# Built chains per user, with the Chroma client each was built on
+_user_chains = OrderedDict()
+_user_chains_lock = threading.Lock()
+
+def _user_store_client(user_id):
+    """The client behind the user's store (replaced when maintenance rebuilds the store)"""
+    return get_store_client(get_user_store_path(user_id))
+
+def get_user_rag_chain(user_id):
+    """
+    Get the user's RAG chain, rebuilt only when their store's client changed
+    """
+    key = str(user_id)
+    with _user_chains_lock:
+        entry = _user_chains.get(key)
+    if entry is not None and entry[0] is _user_store_client(user_id):
+        with _user_chains_lock:
+            if key in _user_chains:
+                _user_chains.move_to_end(key)
+        return entry[1]
+    
+    rag_chain = create_rag_chain_for_user(user_id)
+    with _user_chains_lock:
+        _user_chains[key] = (_user_store_client(user_id), rag_chain)
+        _user_chains.move_to_end(key)
+        while len(_user_chains) > CHAIN_CACHE_MAX_USERS:
+            _user_chains.popitem(last=False)
+    return rag_chain
+
+def warm_vectorstore(vectorstore):
+    """
+    Load the store's vector index by querying with one of its own embeddings
+    (Chroma loads it on the first query; no embeddings API call is made)
+    """
+    if isinstance(vectorstore, TenantVectorStore):
+        collection, where = vectorstore.store._collection, tenant_filter(vectorstore.user_id)
+    else:
+        collection, where = vectorstore._collection, None
+    sample = collection.get(where=where, limit=1, include=["embeddings"])
+    if sample["ids"]:
+        collection.query(query_embeddings=[list(sample["embeddings"][0])], n_results=1, where=where)
+
+def prewarm_user(user_id):
+    """
+    Load everything a user's first chat turn needs: store, lexical index,
+    chat history and chain (see prewarm.py)
+    """
+    vectorstore = get_user_vectorstore(user_id)
+    warm_vectorstore(vectorstore)
+    if HYBRID_RETRIEVAL:
+        get_user_lexical_index(user_id, vectorstore)
+    get_history_cache().get(user_id)
+    get_user_rag_chain(user_id)
+
+def drop_user_vectorstore(user_id):
+    """
+    Remove a user's vectors and lexical index from this node, e.g. once a
+    sharded deployment moved them to another node. Returns whether anything was removed.
+    """
+    with _user_chains_lock:
+        _user_chains.pop(str(user_id), None)
+    lexical_path = get_user_lexical_path(user_id)
+    forget_lexical_index(lexical_path)
+    
+    if VECTORSTORE_MODE == "shared":
+        with _seeded_tenants_lock:
+            _seeded_tenants.discard(user_id)
+        with store_lock(get_shared_vectorstore_path()):
+            collection = get_store_client(get_shared_vectorstore_path()).get_or_create_collection(
+                SHARED_COLLECTION_NAME, embedding_function=None
+            )
+            removed = bool(collection.get(where=tenant_filter(user_id), limit=1, include=[])["ids"])
+            collection.delete(where=tenant_filter(user_id))
+        shutil.rmtree(lexical_path, ignore_errors=True)
+        return removed
+    
+    path = get_user_vectorstore_path(user_id)
+    if not os.path.isdir(path):
+        return False
+    with store_lock(path):
+        close_store_client(path)
+        shutil.rmtree(path)
+    return True
+
+def delete_documents_from_user_vectorstore(user_id, ids):
+    """
+    Remove chunks from the user's vectorstore and lexical index
+    """
+    if not ids:
+        return
+    with store_lock(get_user_store_path(user_id)):
+        vectorstore = get_user_vectorstore(user_id)
+        vectorstore.delete(ids=list(ids))
+        get_user_lexical_index(user_id, vectorstore).remove(ids)
+
+def get_source_chunks(user_id, source):
+    """
+    Get the ids and content hashes of the chunks stored for one source
+    """
+    vectorstore = get_user_vectorstore(user_id)
+    stored = vectorstore.get(where={"source": source}, include=["metadatas"])
+    hashes = {(metadata or {}).get("content_hash") for metadata in stored["metadatas"]}
+    return stored["ids"], hashes
+
+def split_url_content(url, content, content_hash=None):
+    """
+    Split crawled page content into chunks tagged with their source URL
+    """
+    metadata = {
+        "source": url,
+        "content_hash": content_hash or hashlib.sha256(content.encode("utf-8")).hexdigest()
+    }
+    return chunk_text(content, metadata)
+
+def get_document_record(user_id, source):
+    """
+    Get the catalog row for one of the user's sources (None when not recorded)
+    """
+    return execute_query(get_document_by_source_query(), params=(user_id, source), fetch_one=True)
+
+def record_document(user_id, source, source_type, content_hash, chunk_ids, size_bytes=None, file_path=None):
+    """
+    Insert or replace the catalog row for one of the user's sources
+    """
+    return execute_query(
+        upsert_document_query(),
+        params=(user_id, source, source_type, content_hash, list(chunk_ids), len(chunk_ids), size_bytes, file_path),
+        fetch_one=True
+    )
+
+def ingest_document(user_id, source, source_type, documents, content_hash, size_bytes=None, file_path=None, force=False):
+    """
+    Add a document's chunks and record them in the documents catalog. If the
+    source was ingested before, its old chunks are removed by id afterwards.
+    Unchanged content (same hash) is skipped unless force is set.
+    Returns "added", "updated" or "unchanged".
+    """
+    record = get_document_record(user_id, source)
+    if record:
+        old_ids = list(record["chunk_ids"] or [])
+        unchanged = record["content_hash"] == content_hash
+    else:
+        # Sources ingested before the catalog existed are found by metadata
+        old_ids, old_hashes = get_source_chunks(user_id, source)
+        unchanged = content_hash in old_hashes
+    
+    if unchanged and not force:
+        if not record:
+            record_document(user_id, source, source_type, content_hash, old_ids, size_bytes, file_path)
+        return "unchanged"
+    
+    new_ids = add_documents_to_user_vectorstore(user_id, documents) if documents else []
+    record_document(user_id, source, source_type, content_hash, new_ids, size_bytes, file_path)
+    delete_documents_from_user_vectorstore(user_id, old_ids)
+    return "updated" if record or old_ids else "added"
+
+def delete_document(user_id, document_id):
+    """
+    Remove a catalogued document: its chunks by id (no collection scan), then
+    its catalog row. Returns the deleted row, or None if it does not exist.
+    """
+    record = execute_query(get_document_by_id_query(), params=(document_id, user_id), fetch_one=True)
+    if not record:
+        return None
+    delete_documents_from_user_vectorstore(user_id, record["chunk_ids"] or [])
+    return execute_query(delete_document_query(), params=(document_id, user_id), fetch_one=True)
+
+def url_to_vectorstore(url, user_id, force=False):
     """
     Add URL content to a user-specific vectorstore
     """
@@ -203,64 +592,99 @@ def url_to_vectorstore(url, user_id):
         print(f"Failed to retrieve content from {url}")
         return False
     
-    # Get the user's vectorstore
-    vectorstore = get_user_vectorstore(user_id)
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    split_docs = split_url_content(url, content, content_hash)
     
-    # Wrap the content in the langchain document format
-    document = Document(
-        page_content=content,
-        metadata={"source": url}
-    )
+    # Add the chunks to the user's vectorstore, lexical index and documents catalog
+    status = ingest_document(user_id, url, "url", split_docs, content_hash, size_bytes=len(content.encode("utf-8")), force=force)
     
-    # Split the document into chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separators=["\n\n", "\n", " ", ""]
-    )
+    print(f"Successfully ingested content from {url} for user {user_id} ({status}).")
+    return True
+
+def urls_to_vectorstore(urls, user_id):
+    """
+    Bulk-ingest many URLs for a user. Pages whose content hash matches what is
+    already stored are skipped; changed pages replace their old chunks.
+    Returns {url: "added" | "updated" | "unchanged" | "failed"}.
+    """
+    pages = webcrawl_many(urls)
     
-    split_docs = text_splitter.split_documents([document])
+    statuses = {}
+    pending = []
+    new_docs = []
+    for url in urls:
+        page = pages.get(url)
+        if not page:
+            statuses[url] = "failed"
+            continue
+        
+        record = get_document_record(user_id, url)
+        if record:
+            old_ids = list(record["chunk_ids"] or [])
+            old_hashes = {record["content_hash"]}
+        else:
+            old_ids, old_hashes = get_source_chunks(user_id, url)
+        if page["content_hash"] in old_hashes:
+            if not record:
+                record_document(user_id, url, "url", page["content_hash"], old_ids, len(page["content"].encode("utf-8")))
+            statuses[url] = "unchanged"
+            continue
+        
+        chunks = split_url_content(url, page["content"], page["content_hash"])
+        pending.append((url, page, old_ids, len(chunks)))
+        new_docs.extend(chunks)
+        statuses[url] = "updated" if old_ids else "added"
     
-    # Add the chunks to the user's vectorstore
-    vectorstore.add_documents(split_docs)
+    # One add call so the embedding requests are batched across pages
+    if new_docs:
+        new_ids = add_documents_to_user_vectorstore(user_id, new_docs)
+        offset = 0
+        for url, page, old_ids, chunk_count in pending:
+            chunk_ids = new_ids[offset:offset + chunk_count]
+            offset += chunk_count
+            record_document(user_id, url, "url", page["content_hash"], chunk_ids, len(page["content"].encode("utf-8")))
+            delete_documents_from_user_vectorstore(user_id, old_ids)
     
-    print(f"Successfully added content from {url} to user {user_id}'s vectorstore.")
-    return True
+    print(f"Bulk ingest for user {user_id}: {len(new_docs)} chunks from {len(pending)} pages")
+    return statuses
 
 def chatbot_talk(prompt, user_id):
     """
     Process a chat message for a specific user
     """
-    # Get the user's chat history from cache/database
-    chat_history = get_user_chat_history(user_id)
+    reset_stage_timings()
     
-    # Create RAG chain for this user
-    rag_chain = create_rag_chain_for_user(user_id)
+    # Get the user's recent chat history from cache/database; server.py saves
+    # the prompt before calling us, and it is the input, not history
+    with time_stage("history"):
+        chat_history = get_user_chat_history(user_id, prompt)
+    
+    # Get (or build) the RAG chain for this user
+    with time_stage("build_chain"):
+        rag_chain = get_user_rag_chain(user_id)
     
     # Process the user's prompt through the retrieval chain
-    result = rag_chain.invoke({"input": prompt, "chat_history": chat_history})
+    with time_stage("chain"):
+        result = rag_chain.invoke({"input": prompt, "chat_history": chat_history})
 
     # Clean up the output
     clean_response = result["answer"].replace("▪", "•")
 
     # Display the AI's response (for debugging)
     print(f"\nAI response for user {user_id}: {clean_response}\n")
+    print(f"Stage timings for user {user_id} (ms): " + ", ".join(f"{name}={ms:.1f}" for name, ms in get_stage_timings().items()))
 
-    # Update the user's chat history cache
-    # Note: The actual database saving is handled in server.py
-    update_user_chat_history_cache(user_id, prompt, result["answer"])
-    
+    # The history cache is updated when server.py saves both messages
     return clean_response
 
 def clear_user_chat_history_cache(user_id):
     """
-    Clear the in-memory chat history cache for a user
+    Drop this worker's cached chat history for a user
     """
-    if user_id in user_chat_histories:
-        user_chat_histories[user_id] = []
+    get_history_cache().invalidate(user_id)
 
 # Export functions for use in server.py
-__all__ = ['chatbot_talk', 'url_to_vectorstore', 'get_user_vectorstore', 'clear_user_chat_history_cache']
+__all__ = ['chatbot_talk', 'url_to_vectorstore', 'urls_to_vectorstore', 'get_user_vectorstore', 'add_documents_to_user_vectorstore', 'ingest_document', 'delete_document', 'clear_user_chat_history_cache']
 
 # Entry point for standalone usage
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Optional, Sequence
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+
+from timing import record_stage
+
+# Loaded once per process, on first use
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+# Running estimate of per-pair scoring cost, used to skip reranking up front
+_cost_estimate = {"ms_per_pair": 0.0}
+
+
+def get_cross_encoder(model_name):
+    """
+    Load the CPU cross-encoder once per process
+    """
+    global _cross_encoder
+    if _cross_encoder is None:
+        with _cross_encoder_lock:
+            if _cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+
+                start = time.perf_counter()
+                _cross_encoder = CrossEncoder(model_name, device="cpu", max_length=512)
+                print(f"Loaded reranker {model_name} in {time.perf_counter() - start:.2f}s")
+    return _cross_encoder
+
+
+class CrossEncoderReranker(BaseDocumentCompressor):
+    """
+    Rescore over-fetched candidates with a local cross-encoder and keep the top_n.
+
+    Scoring runs in batches against a latency budget. When the budget is (or is
+    predicted to be) exceeded, the candidates keep their vector order instead.
+    """
+
+    model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    top_n: int = 3
+    batch_size: int = 16
+    budget_ms: float = 250.0
+    max_chars: int = 1200
+
+    def _fallback(self, documents, reason):
+        print(f"Reranker fallback to vector order ({reason})")
+        record_stage("rerank_fallback", 0.0)
+        return list(documents[:self.top_n])
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if len(documents) <= 1:
+            return list(documents)
+
+        estimate = _cost_estimate["ms_per_pair"] * len(documents)
+        if estimate > self.budget_ms:
+            # Decay the estimate so one slow call cannot disable reranking for good
+            _cost_estimate["ms_per_pair"] *= 0.9
+            return self._fallback(documents, f"estimated {estimate:.0f}ms > budget {self.budget_ms:.0f}ms")
+
+        model = get_cross_encoder(self.model_name)
+        pairs = [(query, doc.page_content[:self.max_chars]) for doc in documents]
+
+        start = time.perf_counter()
+        scores = []
+        for offset in range(0, len(pairs), self.batch_size):
+            batch = pairs[offset:offset + self.batch_size]
+            scores.extend(float(score) for score in model.predict(batch, batch_size=self.batch_size))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms > self.budget_ms and len(scores) < len(pairs):
+                _cost_estimate["ms_per_pair"] = elapsed_ms / len(scores)
+                return self._fallback(documents, f"{elapsed_ms:.0f}ms over budget")
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        per_pair = elapsed_ms / len(pairs)
+        previous = _cost_estimate["ms_per_pair"]
+        _cost_estimate["ms_per_pair"] = per_pair if not previous else 0.8 * previous + 0.2 * per_pair
+
+        ranked = sorted(zip(scores, range(len(documents))), key=lambda item: item[0], reverse=True)
+        return [documents[i] for _, i in ranked[:self.top_n]]
@@ -0,0 +1,165 @@
+import gzip
+import zlib
+
+import orjson
+from flask import Response, request
+from flask.json.provider import JSONProvider
+
+from config import (
+    COMPRESS_MIN_BYTES,
+    COMPRESS_GZIP_LEVEL,
+    COMPRESS_BROTLI_QUALITY,
+    HISTORY_STREAM_MIN_MESSAGES
+)
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+STREAM_BATCH_SIZE = 1000
+
+
+def _default(obj):
+    # Anything orjson cannot serialize natively (Decimal, sets, ...)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, used by jsonify and request.get_json"""
+
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=self.option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_default, option=self.option)
+        return self._app.response_class(body, mimetype="application/json")
+
+
+def negotiate_encoding():
+    """Pick br or gzip from the request's Accept-Encoding (None for identity)"""
+    accepted = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        fields = part.strip().split(";")
+        name = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name] = quality
+
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def _compress_stream(chunks, encoding):
+    """Compress an iterable of byte chunks incrementally"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        for chunk in chunks:
+            out = compressor.process(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+
+
+def compress_response(response):
+    """after_request hook: compress JSON/text bodies above COMPRESS_MIN_BYTES"""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_compression(app):
+    app.json = OrjsonProvider(app)
+    app.after_request(compress_response)
+
+
+def _history_chunks(fields, chat_history):
+    head = orjson.dumps(fields, default=_default)
+    # Splice the history array into the object: {"chat_history":[...],<fields>}
+    yield b'{"chat_history":['
+    for start in range(0, len(chat_history), STREAM_BATCH_SIZE):
+        batch = orjson.dumps(chat_history[start:start + STREAM_BATCH_SIZE], default=_default)
+        if start:
+            yield b","
+        yield batch[1:-1]
+    yield b"]"
+    if len(head) > 2:
+        yield b"," + head[1:]
+    else:
+        yield b"}"
+
+
+def history_response(fields, chat_history, status=200):
+    """
+    JSON response carrying a chat history. Large histories are streamed with
+    chunked transfer encoding (compressed on the fly when the client accepts it).
+    """
+    if len(chat_history) < HISTORY_STREAM_MIN_MESSAGES:
+        response = Response(
+            orjson.dumps({"chat_history": chat_history, **fields}, default=_default),
+            status=status,
+            mimetype="application/json"
+        )
+        return response
+
+    encoding = negotiate_encoding()
+    chunks = _history_chunks(fields, chat_history)
+    if encoding:
+        chunks = _compress_stream(chunks, encoding)
+
+    response = Response(chunks, status=status, mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
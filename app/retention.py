@@ -0,0 +1,275 @@
+"""
+Chat retention: per-user message caps, an age limit and (for the
+partitioned chats table) monthly partition upkeep.
+
+Deletes run in bounded batches so a pass never holds long locks or builds
+a huge transaction. The job uses its own connection rather than the
+request-path one in db/connection.py.
+
+    python retention.py          # one pass with the configured limits
+"""
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from config import (
+    RETENTION_MAX_MESSAGES_PER_USER,
+    RETENTION_MAX_AGE_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_PAUSE_SECONDS,
+    RETENTION_INTERVAL_SECONDS,
+    CHATS_PARTITIONS_AHEAD
+)
+from db.connection import create_connection
+from db.queries.chats import (
+    delete_chats_by_order_range_query,
+    delete_chats_older_than_batch_query,
+    get_retention_cutoff_order_query,
+    get_first_message_order_by_user_query,
+    get_user_ids_after_query,
+    get_chats_is_partitioned_query,
+    get_chats_partitions_query,
+    create_chats_partition_query,
+    create_chats_partition_from_default_query,
+    get_partition_has_rows_between_query,
+    drop_chats_partition_query,
+    bump_chat_history_version_query,
+    bump_all_chat_history_versions_query
+)
+
+PARTITION_NAME_RE = re.compile(r"^chats_p(\d{4})(\d{2})$")
+DEFAULT_PARTITION = "chats_default"
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def next_month(moment):
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def partition_name(moment):
+    return f"chats_p{moment.year:04d}{moment.month:02d}"
+
+
+def partition_bounds(name):
+    """[start, end) of a monthly partition, or None for other partitions (e.g. chats_default)"""
+    match = PARTITION_NAME_RE.match(name)
+    if not match:
+        return None
+    start = datetime(int(match.group(1)), int(match.group(2)), 1)
+    return start, next_month(start)
+
+
+def _fetch_one(conn, query, params=None):
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.fetchone()
+
+
+def _fetch_all(conn, query, params=None):
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
+
+
+def _execute(conn, query, params=None):
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.rowcount
+
+
+def is_partitioned(conn):
+    return _fetch_one(conn, get_chats_is_partitioned_query())["partitioned"]
+
+
+def ensure_partitions(conn, start, end):
+    """
+    Create the monthly partitions covering [start, end); returns the new names.
+    Rows of a month that already landed in the default partition are moved
+    into the month's new partition.
+    """
+    existing = {row["partition_name"] for row in _fetch_all(conn, get_chats_partitions_query())}
+    created = []
+    month = month_start(start)
+    while month < end:
+        name = partition_name(month)
+        if name not in existing:
+            bounds = (month, next_month(month))
+            if DEFAULT_PARTITION in existing and _fetch_one(
+                conn, get_partition_has_rows_between_query(DEFAULT_PARTITION), bounds
+            )["has_rows"]:
+                _execute(
+                    conn, create_chats_partition_from_default_query(name, DEFAULT_PARTITION),
+                    {"start": bounds[0], "end": bounds[1]}
+                )
+                print(f"⚡ Moved {month:%Y-%m} rows from {DEFAULT_PARTITION} into {name}")
+            else:
+                _execute(conn, create_chats_partition_query(name), bounds)
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def drop_expired_partitions(conn, cutoff):
+    """Drop monthly partitions whose rows are all older than cutoff"""
+    dropped = []
+    for row in _fetch_all(conn, get_chats_partitions_query()):
+        bounds = partition_bounds(row["partition_name"])
+        if bounds and bounds[1] <= cutoff:
+            _execute(conn, drop_chats_partition_query(row["partition_name"]))
+            dropped.append(row["partition_name"])
+    return dropped
+
+
+def enforce_message_cap(conn, max_messages, batch_size, pause_seconds=0.0):
+    """
+    Keep each user's newest max_messages messages. Users are walked by id and
+    each user's excess is deleted in message_order ranges of batch_size.
+    Returns (users trimmed, messages deleted).
+    """
+    users_trimmed = 0
+    deleted = 0
+    last_user_id = 0
+    while True:
+        user_ids = [row["id"] for row in _fetch_all(conn, get_user_ids_after_query(), (last_user_id, batch_size))]
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+
+        for user_id in user_ids:
+            cutoff = _fetch_one(conn, get_retention_cutoff_order_query(), (user_id, max_messages))
+            if not cutoff:
+                continue
+            first_order = _fetch_one(conn, get_first_message_order_by_user_query(), (user_id,))["first_order"]
+            lower = first_order
+            stop = cutoff["cutoff_order"] + 1
+            while lower < stop:
+                upper = min(lower + batch_size, stop)
+                deleted += _execute(conn, delete_chats_by_order_range_query(), (user_id, lower, upper))
+                lower = upper
+                if pause_seconds:
+                    time.sleep(pause_seconds)
+            # Cached histories in every worker are now stale
+            _fetch_one(conn, bump_chat_history_version_query(), (user_id, user_id))
+            users_trimmed += 1
+    return users_trimmed, deleted
+
+
+def enforce_max_age(conn, cutoff, batch_size, pause_seconds=0.0):
+    """Delete messages created before cutoff, oldest first, batch_size rows at a time"""
+    deleted = 0
+    touched_users = set()
+    while True:
+        rows = _fetch_all(conn, delete_chats_older_than_batch_query(), (cutoff, cutoff, batch_size))
+        deleted += len(rows)
+        touched_users.update(row["user_id"] for row in rows)
+        if len(rows) < batch_size:
+            break
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    for user_id in touched_users:
+        _fetch_one(conn, bump_chat_history_version_query(), (user_id, user_id))
+    return deleted
+
+
+def run_retention(
+    conn=None,
+    max_messages=RETENTION_MAX_MESSAGES_PER_USER,
+    max_age_days=RETENTION_MAX_AGE_DAYS,
+    batch_size=RETENTION_BATCH_SIZE,
+    pause_seconds=RETENTION_BATCH_PAUSE_SECONDS,
+    partitions_ahead=CHATS_PARTITIONS_AHEAD,
+    now=None
+):
+    """
+    One retention pass; returns a summary dict. Partition upkeep always runs
+    on a partitioned table, limits set to 0 are skipped.
+    """
+    own_connection = conn is None
+    conn = conn or create_connection()
+    now = now or datetime.now()
+    start = time.perf_counter()
+    summary = {
+        "partitioned": False,
+        "partitions_created": [],
+        "partitions_dropped": [],
+        "users_trimmed": 0,
+        "deleted_for_cap": 0,
+        "deleted_for_age": 0
+    }
+    try:
+        summary["partitioned"] = is_partitioned(conn)
+        if summary["partitioned"]:
+            # A failed month must not cost the pass its deletes; the next pass retries it
+            try:
+                summary["partitions_created"] = ensure_partitions(
+                    conn, now, next_month(month_start(now) + timedelta(days=31 * partitions_ahead))
+                )
+            except Exception as e:
+                print(f"❌ Chats partition upkeep failed: {e}")
+
+        if max_age_days > 0:
+            cutoff = now - timedelta(days=max_age_days)
+            if summary["partitioned"]:
+                # Whole months go by DROP; only the boundary month needs row deletes
+                summary["partitions_dropped"] = drop_expired_partitions(conn, cutoff)
+                if summary["partitions_dropped"]:
+                    _fetch_one(conn, bump_all_chat_history_versions_query())
+            summary["deleted_for_age"] = enforce_max_age(conn, cutoff, batch_size, pause_seconds)
+
+        if max_messages > 0:
+            summary["users_trimmed"], summary["deleted_for_cap"] = enforce_message_cap(
+                conn, max_messages, batch_size, pause_seconds
+            )
+    finally:
+        if own_connection:
+            conn.close()
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+_stop = threading.Event()
+_thread = None
+_lock = threading.Lock()
+
+
+def _retention_loop(interval_seconds, enforce_limits):
+    while not _stop.is_set():
+        try:
+            # Without limits a pass only keeps the monthly partitions ahead of time
+            summary = run_retention() if enforce_limits else run_retention(max_messages=0, max_age_days=0)
+            if enforce_limits or summary["partitions_created"]:
+                print(
+                    f"⚡ Retention pass: {summary['deleted_for_cap']} capped, {summary['deleted_for_age']} expired, "
+                    f"{len(summary['partitions_created'])} partitions created, "
+                    f"{len(summary['partitions_dropped'])} partitions dropped in {summary['seconds']}s"
+                )
+        except Exception as e:
+            print(f"❌ Retention pass failed: {e}")
+        _stop.wait(interval_seconds)
+
+
+def start_retention_job(interval_seconds=RETENTION_INTERVAL_SECONDS, enforce_limits=True):
+    """
+    Run retention passes on a background thread every interval_seconds;
+    with enforce_limits off they only do partition upkeep
+    """
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _stop.clear()
+        _thread = threading.Thread(target=_retention_loop, args=(interval_seconds, enforce_limits), name="retention", daemon=True)
+        _thread.start()
+
+
+def stop_retention_job():
+    _stop.set()
+
+
+if __name__ == "__main__":
+    print(run_retention())
@@ -0,0 +1,87 @@
+from typing import Any, List, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.retrievers import BaseRetriever
+
+from timing import time_stage
+
+
+def _doc_key(doc):
+    return getattr(doc, "id", None) or doc.page_content
+
+
+def reciprocal_rank_fusion(ranked_lists, k=60):
+    """
+    Fuse several ranked lists of documents: score(d) = sum(1 / (k + rank)).
+    Documents are matched by id (falling back to their text).
+    """
+    scores = {}
+    docs = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Vector similarity search fused with BM25 lexical search (reciprocal-rank fusion).
+
+    Lexical matching recovers exact identifiers, part numbers and names that
+    embeddings tend to blur.
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_index: Any
+    k: int = 3
+    fetch_k: int = 10
+    rrf_k: int = 60
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with time_stage("vector_search"):
+            vector_docs = self.vector_retriever.invoke(
+                query, config={"callbacks": run_manager.get_child()}
+            )
+
+        with time_stage("lexical_search"):
+            lexical_docs = []
+            for doc_id, score in self.lexical_index.search(query, self.fetch_k):
+                entry = self.lexical_index.get(doc_id)
+                if entry is not None:
+                    text, metadata = entry
+                    lexical_docs.append(Document(id=doc_id, page_content=text, metadata=metadata))
+
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], k=self.rrf_k)[:self.k]
+
+
+class StagedRetriever(BaseRetriever):
+    """
+    Candidate retrieval followed by named post-processing stages (rerank, ...),
+    with the time spent in each stage recorded for the current request.
+    """
+
+    base_retriever: BaseRetriever
+    stages: List[Tuple[str, BaseDocumentCompressor]] = []
+    k: int = 3
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with time_stage("retrieve"):
+            documents = self.base_retriever.invoke(
+                query, config={"callbacks": run_manager.get_child()}
+            )
+
+        for name, stage in self.stages:
+            with time_stage(name):
+                documents = stage.compress_documents(
+                    documents, query, callbacks=run_manager.get_child()
+                )
+
+        return list(documents)[:self.k]
@@ -0,0 +1,157 @@
+"""
+Request router for sharded deployments (see sharding.py).
+
+Sits in front of the server.py nodes and forwards each request to the node
+that owns its user, read from the JWT. Requests without a token (register,
+login, health checks, CORS preflights) go to the nodes in turn. Bodies and
+responses are streamed through unchanged, uploads included.
+
+Three local nodes and a router, all from one checkout:
+
+    export SHARD_NODES="a=http://127.0.0.1:8124,b=http://127.0.0.1:8125,c=http://127.0.0.1:8126"
+    NODE_NAME=a PORT=8124 VECTORSTORES_DIR=db/vectorstores/node_a python server.py
+    NODE_NAME=b PORT=8125 VECTORSTORES_DIR=db/vectorstores/node_b python server.py
+    NODE_NAME=c PORT=8126 VECTORSTORES_DIR=db/vectorstores/node_c python server.py
+    ROUTER_PORT=8123 python router.py
+
+GET /router/ring?user_id=N shows where a user lives; GET /router/health
+checks every node.
+"""
+import itertools
+import threading
+
+import requests
+from flask import Flask, Response, jsonify, request
+
+from auth import verify_jwt_token
+from config import ROUTER_PORT, ROUTER_TIMEOUT_SECONDS
+from sharding import get_ring
+
+METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+# Headers that describe one connection, not the message (RFC 9110 section 7.6.1)
+HOP_BY_HOP = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host", "content-length"
+})
+STREAM_CHUNK_BYTES = 64 * 1024
+
+app = Flask(__name__)
+ring = get_ring()
+
+_session = requests.Session()
+_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=64))
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=64))
+_round_robin = itertools.cycle(sorted(ring.nodes)) if ring else None
+_round_robin_lock = threading.Lock()
+
+
+class _Body:
+    """The incoming body with its length, so requests sends Content-Length rather than chunks"""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+def request_user_id():
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    payload = verify_jwt_token(auth_header.split(' ')[1])
+    return payload['user_id'] if payload else None
+
+
+def pick_node():
+    """(node name, user_id or None) for the current request"""
+    user_id = request_user_id()
+    if user_id is not None:
+        return ring.node_for(user_id), user_id
+    # Invalid tokens land here too; the node answers them with 401
+    with _round_robin_lock:
+        return next(_round_robin), None
+
+
+@app.route('/router/ring', methods=['GET'])
+def ring_info():
+    info = {"nodes": ring.nodes}
+    user_id = request.args.get('user_id')
+    if user_id is not None:
+        info["user_id"] = user_id
+        info["node"] = ring.node_for(user_id)
+    return jsonify(info)
+
+
+@app.route('/router/health', methods=['GET'])
+def health():
+    nodes = {}
+    for name, url in ring.nodes.items():
+        try:
+            nodes[name] = _session.get(f"{url}/healthz", timeout=2).status_code == 200
+        except requests.RequestException:
+            nodes[name] = False
+    return jsonify({"nodes": nodes}), 200 if all(nodes.values()) else 503
+
+
+@app.route('/', defaults={'path': ''}, methods=METHODS)
+@app.route('/<path:path>', methods=METHODS)
+def forward(path):
+    # Node-to-node endpoints are never reachable through the router
+    if path.startswith('internal/'):
+        return jsonify({"error": "Not found"}), 404
+
+    node, _ = pick_node()
+    url = f"{ring.nodes[node]}/{path}"
+    if request.query_string:
+        url += "?" + request.query_string.decode("latin-1")
+
+    headers = {key: value for key, value in request.headers.items() if key.lower() not in HOP_BY_HOP}
+    forwarded_for = request.headers.get('X-Forwarded-For')
+    headers['X-Forwarded-For'] = f"{forwarded_for}, {request.remote_addr}" if forwarded_for else request.remote_addr
+    headers['X-Forwarded-Host'] = request.host
+
+    if request.content_length:
+        body = _Body(request.stream, request.content_length)
+    elif request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        body = iter(lambda: request.stream.read(STREAM_CHUNK_BYTES), b"")
+    else:
+        body = None
+
+    try:
+        upstream = _session.request(
+            request.method,
+            url,
+            headers=headers,
+            data=body,
+            stream=True,
+            allow_redirects=False,
+            timeout=(5, ROUTER_TIMEOUT_SECONDS)
+        )
+    except requests.RequestException as e:
+        print(f"❌ Forwarding to node {node} failed: {e}")
+        error_response = jsonify({"error": "Service node unavailable", "node": node})
+        return error_response, 502
+
+    response = Response(
+        upstream.raw.stream(STREAM_CHUNK_BYTES, decode_content=False),
+        status=upstream.status_code,
+        headers=[
+            (key, value) for key, value in upstream.raw.headers.items()
+            if key.lower() not in HOP_BY_HOP or key.lower() == "content-length"
+        ]
+    )
+    response.call_on_close(upstream.close)
+    response.headers['X-Shard-Node'] = node
+    return response
+
+
+if __name__ == '__main__':
+    if ring is None:
+        raise SystemExit("❌ SHARD_NODES is not set; the router needs the list of nodes")
+    print(f"⚡ Routing to {len(ring.nodes)} nodes: {', '.join(ring.nodes)}")
+    app.run(debug=False, host='0.0.0.0', port=ROUTER_PORT, threaded=True)
@@ -1,18 +1,59 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from rag_chain import chatbot_talk, url_to_vectorstore
-from pdf_converter import add_pdf_to_vectorstore
+from flask import Flask, request, jsonify, send_file
+from timing import get_stage_timings, format_server_timing
 import os
+import hmac
+import json
+import math
+import shutil
+import tempfile
+import time
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-from config import JWT_SECRET
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import LimitedStream
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    CRAWL_MAX_URLS,
+    CHAT_LATENCY_BUDGET_SECONDS,
+    CHAT_CONCURRENCY,
+    CHAT_QUEUE_SIZE,
+    CHAT_MAX_QUEUE_SECONDS,
+    CHAT_PER_USER_LIMIT,
+    INGEST_CONCURRENCY,
+    INGEST_QUEUE_SIZE,
+    INGEST_MAX_QUEUE_SECONDS,
+    INGEST_PER_USER_LIMIT,
+    WARMUP_ON_START,
+    MAX_CONTENT_LENGTH,
+    MAX_UPLOAD_FILES,
+    UPLOAD_CONCURRENCY,
+    RETENTION_ENABLED,
+    VECTORSTORE_MODE,
+    VECTORSTORES_DIR,
+    SHARED_VECTORSTORE_PATH,
+    SHARED_COLLECTION_NAME,
+    INTERNAL_TOKEN,
+    PORT
+)
+from admission import AdmissionController, AdmissionRejected
+from llm import latency_budget, LLMDeadlineExceeded, LLMUnavailable
+from responses import init_compression, history_response
+from cors import init_cors
+from profiling import init_profiling
+from quota import get_quota
+import lifecycle
+from auth import (
+    AuthBusyError,
+    hash_password,
+    check_password,
+    generate_jwt_token,
+    verify_jwt_token
+)
 from db.connection import get_db_connection, execute_query, close_connection  
 from db.queries.users import (
-    create_new_user_query,
+    register_user_query,
     get_all_users_query,
     get_user_by_id_query,
     get_user_by_username_query,
-    get_user_by_email_query,
     get_user_login_query,
     get_newest_user_query,
     update_user_email_query,
@@ -22,89 +63,65 @@ from db.queries.users import (
     
 )
 from db.queries.chats import (
-    create_new_chat_message_query,
-    get_all_chats_by_user_query,
-    get_last_message_order_by_user_query,
-    delete_all_chats_by_user_query
+    append_chat_message_query,
+    clear_chats_by_user_query
+)
+from history_cache import get_history_cache
+import prewarm
+from sharding import check_node, get_ring, owns_user, owner_of
+from uploads import (
+    UploadRequest,
+    UploadRejected,
+    get_user_upload_dir,
+    discard_incoming,
+    store_upload,
+    ingest_upload
 )
+from db.queries.documents import (
+    get_documents_by_user_query,
+    get_document_by_id_query,
+    count_documents_by_file_path_query
+)
+
+from psycopg2 import errors as pg_errors
 
-# JWT imports
-import jwt
-from datetime import datetime, timedelta
 from functools import wraps
 
 app = Flask(__name__)
 
-# Configure CORS for both development and production
-CORS(
-    app,
-    resources={
-        r"/*": {
-            "origins": [
-                "http://localhost:5173",  # Development
-                "http://127.0.0.1:5173",  # Development alternative
-                "https://ragit.netlify.app"  # Production
-            ],
-            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
-            "supports_credentials": True
-        }
-    }
-)
+# Uploads stream into per-user storage while being hashed; oversized requests get 413
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
-# Helper function for CORS headers
-def get_cors_origin():
-    """Get appropriate CORS origin based on request"""
-    origin = request.headers.get('Origin')
-    allowed_origins = [
-        "http://localhost:5173",
-        "http://127.0.0.1:5173", 
-        "https://ragit.netlify.app"
-    ]
-    
-    if origin in allowed_origins:
-        return origin
-    
-    # Default fallback
-    return "https://ragit.netlify.app"
-
-# JWT Helper Functions
-def generate_jwt_token(user_id, username):
-    """Generate JWT token for authenticated user"""
-    payload = {
-        'user_id': user_id,
-        'username': username,
-        'exp': datetime.utcnow() + timedelta(hours=24)  # Token expires in 24 hours
-    }
-    return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
-
-def verify_jwt_token(token):
-    """Verify and decode JWT token"""
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None  # Token expired
-    except jwt.InvalidTokenError:
-        return None  # Invalid token
+@app.errorhandler(413)
+def request_too_large(e):
+    error_response = jsonify({'error': f"Request too large (max {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB)"})
+    return error_response, 413
+
+# orjson for every JSON response, gzip/brotli above a size threshold
+init_compression(app)
+
+# CORS for every response; preflights are answered before routing and auth
+init_cors(app)
+
+# Opt-in sampling profiler (no-op unless PROFILING_ENABLED)
+init_profiling(app)
+
+# A sharded node must know its own name, or it would claim every user
+check_node()
+
+@app.before_request
+def mark_request_start():
+    request.received_at = time.monotonic()
 
 def require_auth(f):
     """Decorator to require authentication for routes"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Handle OPTIONS requests for CORS
-        if request.method == 'OPTIONS':
-            response = jsonify({"status": "preflight"})
-            response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-            response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-            response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-            return response
-        
         # Get token from Authorization header
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
             error_response = jsonify({"error": "Authentication required"})
-            error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
             return error_response, 401
         
         token = auth_header.split(' ')[1]
@@ -112,48 +129,61 @@ def require_auth(f):
         
         if not payload:
             error_response = jsonify({"error": "Invalid or expired token"})
-            error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
             return error_response, 401
         
         # Add user info to request context
         request.user_id = payload['user_id']
         request.username = payload['username']
         
+        # In a sharded deployment the user's data lives on one node (router.py sends requests there)
+        if not owns_user(request.user_id):
+            error_response = jsonify({"error": "User is served by another node", "node": owner_of(request.user_id)})
+            return error_response, 421
+        
         return f(*args, **kwargs)
     return decorated_function
 
+# Admission control: bounded concurrency and queues per endpoint class
+admission = AdmissionController()
+admission.add_class("chat", CHAT_CONCURRENCY, CHAT_QUEUE_SIZE, CHAT_MAX_QUEUE_SECONDS, CHAT_PER_USER_LIMIT)
+admission.add_class("ingest", INGEST_CONCURRENCY, INGEST_QUEUE_SIZE, INGEST_MAX_QUEUE_SECONDS, INGEST_PER_USER_LIMIT)
+
+def admission_controlled(class_name):
+    """Decorator to run a route under admission control (use below require_auth)"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                with admission.admit(class_name, request.user_id):
+                    return f(*args, **kwargs)
+            except AdmissionRejected as e:
+                error_response = jsonify({"error": e.reason})
+                error_response.headers.add('Retry-After', str(e.retry_after))
+                return error_response, e.status
+        return decorated_function
+    return decorator
+
 def save_chat_message(user_id, message_text, sender):
     """Save a single chat message to the database"""
     try:
-        # Get the last message order for this user
-        last_order_query = get_last_message_order_by_user_query()
-        result = execute_query(last_order_query, params=(user_id,), fetch_one=True)
-        next_order = (result['last_order'] if result and result['last_order'] else 0) + 1
-        
-        # Save the message
-        query = create_new_chat_message_query()
-        execute_query(query, params=(user_id, message_text, sender, next_order))
+        # Save the message after the user's last one and bump their history version
+        query = append_chat_message_query()
+        result = execute_query(query, params=(user_id, user_id, message_text, sender, user_id, user_id), fetch_one=True)
+        if not result:
+            return False
+        
+        # Keep this worker's cached history current without a reload
+        get_history_cache().apply_write(user_id, result['version'], (sender, message_text))
         return True
     except Exception as e:
         print(f"Error saving chat message: {str(e)}")
         return False
 
 def get_user_chat_history(user_id):
-    """Retrieve all chat messages for a user"""
+    """Retrieve all chat messages for a user (through the history cache the chat turn reads too)"""
     try:
-        query = get_all_chats_by_user_query()
-        messages = execute_query(query, params=(user_id,), fetch_all=True)
-        
         # Convert to the format expected by the frontend
-        chat_history = []
-        if messages:
-            for msg in messages:
-                chat_history.append({
-                    "sender": msg['sender'],
-                    "text": msg['message_text']
-                })
-        
-        return chat_history
+        return [{"sender": sender, "text": text} for sender, text in get_history_cache().get(user_id)]
     except Exception as e:
         print(f"Error retrieving chat history: {str(e)}")
         return []
@@ -162,15 +192,30 @@ def get_user_chat_history(user_id):
 def home():
     return "RAGIT Server is running!"
   
-@app.route('/register', methods=['POST', 'OPTIONS'])
+# Liveness: the process is up and serving requests
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"})
+
+# Readiness: heavy modules and clients are loaded and the database answers.
+# A cold process starts warming up on the first probe.
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    lifecycle.start_warmup()
+    ready, details = lifecycle.readiness()
+    return jsonify(details), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "admission": admission.metrics(),
+        "history_cache": get_history_cache().metrics(),
+        "prewarm": prewarm.metrics(),
+        "quota": get_quota().metrics()
+    })
+  
+@app.route('/register', methods=['POST'])
 def register_user():
-    if request.method == 'OPTIONS':
-        response = jsonify({"status": "preflight"})
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        return response
-
     try:
         data = request.get_json()
         
@@ -188,29 +233,28 @@ def register_user():
         if len(password) < 6:
             return jsonify({"error": "Password must be at least 6 characters long"}), 400
 
-        # Check if user/email exists
-        existing_user = execute_query(get_user_by_username_query(), params=(username,), fetch_one=True)
-        if existing_user:
+        # Hash password - this is the key security step (runs on the bounded KDF pool)
+        password_hash = hash_password(password)
+
+        # Create user (never store plain text password), set the vectorstore path
+        # and seed the initial chat message in a single statement. Duplicate
+        # usernames/emails are reported by the UNIQUE constraints, so there is no
+        # check-then-insert race.
+        try:
+            result = execute_query(
+                register_user_query(),
+                params=(username, email, password_hash, "Hello! How can I assist you today?"),
+                fetch_one=True,
+                raise_errors=True
+            )
+        except pg_errors.UniqueViolation as e:
+            if e.diag.constraint_name == 'users_email_key':
+                return jsonify({"error": "Email already exists"}), 409
             return jsonify({"error": "Username already exists"}), 409
 
-        existing_email = execute_query(get_user_by_email_query(), params=(email,), fetch_one=True)
-        if existing_email:
-            return jsonify({"error": "Email already exists"}), 409
-
-        # Hash password - this is the key security step
-        password_hash = generate_password_hash(password, method='pbkdf2:sha256', salt_length=8)
-
-        # Create user with hashed password (never store plain text password)
-        result = execute_query(create_new_user_query(), params=(username, email, password_hash, "temp_path"), fetch_one=True)
         user_id = result['id']
-
-        # Update vectorstore path
-        actual_vectorstore_path = f"db/vectorstores/user_{user_id}_vectorstore"
-        os.makedirs(actual_vectorstore_path, exist_ok=True)
-        execute_query("UPDATE users SET vectorstore_path=%s WHERE id=%s", params=(actual_vectorstore_path, user_id))
-
-        # Initial chat message
-        save_chat_message(user_id, "Hello! How can I assist you today?", "bot")
+        if VECTORSTORE_MODE == "per_user":
+            os.makedirs(result['vectorstore_path'], exist_ok=True)
 
         # Generate JWT token
         token = generate_jwt_token(user_id, username)
@@ -221,24 +265,20 @@ def register_user():
             "user_id": user_id, 
             "username": username
         })
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return response, 201
 
+    except AuthBusyError:
+        error_response = jsonify({"error": "Server busy, please retry"})
+        error_response.headers.add('Retry-After', '1')
+        return error_response, 503
+
     except Exception as e:
         print(f"Registration error: {e}")
         error_response = jsonify({"error": "Registration failed"})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
 
-@app.route('/login', methods=['POST', 'OPTIONS'])
+@app.route('/login', methods=['POST'])
 def login_user():
-    if request.method == 'OPTIONS':
-        response = jsonify({"status": "preflight"})
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        return response
-
     try:
         data = request.get_json()
         
@@ -252,8 +292,8 @@ def login_user():
         user = execute_query(get_user_login_query(), params=(username,), fetch_one=True)
         
         # Check if user exists and password is correct
-        # check_password_hash compares plain text password with stored hash
-        if not user or not check_password_hash(user['password_hash'], password):
+        # check_password compares plain text password with stored hash on the KDF pool
+        if not user or not check_password(user['password_hash'], password):
             return jsonify({"error": "Invalid username or password"}), 401
 
         # Generate JWT token for successful login
@@ -262,65 +302,58 @@ def login_user():
         # Get user's chat history
         chat_history = get_user_chat_history(user['id'])
 
-        response = jsonify({
+        # Load the user's store and chain in the background for their first question,
+        # on the node that owns the user (the router sends logins to any node)
+        if owns_user(user['id']):
+            prewarm.schedule_prewarm(user['id'])
+        else:
+            prewarm.forward_prewarm(user['id'], get_ring().nodes[owner_of(user['id'])])
+
+        response = history_response({
             "message": "Login successful", 
             "token": token, 
             "user_id": user['id'], 
-            "username": user['username'], 
-            "chat_history": chat_history
-        })
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
+            "username": user['username']
+        }, chat_history)
         return response, 200
 
+    except AuthBusyError:
+        error_response = jsonify({"error": "Server busy, please retry"})
+        error_response.headers.add('Retry-After', '1')
+        return error_response, 503
+
     except Exception as e:
         print(f"Login error: {e}")
         error_response = jsonify({"error": "Login failed"})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
 
-@app.route('/chat-history', methods=['GET', 'OPTIONS'])
+@app.route('/chat-history', methods=['GET'])
 @require_auth
 def get_chat_history():
-    if request.method == 'OPTIONS':
-        response = jsonify({"status": "preflight"})
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        return response
-    
     try:
         user_id = request.user_id
         chat_history = get_user_chat_history(user_id)
         
-        response = jsonify({
-            "chat_history": chat_history,
+        response = history_response({
             "status": "success"
-        })
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
+        }, chat_history)
         return response, 200
         
     except Exception as e:
         print(f"Error retrieving chat history: {str(e)}")
         error_response = jsonify({"error": "Failed to retrieve chat history"})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
 
-@app.route('/clear-chat', methods=['POST', 'OPTIONS'])
+@app.route('/clear-chat', methods=['POST'])
 @require_auth
 def clear_chat():
-    if request.method == 'OPTIONS':
-        response = jsonify({"status": "preflight"})
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        return response
-    
     try:
         user_id = request.user_id
         
-        # Clear all chat messages for this user
-        query = delete_all_chats_by_user_query()
-        execute_query(query, params=(user_id,))
+        # Clear all chat messages for this user; the version bump tells other workers
+        query = clear_chats_by_user_query()
+        execute_query(query, params=(user_id, user_id, user_id), fetch_one=True)
+        get_history_cache().invalidate(user_id)
         
         # Add initial bot message
         save_chat_message(user_id, "Hello! How can I assist you today?", "bot")
@@ -329,61 +362,63 @@ def clear_chat():
             "message": "Chat history cleared successfully",
             "status": "success"
         })
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return response, 200
         
     except Exception as e:
         print(f"Error clearing chat history: {str(e)}")
         error_response = jsonify({"error": "Failed to clear chat history"})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
 
-@app.route('/upload-pdf', methods=['POST', 'OPTIONS'])
+def validate_pdf_upload(file):
+    """Error message for an unusable file part, or None"""
+    if file.filename == '':
+        return 'No file selected'
+    if not file.filename.lower().endswith('.pdf'):
+        return 'File must be a PDF'
+    return None
+
+@app.route('/upload-pdf', methods=['POST'])
 @require_auth
+@admission_controlled("ingest")
 def upload_pdf():
     try:
+        # Stream the upload into the user's folder, hashing it on the way
+        user_id = request.user_id
+        request.upload_dir = get_user_upload_dir(user_id)
+        
         # Check if file is in the request
         if 'file' not in request.files:
             error_response = jsonify({'error': 'No file provided'})
-            error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
             return error_response, 400
         
         file = request.files['file']
         
-        # Check if file was actually selected
-        if file.filename == '':
-            error_response = jsonify({'error': 'No file selected'})
-            error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
+        # Check the file was selected and is a PDF
+        error = validate_pdf_upload(file)
+        if error:
+            error_response = jsonify({'error': error})
             return error_response, 400
         
-        # Check if it's a PDF file
-        if not file.filename.lower().endswith('.pdf'):
-            error_response = jsonify({'error': 'File must be a PDF'})
-            error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-            return error_response, 400
-        
-        # Create pdf folder if it doesn't exist
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        pdf_folder = os.path.join(current_dir, "pdf")
-        os.makedirs(pdf_folder, exist_ok=True)
-        
-        # Secure the filename
+        # Secure the filename (it names the document; the file is stored by content hash)
         filename = secure_filename(file.filename)
-        file_path = os.path.join(pdf_folder, filename)
-        
-        # Save the file
-        file.save(file_path)
+        content_hash, size_bytes, file_path = store_upload(file)
         print(f"PDF saved to: {file_path}")
         
-        # Use user_id from JWT token
-        user_id = request.user_id
-        success = add_pdf_to_vectorstore(file_path, filename, user_id)
+        result = ingest_upload(user_id, filename, content_hash, size_bytes, file_path)
         
-        if success:
+        if result['status'] in ('unchanged', 'duplicate'):
+            response = jsonify({
+                'message': 'PDF already uploaded, nothing to process',
+                'filename': filename,
+                'status': 'success',
+                'document': result
+            })
+        elif result['status'] != 'failed':
             response = jsonify({
                 'message': 'PDF uploaded and processed successfully',
                 'filename': filename,
-                'status': 'success'
+                'status': 'success',
+                'document': result
             })
         else:
             response = jsonify({
@@ -392,17 +427,105 @@ def upload_pdf():
                 'status': 'partial_success'
             })
         
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return response, 200
+    
+    except UploadRejected as e:
+        error_response = jsonify({'error': e.reason})
+        return error_response, 400
+    except HTTPException:
+        # e.g. 413 from MAX_CONTENT_LENGTH, answered by its error handler
+        raise
+    except Exception as e:
+        print(f"Upload error: {str(e)}")
+        error_response = jsonify({'error': f'Upload failed: {str(e)}'})
+        return error_response, 500
+    finally:
+        discard_incoming(request)
+
+def ingest_upload_group(user_id, group):
+    """
+    Ingest stored uploads that share one content hash, first to last; results
+    in the same order. If the first fails, the content is gone and so do the rest.
+    """
+    results = []
+    for index, filename, content_hash, size_bytes, file_path in group:
+        if results and results[0]['status'] == 'failed':
+            results.append({'filename': filename, 'content_hash': content_hash, 'status': 'failed'})
+            continue
+        try:
+            results.append(ingest_upload(user_id, filename, content_hash, size_bytes, file_path))
+        except Exception as e:
+            print(f"Upload error for {filename}: {str(e)}")
+            results.append({'filename': filename, 'status': 'failed'})
+    return results
+
+@app.route('/upload-pdfs', methods=['POST'])
+@require_auth
+@admission_controlled("ingest")
+def upload_pdfs():
+    try:
+        user_id = request.user_id
+        request.upload_dir = get_user_upload_dir(user_id)
+        
+        files = request.files.getlist('files')
+        if not files:
+            error_response = jsonify({'error': 'No files provided (use the "files" field)'})
+            return error_response, 400
+        
+        if len(files) > MAX_UPLOAD_FILES:
+            error_response = jsonify({'error': f'Too many files (max {MAX_UPLOAD_FILES})'})
+            return error_response, 400
         
+        # Store every file first (cheap renames); rejected files are reported, not fatal
+        results = []
+        stored = []
+        for file in files:
+            filename = secure_filename(file.filename) or file.filename
+            error = validate_pdf_upload(file)
+            if not error:
+                try:
+                    stored.append((len(results), filename) + store_upload(file))
+                except UploadRejected as e:
+                    error = e.reason
+            results.append({'filename': filename, 'status': 'rejected', 'error': error} if error else None)
+        
+        # Parts with identical bytes share one stored file: ingest each content
+        # once, then let the other names short-circuit against it in order
+        groups = {}
+        for entry in stored:
+            groups.setdefault(entry[2], []).append(entry)
+        
+        # Parse and embed the distinct contents concurrently
+        if groups:
+            with ThreadPoolExecutor(max_workers=min(UPLOAD_CONCURRENCY, len(groups))) as pool:
+                futures = [(group, pool.submit(ingest_upload_group, user_id, group)) for group in groups.values()]
+                for group, future in futures:
+                    for (index, filename, *_), result in zip(group, future.result()):
+                        results[index] = result
+        
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        
+        response = jsonify({
+            'message': f'Processed {len(files)} files',
+            'counts': counts,
+            'results': results
+        })
+        return response, 200
+    
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Upload error: {str(e)}")
         error_response = jsonify({'error': f'Upload failed: {str(e)}'})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
+    finally:
+        discard_incoming(request)
 
-@app.route('/ingest-url', methods=['POST', 'OPTIONS'])
+@app.route('/ingest-url', methods=['POST'])
 @require_auth
+@admission_controlled("ingest")
 def ingest_url():
     try:
         data = request.get_json()
@@ -411,16 +534,15 @@ def ingest_url():
         
         if not url:
             error_response = jsonify({'error': 'URL is required'})
-            error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
             return error_response, 400
         
         # Basic URL validation
         if not url.startswith(('http://', 'https://')):
             error_response = jsonify({'error': 'Invalid URL format. Must start with http:// or https://'})
-            error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
             return error_response, 400
         
         # Use user_id from JWT token
+        from rag_chain import url_to_vectorstore
         user_id = request.user_id
         success = url_to_vectorstore(url, user_id)
         
@@ -435,55 +557,310 @@ def ingest_url():
                 'url': url
             })
         
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return response, 200
         
     except Exception as e:
         print(f"Error processing URL: {str(e)}")
         error_response = jsonify({'error': f'Failed to process URL: {str(e)}'})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
 
-@app.route('/message', methods=['POST', 'OPTIONS'])
+@app.route('/ingest-urls', methods=['POST'])
 @require_auth
+@admission_controlled("ingest")
+def ingest_urls():
+    try:
+        data = request.get_json() or {}
+        if not isinstance(data, dict):
+            error_response = jsonify({'error': 'Expected a JSON object'})
+            return error_response, 400
+        
+        urls = data.get('urls') or []
+        sitemap = data.get('sitemap')
+        
+        if not isinstance(urls, list):
+            error_response = jsonify({'error': 'urls must be a list'})
+            return error_response, 400
+        
+        if sitemap is not None and not isinstance(sitemap, str):
+            error_response = jsonify({'error': 'sitemap must be a string'})
+            return error_response, 400
+        
+        if sitemap:
+            if not sitemap.startswith(('http://', 'https://')):
+                error_response = jsonify({'error': 'Invalid sitemap URL. Must start with http:// or https://'})
+                return error_response, 400
+            from webcrawler import fetch_sitemap_urls
+            urls = urls + fetch_sitemap_urls(sitemap, limit=CRAWL_MAX_URLS)
+        
+        # Basic URL validation, keeping order and dropping duplicates
+        urls = list(dict.fromkeys(u.strip() for u in urls if isinstance(u, str) and u.strip()))
+        invalid = [u for u in urls if not u.startswith(('http://', 'https://'))]
+        
+        if not urls or invalid:
+            error_response = jsonify({
+                'error': 'Provide urls or a sitemap; every URL must start with http:// or https://',
+                'invalid': invalid
+            })
+            return error_response, 400
+        
+        if len(urls) > CRAWL_MAX_URLS:
+            error_response = jsonify({'error': f'Too many URLs (max {CRAWL_MAX_URLS})'})
+            return error_response, 400
+        
+        # Use user_id from JWT token
+        from rag_chain import urls_to_vectorstore
+        user_id = request.user_id
+        statuses = urls_to_vectorstore(urls, user_id)
+        
+        counts = {}
+        for status in statuses.values():
+            counts[status] = counts.get(status, 0) + 1
+        
+        response = jsonify({
+            'message': f'Processed {len(urls)} URLs',
+            'counts': counts,
+            'results': statuses
+        })
+        return response, 200
+        
+    except Exception as e:
+        print(f"Error processing URLs: {str(e)}")
+        error_response = jsonify({'error': f'Failed to process URLs: {str(e)}'})
+        return error_response, 500
+
+@app.route('/documents', methods=['GET'])
+@require_auth
+def list_documents():
+    try:
+        user_id = request.user_id
+        documents = execute_query(get_documents_by_user_query(), params=(user_id,), fetch_all=True) or []
+        
+        response = jsonify({
+            'documents': documents,
+            'status': 'success'
+        })
+        return response, 200
+        
+    except Exception as e:
+        print(f"Error listing documents: {str(e)}")
+        error_response = jsonify({'error': 'Failed to list documents'})
+        return error_response, 500
+
+@app.route('/documents/<int:document_id>', methods=['DELETE'])
+@require_auth
+def delete_document(document_id):
+    try:
+        from rag_chain import delete_document as delete_catalog_document
+        user_id = request.user_id
+        deleted = delete_catalog_document(user_id, document_id)
+        
+        if not deleted:
+            error_response = jsonify({'error': 'Document not found'})
+            return error_response, 404
+        
+        # PDFs are stored by filename, so the file may still back another user's document
+        file_path = deleted['file_path']
+        if file_path:
+            remaining = execute_query(count_documents_by_file_path_query(), params=(file_path,), fetch_one=True)
+            if remaining and remaining['document_count'] == 0 and os.path.exists(file_path):
+                os.remove(file_path)
+            
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            md_filename = deleted['source'].replace(".pdf", ".md")
+            md_path = os.path.join(current_dir, "markdown", f"user_{user_id}", md_filename)
+            if os.path.exists(md_path):
+                os.remove(md_path)
+        
+        response = jsonify({
+            'message': 'Document deleted successfully',
+            'id': deleted['id'],
+            'source': deleted['source'],
+            'chunks_removed': len(deleted['chunk_ids'] or []),
+            'status': 'success'
+        })
+        return response, 200
+        
+    except Exception as e:
+        print(f"Error deleting document: {str(e)}")
+        error_response = jsonify({'error': f'Failed to delete document: {str(e)}'})
+        return error_response, 500
+
+@app.route('/documents/<int:document_id>/reindex', methods=['POST'])
+@require_auth
+@admission_controlled("ingest")
+def reindex_document(document_id):
+    try:
+        user_id = request.user_id
+        document = execute_query(get_document_by_id_query(), params=(document_id, user_id), fetch_one=True)
+        
+        if not document:
+            error_response = jsonify({'error': 'Document not found'})
+            return error_response, 404
+        
+        # Re-ingesting replaces exactly this document's chunk ids
+        if document['source_type'] == 'pdf':
+            if not document['file_path'] or not os.path.exists(document['file_path']):
+                error_response = jsonify({'error': 'The original PDF is no longer available; upload it again'})
+                return error_response, 409
+            from pdf_converter import add_pdf_to_vectorstore
+            success = add_pdf_to_vectorstore(document['file_path'], document['source'], user_id, force=True)
+        else:
+            from rag_chain import url_to_vectorstore
+            success = url_to_vectorstore(document['source'], user_id, force=True)
+        
+        if not success:
+            error_response = jsonify({'error': 'Failed to re-index document', 'source': document['source']})
+            return error_response, 502
+        
+        updated = execute_query(get_document_by_id_query(), params=(document_id, user_id), fetch_one=True)
+        response = jsonify({
+            'message': 'Document re-indexed successfully',
+            'id': document_id,
+            'source': document['source'],
+            'chunk_count': updated['chunk_count'] if updated else None,
+            'status': 'success'
+        })
+        return response, 200
+        
+    except Exception as e:
+        print(f"Error re-indexing document: {str(e)}")
+        error_response = jsonify({'error': f'Failed to re-index document: {str(e)}'})
+        return error_response, 500
+
+@app.route('/message', methods=['POST'])
+@require_auth
+@admission_controlled("chat")
 def message():
     data = request.get_json()
 
     if not data or 'message' not in data:
         error_response = jsonify({"error": "No message provided"})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 400
 
     user_message = data['message']
     user_id = request.user_id
+    start = time.perf_counter()
 
     # Save user message to database
     save_chat_message(user_id, user_message, "user")
 
-    # Send message to AI setup function with user_id
-    ai_response = chatbot_talk(user_message, user_id)
+    # Send message to AI setup function with user_id; both chain stages share
+    # the request's latency budget (time already spent queueing counts too)
+    try:
+        from rag_chain import chatbot_talk
+        with latency_budget(CHAT_LATENCY_BUDGET_SECONDS - (time.monotonic() - request.received_at)):
+            ai_response = chatbot_talk(user_message, user_id)
+    except LLMDeadlineExceeded as e:
+        print(f"Chat deadline exceeded for user {user_id}: {e}")
+        error_response = jsonify({"error": "The assistant took too long to respond, please try again"})
+        return error_response, 504
+    except LLMUnavailable as e:
+        print(f"Chat model unavailable for user {user_id}: {e}")
+        error_response = jsonify({"error": "The assistant is unavailable right now, please try again shortly"})
+        error_response.headers.add('Retry-After', str(max(1, math.ceil(e.retry_after))))
+        return error_response, 503
+    except Exception as e:
+        print(f"Error generating response for user {user_id}: {str(e)}")
+        error_response = jsonify({"error": "Failed to generate a response"})
+        return error_response, 500
 
     # Save AI response to database
     save_chat_message(user_id, ai_response, "bot")
+    prewarm.record_first_turn(user_id, (time.perf_counter() - start) * 1000)
 
     response = jsonify({
         "message": ai_response
     })
     
-    response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
+    response.headers.add('Server-Timing', format_server_timing(get_stage_timings()))
+    return response
+
+def require_internal(f):
+    """Decorator for node-to-node routes: X-Internal-Token must match INTERNAL_TOKEN"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = request.headers.get('X-Internal-Token')
+        if not INTERNAL_TOKEN or token is None or not hmac.compare_digest(token, INTERNAL_TOKEN):
+            return jsonify({"error": "Forbidden"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def _store_transfer_args():
+    """Arguments tools.bulk_transfer takes for this node's vector storage"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    shared_dir = os.path.join(app_dir, SHARED_VECTORSTORE_PATH)
+    shared = None
+    if VECTORSTORE_MODE == "shared":
+        from chroma_clients import get_store_client
+        shared = get_store_client(shared_dir).get_or_create_collection(SHARED_COLLECTION_NAME, embedding_function=None)
+    return VECTORSTORE_MODE, os.path.join(app_dir, VECTORSTORES_DIR), shared, shared_dir
+
+# Snapshot of a user's vectors, for moving them to another node (tools/rebalance_shards.py)
+@app.route('/internal/users/<int:user_id>/store', methods=['GET'])
+@require_internal
+def export_user_store(user_id):
+    from tools.bulk_transfer import export_user_vectors
+    mode, stores_dir, shared, shared_dir = _store_transfer_args()
+    workdir = tempfile.mkdtemp(prefix="ragit_store_")
+    try:
+        os.makedirs(os.path.join(workdir, "vectors"))
+        entry = export_user_vectors(user_id, workdir, mode, stores_dir, shared, shared_dir, 1000, False)
+        if not entry["chunks"]:
+            return jsonify({"error": "No vectors for this user", "chunks": 0}), 404
+        # Still readable once the directory is gone; closed when the response is
+        snapshot = open(os.path.join(workdir, entry["file"]), "rb")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    response = send_file(snapshot, mimetype="application/octet-stream")
+    response.headers['X-Chunk-Count'] = str(entry["chunks"])
+    response.headers['X-Collection-Metadata'] = json.dumps(entry.get("collection_metadata"))
     return response
 
+@app.route('/internal/users/<int:user_id>/store', methods=['PUT'])
+@require_internal
+def import_user_store(user_id):
+    from tools.bulk_transfer import import_user_vectors
+    if request.content_length is None:
+        return jsonify({"error": "Content-Length required"}), 411
+    mode, stores_dir, shared, shared_dir = _store_transfer_args()
+    workdir = tempfile.mkdtemp(prefix="ragit_store_")
+    try:
+        # Snapshots can be larger than MAX_CONTENT_LENGTH, which guards user uploads
+        body = LimitedStream(request.input_stream, request.content_length)
+        with open(os.path.join(workdir, "store.npz"), "wb") as f:
+            shutil.copyfileobj(body, f, 1024 * 1024)
+        entry = {
+            "user_id": user_id,
+            "file": "store.npz",
+            "collection_metadata": json.loads(request.headers.get('X-Collection-Metadata') or "null")
+        }
+        status, chunks = import_user_vectors(entry, workdir, mode, stores_dir, shared, shared_dir, 1000, replace=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return jsonify({"status": status, "chunks": chunks}), 200
+
+@app.route('/internal/users/<int:user_id>/store', methods=['DELETE'])
+@require_internal
+def delete_user_store(user_id):
+    # Only stores this node no longer serves (after the ring changed) may go
+    if owns_user(user_id):
+        return jsonify({"error": "This node still owns the user"}), 409
+    from rag_chain import drop_user_vectorstore
+    removed = drop_user_vectorstore(user_id)
+    return jsonify({"removed": removed}), 200
+
+# Prewarm for a login served by another node
+@app.route('/internal/users/<int:user_id>/prewarm', methods=['POST'])
+@require_internal
+def prewarm_owned_user(user_id):
+    if not owns_user(user_id):
+        return jsonify({"error": "This node does not own the user"}), 409
+    return jsonify({"scheduled": prewarm.schedule_prewarm(user_id)}), 202
+
 # Logout endpoint
-@app.route('/logout', methods=['POST', 'OPTIONS'])
+@app.route('/logout', methods=['POST'])
 @require_auth
 def logout():
-    if request.method == 'OPTIONS':
-        response = jsonify({"status": "preflight"})
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        return response
-    
     try:
         # Since JWT is stateless, we mainly just confirm the logout
         # In the future, you could add token blacklisting here if needed
@@ -493,26 +870,17 @@ def logout():
             "message": f"User {username} logged out successfully",
             "status": "success"
         })
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return response, 200
         
     except Exception as e:
         print(f"Error during logout: {str(e)}")
         error_response = jsonify({"error": "Logout failed due to server error"})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
 
 # Optional: Add token refresh endpoint
-@app.route('/refresh-token', methods=['POST', 'OPTIONS'])
+@app.route('/refresh-token', methods=['POST'])
 @require_auth
 def refresh_token():
-    if request.method == 'OPTIONS':
-        response = jsonify({"status": "preflight"})
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        return response
-    
     try:
         # Generate new token with extended expiration
         new_token = generate_jwt_token(request.user_id, request.username)
@@ -521,14 +889,17 @@ def refresh_token():
             "message": "Token refreshed successfully",
             "token": new_token
         })
-        response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return response, 200
         
     except Exception as e:
         print(f"Error refreshing token: {str(e)}")
         error_response = jsonify({"error": "Token refresh failed"})
-        error_response.headers.add('Access-Control-Allow-Origin', get_cors_origin())
         return error_response, 500
 
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0', port=8123)  
\ No newline at end of file
+    if WARMUP_ON_START:
+        lifecycle.start_warmup()
+    # Partition upkeep runs even when nothing is to be deleted
+    from retention import start_retention_job
+    start_retention_job(enforce_limits=RETENTION_ENABLED)
+    app.run(debug=False, host='0.0.0.0', port=PORT)  
\ No newline at end of file
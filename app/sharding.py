@@ -0,0 +1,84 @@
+"""
+Consistent-hash placement of users on nodes for sharded deployments.
+
+Vectorstores live on the local disk of the node that owns the user, so
+every request for a user must reach the same node. SHARD_NODES lists the
+nodes ("name=url,name=url"); each node is placed on a hash ring at
+SHARD_VNODES points and a user belongs to the first node point at or after
+the hash of their id. Adding a node only moves the users that land on its
+points (about 1/N of them), see tools/rebalance_shards.py.
+
+Without SHARD_NODES (the default) there is one node and it owns everyone.
+"""
+import bisect
+import hashlib
+
+from config import SHARD_NODES, SHARD_VNODES, NODE_NAME
+
+
+def parse_nodes(spec):
+    """{name: url} from "name=url,name=url" """
+    nodes = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, url = item.partition("=")
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid shard node {item!r}, expected name=url")
+        nodes[name.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes=SHARD_VNODES):
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node")
+        self.nodes = dict(nodes)
+        points = sorted(
+            (_hash(f"{name}#{replica}"), name)
+            for name in self.nodes
+            for replica in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def node_for(self, user_id):
+        """Name of the node owning a user"""
+        index = bisect.bisect_left(self._hashes, _hash(f"user:{user_id}"))
+        return self._names[index % len(self._names)]
+
+    def url_for(self, user_id):
+        return self.nodes[self.node_for(user_id)]
+
+
+_ring = HashRing(parse_nodes(SHARD_NODES)) if SHARD_NODES else None
+
+
+def get_ring():
+    """The configured ring, or None when sharding is off"""
+    return _ring
+
+
+def check_node():
+    """Refuse to serve when sharding is on but NODE_NAME is not one of the ring's nodes"""
+    if _ring is not None and NODE_NAME not in _ring.nodes:
+        raise SystemExit(
+            f"❌ NODE_NAME={NODE_NAME!r} is not in SHARD_NODES ({', '.join(_ring.nodes)}); "
+            "set it to this node's name"
+        )
+
+
+def owns_user(user_id):
+    """Whether this node (NODE_NAME) serves the user; always true when sharding is off"""
+    if _ring is None:
+        return True
+    return _ring.node_for(user_id) == NODE_NAME
+
+
+def owner_of(user_id):
+    return _ring.node_for(user_id) if _ring is not None else NODE_NAME
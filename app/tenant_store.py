@@ -0,0 +1,87 @@
+import threading
+
+from langchain_chroma import Chroma
+
+from chroma_clients import get_store_client
+
+TENANT_KEY = "user_id"
+
+
+def tenant_value(user_id):
+    # Stored as a string so ids from JWTs (int) and directory names (str) match
+    return str(user_id)
+
+
+def tenant_filter(user_id, where=None):
+    """Chroma `where` clause restricted to one tenant"""
+    condition = {TENANT_KEY: tenant_value(user_id)}
+    if not where:
+        return condition
+    return {"$and": [condition, where]}
+
+
+class TenantVectorStore:
+    """
+    One user's view of the shared collection.
+
+    Exposes the subset of the Chroma API that rag_chain uses; every write is
+    tagged with the user's id and every read or delete is filtered by it.
+    """
+
+    def __init__(self, store, user_id):
+        self.store = store
+        self.user_id = user_id
+
+    def add_documents(self, documents, **kwargs):
+        tagged = []
+        for document in documents:
+            document = document.copy()
+            document.metadata = {**document.metadata, TENANT_KEY: tenant_value(self.user_id)}
+            tagged.append(document)
+        return self.store.add_documents(tagged, **kwargs)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        kwargs = {"where": tenant_filter(self.user_id, where)}
+        if ids is not None:
+            kwargs["ids"] = ids
+        if limit is not None:
+            kwargs["limit"] = limit
+        if offset is not None:
+            kwargs["offset"] = offset
+        if include is not None:
+            kwargs["include"] = include
+        return self.store.get(**kwargs)
+
+    def delete(self, ids):
+        # Scoped by tenant too, so a user can never delete another user's chunks
+        self.store._collection.delete(ids=list(ids), where=tenant_filter(self.user_id))
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.store.similarity_search(query, k=k, filter=tenant_filter(self.user_id, filter), **kwargs)
+
+    def as_retriever(self, search_type="similarity", search_kwargs=None):
+        search_kwargs = dict(search_kwargs or {})
+        search_kwargs["filter"] = tenant_filter(self.user_id, search_kwargs.get("filter"))
+        return self.store.as_retriever(search_type=search_type, search_kwargs=search_kwargs)
+
+    def is_empty(self):
+        return not self.get(limit=1, include=[])["ids"]
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_shared_store(persist_directory, collection_name, embedding_function):
+    """The process-wide Chroma handle on the shared collection"""
+    global _shared_store
+    client = get_store_client(persist_directory)
+    with _shared_store_lock:
+        # Re-wrapped only when the client changed (store rebuilt by maintenance)
+        if _shared_store is None or _shared_store._client is not client:
+            _shared_store = Chroma(
+                client=client,
+                collection_name=collection_name,
+                embedding_function=embedding_function
+            )
+        return _shared_store
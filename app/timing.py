@@ -0,0 +1,41 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Per-request stage timings. The dict is shared by reference, so stages that
+# LangChain runs on worker threads (with a copied context) still report here.
+_stage_timings = ContextVar("stage_timings", default=None)
+
+
+def reset_stage_timings():
+    """Start collecting stage timings for the current request"""
+    timings = {}
+    _stage_timings.set(timings)
+    return timings
+
+
+def record_stage(name, elapsed_ms):
+    """Add elapsed milliseconds to a named stage (no-op outside a request)"""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + elapsed_ms
+
+
+def get_stage_timings():
+    """Return a copy of the stage timings collected so far"""
+    return dict(_stage_timings.get() or {})
+
+
+@contextmanager
+def time_stage(name):
+    """Time the enclosed block as a named stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, (time.perf_counter() - start) * 1000)
+
+
+def format_server_timing(timings):
+    """Render stage timings as a Server-Timing header value"""
+    return ", ".join(f"{name.replace(' ', '_')};dur={ms:.1f}" for name, ms in timings.items())
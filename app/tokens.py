@@ -0,0 +1,47 @@
+import re
+import threading
+
+# cl100k_base is the text-embedding-3-* encoding; close enough to budget gpt-4o prompts
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_FALLBACK_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def get_encoding():
+    """
+    Load the tiktoken encoding once per process (None if tiktoken is unavailable)
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    print(f"tiktoken unavailable, using approximate token counts: {e}")
+                    _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """Count tokens in text (approximate when tiktoken is unavailable)"""
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(_FALLBACK_RE.findall(text))
+
+
+def split_by_tokens(text, max_tokens):
+    """Cut text into pieces of at most max_tokens tokens (last resort for run-on text)"""
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+    starts = [match.start() for match in _FALLBACK_RE.finditer(text)]
+    cuts = starts[max_tokens::max_tokens]
+    bounds = [0] + cuts + [len(text)]
+    return [text[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1) if text[bounds[i]:bounds[i + 1]].strip()]
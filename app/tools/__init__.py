@@ -0,0 +1,2 @@
+# Offline command-line tools (evaluation, benchmarks, maintenance).
+# Run them from the app/ directory, e.g. `python -m tools.eval_retrieval --help`.
@@ -0,0 +1,109 @@
+"""
+Benchmark auth overhead per request under concurrency.
+
+    python -m tools.bench_auth --threads 16 --requests 20000 --logins 64
+
+1. Token verification: full jwt.decode on every request vs the verified-token LRU.
+2. Login burst: password checks inline on request threads vs on the bounded
+   KDF pool, measured by the latency of a light "chat" probe running alongside.
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import auth
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+def bench_verify(threads, requests, users):
+    tokens = [auth.generate_jwt_token(i, f"user{i}") for i in range(users)]
+
+    def uncached(i):
+        return jwt.decode(tokens[i % users], auth.JWT_SECRET, algorithms=['HS256'])
+
+    def cached(i):
+        return auth.verify_jwt_token(tokens[i % users])
+
+    results = {}
+    for name, fn in (("jwt.decode every request", uncached), ("verified-token LRU", cached)):
+        auth.token_cache.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(fn, range(requests)))
+        elapsed = time.perf_counter() - start
+        results[name] = elapsed / requests * 1e6
+        print(f"{name:<28} {results[name]:8.2f} us/request  ({requests} requests, {threads} threads)")
+    return results
+
+
+def bench_login_burst(logins, threads, probe_interval_ms=5):
+    password_hash = generate_password_hash("correct horse", method='pbkdf2:sha256', salt_length=8)
+
+    def probe(stop, latencies):
+        # Stand-in for a chat request's CPU work on another request thread
+        while not stop.is_set():
+            start = time.perf_counter()
+            sum(i * i for i in range(2000))
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(probe_interval_ms / 1000)
+
+    for name, check in (
+        ("inline check_password_hash", lambda: check_password_hash(password_hash, "correct horse")),
+        ("bounded KDF pool", lambda: auth.check_password(password_hash, "correct horse")),
+    ):
+        stop = threading.Event()
+        latencies = []
+        prober = threading.Thread(target=probe, args=(stop, latencies))
+        prober.start()
+
+        def login(_):
+            try:
+                return check()
+            except auth.AuthBusyError:
+                return None
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            outcomes = list(pool.map(login, range(logins)))
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        prober.join()
+
+        shed = sum(1 for outcome in outcomes if outcome is None)
+        print(
+            f"{name:<28} logins/s={logins / elapsed:7.1f}  shed={shed:3d}  "
+            f"chat probe p50={statistics.median(latencies):6.2f}ms p95={_percentile(latencies, 95):6.2f}ms"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark auth overhead per request")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--logins", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    if not auth.JWT_SECRET:
+        auth.JWT_SECRET = "bench-secret"
+
+    print("Token verification")
+    bench_verify(args.threads, args.requests, args.users)
+    print("\nLogin burst")
+    bench_login_burst(args.logins, args.threads)
+
+
+if __name__ == "__main__":
+    main()
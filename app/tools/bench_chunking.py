@@ -0,0 +1,223 @@
+"""
+Compare the token chunker (chunking.py) with the legacy character splitter.
+
+    python -m tools.bench_chunking --sizes-mb 1 4 16
+    python -m tools.bench_chunking --inputs markdown/*.md pdf/manual.pdf --labels eval/manual.jsonl --embedder azure
+
+Throughput: the splitters run on the same inputs (synthetic markdown of
+--sizes-mb, or --inputs files). "recursive-tokens" is the character
+splitter measuring length in tokens, the like-for-like baseline for a
+token-aware splitter. The report shows MB/s, chunk counts and chunk sizes
+in tokens; seconds per MB should stay flat as size grows.
+
+Recall: both splitters index the same corpus into fresh stores and answer
+labeled questions with exact search (see tools.eval_retrieval). Without
+--labels, a synthetic corpus with planted facts is generated.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from langchain_core.documents import Document
+
+from config import CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from tokens import count_tokens
+from tools.embedders import make_embedder
+from tools.eval_retrieval import build_store, evaluate, load_labels, make_exact_search, split_documents
+
+WORDS = (
+    "pump valve pressure rated report quarterly revenue customer contract warranty delivery "
+    "schedule invoice summary assistant context answer turbine filter sensor coolant gasket "
+    "supplier audit compliance shipment batch module firmware calibration"
+).split()
+
+
+def _sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20))).capitalize() + "."
+
+
+def make_markdown(size_bytes, seed=0, facts=None):
+    """Synthetic markdown with nested sections, normal paragraphs and a few run-on ones"""
+    rng = random.Random(seed)
+    facts = list(facts or [])
+    parts = []
+    size = 0
+    section = 0
+    while size < size_bytes or facts:
+        section += 1
+        parts.append(f"# Chapter {section}")
+        for sub in range(rng.randint(2, 4)):
+            parts.append(f"## Section {section}.{sub + 1}")
+            for _ in range(rng.randint(3, 8)):
+                # One paragraph in ten has no breaks at all, like text extracted from a PDF
+                count = rng.randint(40, 120) if rng.random() < 0.1 else rng.randint(2, 7)
+                sentences = [_sentence(rng) for _ in range(count)]
+                if facts and rng.random() < 0.2:
+                    sentences.insert(rng.randrange(len(sentences) + 1), facts.pop())
+                parts.append(" ".join(sentences))
+        size = sum(len(part) + 2 for part in parts)
+    return "\n\n".join(parts)
+
+
+def make_fact_corpus(documents, facts_per_document, seed=0):
+    """(documents, labels) where each label asks about one planted fact"""
+    rng = random.Random(seed)
+    docs, labels = [], []
+    for d in range(documents):
+        facts = []
+        for f in range(facts_per_document):
+            name = f"{rng.choice(WORDS)}{d}x{f}"
+            value = "".join(rng.choice("BCDFGHJKLMNPQRSTVWXZ") for _ in range(6))
+            facts.append(f"The serial code of unit {name} is {value}.")
+            labels.append({
+                "question": f"What is the serial code of unit {name}?",
+                "relevant": [f"unit {name} is {value}"],
+                "relevant_ids": []
+            })
+        docs.append(Document(
+            page_content=make_markdown(40_000, seed=seed + d, facts=facts),
+            metadata={"source": f"doc{d}.md"}
+        ))
+    return docs, labels
+
+
+def load_inputs(paths):
+    docs = []
+    for path in paths:
+        if path.lower().endswith(".pdf"):
+            from pdf_converter import convert_PDF_to_markdown
+            text = convert_PDF_to_markdown(path)
+        else:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        docs.append(Document(page_content=text, metadata={"source": os.path.basename(path)}))
+    return docs
+
+
+def split_recursive_tokens(docs, chunk_size, chunk_overlap):
+    """The character splitter measuring length in tokens, as from_tiktoken_encoder does"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from tools.eval_retrieval import PDF_SEPARATORS
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=PDF_SEPARATORS,
+        length_function=count_tokens
+    ).split_documents(docs)
+
+
+def bench_throughput(docs, splitter, chunk_size, chunk_overlap):
+    size_mb = sum(len(doc.page_content.encode("utf-8")) for doc in docs) / 1e6
+    start = time.perf_counter()
+    if splitter == "recursive-tokens":
+        chunks = split_recursive_tokens(docs, chunk_size, chunk_overlap)
+    else:
+        chunks = split_documents(docs, splitter, chunk_size, chunk_overlap)
+    elapsed = time.perf_counter() - start
+    sizes = sorted(count_tokens(chunk.page_content) for chunk in chunks)
+    return {
+        "splitter": splitter,
+        "mb": round(size_mb, 2),
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(size_mb / elapsed, 2) if elapsed else None,
+        "s_per_mb": round(elapsed / size_mb, 3) if size_mb else None,
+        "chunks": len(chunks),
+        "tokens_p50": sizes[len(sizes) // 2] if sizes else 0,
+        "tokens_max": sizes[-1] if sizes else 0
+    }
+
+
+def bench_recall(docs, labels, embedder, splitter, chunk_size, chunk_overlap, k):
+    workdir = tempfile.mkdtemp(prefix="ragit_chunking_")
+    try:
+        vectorstore, chunk_count = build_store(
+            docs, embedder, chunk_size, chunk_overlap, os.path.join(workdir, "store"), splitter=splitter
+        )
+        _, summary = evaluate(make_exact_search(vectorstore, embedder), labels, k)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "splitter": splitter,
+        "chunks": chunk_count,
+        "recall_at_k": round(summary["recall_at_k"], 3),
+        "mrr": round(summary["mrr"], 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the token chunker against the character splitter")
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4], help="Synthetic document sizes")
+    parser.add_argument("--inputs", nargs="+", help="Markdown, text or PDF files instead of synthetic documents")
+    parser.add_argument("--labels", help="Labeled questions for --inputs (see tools.eval_retrieval)")
+    parser.add_argument("--embedder", choices=["fake", "azure"], default="fake")
+    parser.add_argument("--cache-path", default=None, help="SQLite embedding cache for --embedder azure")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--chunk-chars", type=int, default=1000, help="Character splitter chunk size")
+    parser.add_argument("--overlap-chars", type=int, default=200)
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--recall-documents", type=int, default=20, help="Synthetic recall corpus size")
+    parser.add_argument("--facts-per-document", type=int, default=5)
+    parser.add_argument("--json-out")
+    args = parser.parse_args(argv)
+
+    settings = {
+        "recursive": (args.chunk_chars, args.overlap_chars),
+        "token": (args.chunk_tokens, args.overlap_tokens)
+    }
+    throughput_settings = {**settings, "recursive-tokens": (args.chunk_tokens, args.overlap_tokens)}
+
+    # Throughput
+    if args.inputs:
+        corpora = [("inputs", load_inputs(args.inputs))]
+    else:
+        corpora = [
+            (f"{size:g}MB", [Document(page_content=make_markdown(int(size * 1e6), seed=i), metadata={"source": "synthetic.md"})])
+            for i, size in enumerate(args.sizes_mb)
+        ]
+    throughput = []
+    print(f"{'corpus':<8} {'splitter':<16} {'MB':>6} {'s':>8} {'MB/s':>7} {'s/MB':>7} {'chunks':>7} {'tok p50':>8} {'tok max':>8}")
+    for name, docs in corpora:
+        for splitter, (size, overlap) in throughput_settings.items():
+            row = {"corpus": name, **bench_throughput(docs, splitter, size, overlap)}
+            throughput.append(row)
+            print(
+                f"{name:<8} {splitter:<16} {row['mb']:>6.2f} {row['seconds']:>8.3f} {row['mb_per_s'] or 0:>7.2f} "
+                f"{row['s_per_mb'] or 0:>7.3f} {row['chunks']:>7} {row['tokens_p50']:>8} {row['tokens_max']:>8}"
+            )
+
+    # Retrieval recall
+    if args.inputs and args.labels:
+        docs, labels = load_inputs(args.inputs), load_labels(args.labels)
+    elif args.inputs:
+        docs = labels = None
+        print("\nNo --labels for --inputs, skipping recall")
+    else:
+        docs, labels = make_fact_corpus(args.recall_documents, args.facts_per_document)
+
+    recall = []
+    if docs:
+        embedder = make_embedder(args.embedder, args.cache_path)
+        print(f"\n{'splitter':<10} {'chunks':>7} {'recall@' + str(args.k):>9} {'MRR':>6}  ({len(labels)} questions)")
+        for splitter, (size, overlap) in settings.items():
+            row = bench_recall(docs, labels, embedder, splitter, size, overlap, args.k)
+            recall.append(row)
+            print(f"{splitter:<10} {row['chunks']:>7} {row['recall_at_k']:>9.3f} {row['mrr']:>6.3f}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"params": vars(args), "throughput": throughput, "recall": recall}, f, indent=2)
+
+    if len(throughput) > 2:
+        token_rows = [row for row in throughput if row["splitter"] == "token" and row["s_per_mb"]]
+        spread = statistics.pstdev(row["s_per_mb"] for row in token_rows) / statistics.fmean(row["s_per_mb"] for row in token_rows)
+        print(f"\nToken chunker s/MB spread across sizes: {spread:.0%} (flat = linear)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Memory used by cached chat histories, per user.
+
+    python -m tools.bench_history_memory --users 10000 --messages 30
+
+Builds the same synthetic histories in three forms and measures each with
+tracemalloc (texts included, as they would arrive fresh from the database):
+
+  langchain  a list of HumanMessage/SystemMessage per user, as the old
+             user_chat_histories dict held them
+  tuples     a list of (sender, text) per user, the previous cache entries
+  compact    history_cache.ChatHistory: role bytes plus interned texts
+
+It also times turning a user's history into the prompt messages: the
+whole history for the tuples, the last HISTORY_WINDOW_MESSAGES for the
+compact one. The langchain form already holds built messages (their cost
+is paid when each message is cached), so it has no prompt time.
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from config import HISTORY_WINDOW_MESSAGES
+from history_cache import ChatHistory
+from rag_chain import to_langchain_messages
+
+GREETING = "Hello! How can I assist you today?"
+SHORT_REPLIES = ["thanks", "ok", "Thank you!", "yes", "no", "great, thanks", "can you explain more?"]
+WORDS = (
+    "the pump valve pressure warranty invoice contract delivery schedule report summary manual "
+    "page section customer revenue quarterly rated maximum minimum filter sensor calibration"
+).split()
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_rows(user_index, messages):
+    """(sender, text) rows as the database returns them: fresh str objects every time"""
+    rng = random.Random(user_index)
+    rows = [("bot".encode().decode(), GREETING.encode().decode())]
+    for turn in range(1, messages):
+        if turn % 2:
+            if rng.random() < 0.3:
+                text = rng.choice(SHORT_REPLIES)
+            else:
+                text = _sentence(rng, rng.randint(6, 20))
+            rows.append(("user".encode().decode(), text.encode().decode()))
+        else:
+            text = " ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 6)))
+            rows.append(("bot".encode().decode(), text))
+    return rows
+
+
+def as_langchain(rows):
+    return [HumanMessage(content=text) if sender == "user" else SystemMessage(content=text) for sender, text in rows]
+
+
+def as_tuples(rows):
+    return [(sender, text) for sender, text in rows]
+
+
+def as_compact(rows):
+    return ChatHistory.from_messages(rows)
+
+
+FORMS = {"langchain": as_langchain, "tuples": as_tuples, "compact": as_compact}
+
+
+def measure(form, users, messages):
+    """Bytes held by `users` histories in one form"""
+    build = FORMS[form]
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    cache = {}
+    for user_index in range(users):
+        cache[user_index] = build(make_rows(user_index, messages))
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return cache, held
+
+
+def time_prompt_messages(form, cache, window, repeat):
+    """Microseconds per user to build the LangChain messages sent with a prompt (None for langchain)"""
+    if form == "langchain":
+        return None
+    histories = list(cache.values())[:repeat]
+    start = time.perf_counter()
+    for history in histories:
+        if form == "compact":
+            to_langchain_messages(history.window(window))
+        else:
+            to_langchain_messages(history)
+    return (time.perf_counter() - start) / len(histories) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure per-user memory of cached chat histories")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=30, help="Messages per user")
+    parser.add_argument("--window", type=int, default=HISTORY_WINDOW_MESSAGES, help="Messages sent with a prompt")
+    parser.add_argument("--forms", nargs="+", choices=sorted(FORMS), default=["langchain", "tuples", "compact"])
+    parser.add_argument("--json-out")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{args.users} users x {args.messages} messages (prompt window {args.window or 'all'})")
+    print(f"{'form':<10} {'MB':>9} {'bytes/user':>11} {'bytes/msg':>10} {'prompt us':>10}")
+    for form in args.forms:
+        cache, held = measure(form, args.users, args.messages)
+        prompt_us = time_prompt_messages(form, cache, args.window, min(args.users, 2000))
+        del cache
+        row = {
+            "form": form,
+            "mb": round(held / 1e6, 2),
+            "bytes_per_user": round(held / args.users),
+            "bytes_per_message": round(held / (args.users * args.messages)),
+            "prompt_us": round(prompt_us, 1) if prompt_us is not None else None
+        }
+        results.append(row)
+        prompt_column = f"{row['prompt_us']:>10.1f}" if prompt_us is not None else f"{'-':>10}"
+        print(f"{form:<10} {row['mb']:>9.2f} {row['bytes_per_user']:>11} {row['bytes_per_message']:>10} {prompt_column}")
+
+    by_form = {row["form"]: row for row in results}
+    if "compact" in by_form:
+        for form in ("langchain", "tuples"):
+            if form in by_form:
+                print(f"compact uses {by_form['compact']['bytes_per_user'] / by_form[form]['bytes_per_user']:.0%} of {form}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark history payload encoding: stdlib json vs orjson, and bytes on the wire.
+
+    python -m tools.bench_responses --sizes 1000 10000 100000
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+import orjson
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from config import COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY
+
+WORDS = (
+    "the pump valve pressure rated report quarterly revenue customer contract "
+    "warranty delivery schedule invoice summary assistant context answer"
+).split()
+
+
+def make_history(size, seed=0):
+    rng = random.Random(seed)
+    history = []
+    for i in range(size):
+        length = rng.randint(5, 80)
+        history.append({
+            "sender": "user" if i % 2 else "bot",
+            "text": " ".join(rng.choice(WORDS) for _ in range(length))
+        })
+    return history
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark chat-history response encoding")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args(argv)
+
+    print(f"{'messages':>9} {'json ms':>8} {'orjson ms':>10} {'raw KB':>9} {'gzip ms':>8} {'gzip KB':>8} {'br ms':>7} {'br KB':>7}")
+    for size in args.sizes:
+        payload = {"chat_history": make_history(size), "status": "success"}
+
+        json_ms, _ = timed(lambda: json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        orjson_ms, body = timed(lambda: orjson.dumps(payload))
+        gzip_ms, gzipped = timed(lambda: gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL))
+
+        br_ms, br_kb = float("nan"), float("nan")
+        if brotli is not None:
+            br_ms, compressed = timed(lambda: brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY))
+            br_kb = len(compressed) / 1024
+
+        print(
+            f"{size:>9} {json_ms:>8.1f} {orjson_ms:>10.1f} {len(body) / 1024:>9.1f} "
+            f"{gzip_ms:>8.1f} {len(gzipped) / 1024:>8.1f} {br_ms:>7.1f} {br_kb:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
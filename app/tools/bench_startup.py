@@ -0,0 +1,106 @@
+"""
+Measure cold-start cost: `import server` in a fresh interpreter, then warm-up.
+
+    python -m tools.bench_startup --runs 5 --max-import-seconds 0.5
+
+Exits non-zero when the median import time exceeds --max-import-seconds or
+when importing the server pulls in a module that should load lazily, so it
+can run as a CI gate against import-time regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Must not be imported by `import server`; they load on first use / warm-up
+LAZY_MODULES = (
+    "chromadb", "langchain", "langchain_core", "langchain_openai", "openai",
+    "tavily", "fitz", "requests", "tiktoken", "torch", "sentence_transformers"
+)
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import server
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+WARMUP_PROBE = """
+import json, time
+import server, lifecycle
+start = time.perf_counter()
+lifecycle.warmup()
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_probe(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit):
+    """Slowest modules by cumulative import time (python -X importtime)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark server import and warm-up time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-seconds", type=float, default=0.5)
+    parser.add_argument("--warmup", action="store_true", help="Also time lifecycle.warmup()")
+    parser.add_argument("--top", type=int, default=10, help="Show the N slowest imports")
+    args = parser.parse_args(argv)
+
+    samples = [run_probe(IMPORT_PROBE) for _ in range(args.runs)]
+    seconds = [s["seconds"] for s in samples]
+    loaded = sorted({m for s in samples for m in s["loaded"]})
+    median = statistics.median(seconds)
+
+    print(f"import server: median={median * 1000:.1f}ms min={min(seconds) * 1000:.1f}ms max={max(seconds) * 1000:.1f}ms ({args.runs} runs)")
+    if args.top:
+        print("slowest imports (cumulative ms):")
+        for cumulative_us, name in top_imports(args.top):
+            print(f"  {cumulative_us / 1000:8.1f}  {name}")
+
+    if args.warmup:
+        print(f"warm-up: {run_probe(WARMUP_PROBE)['seconds']:.2f}s")
+
+    failed = False
+    if loaded:
+        print(f"❌ Eagerly imported modules that should be lazy: {', '.join(loaded)}")
+        failed = True
+    if median > args.max_import_seconds:
+        print(f"❌ Import time {median:.3f}s exceeds {args.max_import_seconds:.3f}s")
+        failed = True
+    if not failed:
+        print("✅ Startup within budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
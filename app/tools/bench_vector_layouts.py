@@ -0,0 +1,196 @@
+"""
+Compare the per-user and shared vectorstore layouts on synthetic data.
+
+    python -m tools.bench_vector_layouts --users 200 --chunks-per-user 50 --dim 1536
+
+Reports disk footprint (bytes, files), time to open a store and answer its
+first query, and warm query latency (a per-user collection vs the shared
+collection filtered by user_id).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from tenant_store import TENANT_KEY, tenant_value
+from chroma_clients import open_client, release_client, dir_footprint
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+def _vectors(rng, count, dim):
+    matrix = rng.standard_normal((count, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def build_per_user(root, users, chunks_per_user, dim, seed, batch_size=500):
+    rng = np.random.default_rng(seed)
+    for user in users:
+        client = open_client(os.path.join(root, f"user_{user}_vectorstore"))
+        collection = client.get_or_create_collection("langchain", embedding_function=None)
+        vectors = _vectors(rng, chunks_per_user, dim)
+        for start in range(0, chunks_per_user, batch_size):
+            end = min(chunks_per_user, start + batch_size)
+            collection.add(
+                ids=[f"{user}-{i}" for i in range(start, end)],
+                embeddings=vectors[start:end].tolist(),
+                documents=[f"chunk {i} of user {user}" for i in range(start, end)],
+                metadatas=[{"source": f"doc{i % 7}"} for i in range(start, end)]
+            )
+        release_client(client)
+
+
+def build_shared(root, users, chunks_per_user, dim, seed, batch_size=500):
+    rng = np.random.default_rng(seed)
+    client = open_client(root)
+    collection = client.get_or_create_collection("ragit_chunks", embedding_function=None)
+    for user in users:
+        vectors = _vectors(rng, chunks_per_user, dim)
+        for start in range(0, chunks_per_user, batch_size):
+            end = min(chunks_per_user, start + batch_size)
+            collection.add(
+                ids=[f"{user}-{i}" for i in range(start, end)],
+                embeddings=vectors[start:end].tolist(),
+                documents=[f"chunk {i} of user {user}" for i in range(start, end)],
+                metadatas=[{"source": f"doc{i % 7}", TENANT_KEY: tenant_value(user)} for i in range(start, end)]
+            )
+    release_client(client)
+
+
+def bench_per_user(root, users, queries, k, dim, seed):
+    rng = np.random.default_rng(seed + 1)
+    sample = random.Random(seed).sample(users, min(len(users), 50))
+
+    open_ms = []
+    for user in sample:
+        start = time.perf_counter()
+        client = open_client(os.path.join(root, f"user_{user}_vectorstore"))
+        collection = client.get_collection("langchain")
+        collection.query(query_embeddings=_vectors(rng, 1, dim).tolist(), n_results=k, include=[])
+        open_ms.append((time.perf_counter() - start) * 1000)
+        release_client(client)
+
+    # Warm queries: every store stays open, as a long-running server would keep it
+    clients = {user: open_client(os.path.join(root, f"user_{user}_vectorstore")) for user in sample}
+    collections = {user: client.get_collection("langchain") for user, client in clients.items()}
+    query_ms = []
+    for i in range(queries):
+        user = sample[i % len(sample)]
+        vector = _vectors(rng, 1, dim).tolist()
+        start = time.perf_counter()
+        collections[user].query(query_embeddings=vector, n_results=k, include=["documents", "metadatas"])
+        query_ms.append((time.perf_counter() - start) * 1000)
+    for client in clients.values():
+        release_client(client)
+    return open_ms, query_ms
+
+
+def bench_shared(root, users, queries, k, dim, seed):
+    rng = np.random.default_rng(seed + 1)
+    sample = random.Random(seed).sample(users, min(len(users), 50))
+
+    start = time.perf_counter()
+    client = open_client(root)
+    collection = client.get_collection("ragit_chunks")
+    collection.query(
+        query_embeddings=_vectors(rng, 1, dim).tolist(),
+        n_results=k,
+        where={TENANT_KEY: tenant_value(sample[0])},
+        include=[]
+    )
+    open_ms = [(time.perf_counter() - start) * 1000]
+
+    query_ms = []
+    for i in range(queries):
+        user = sample[i % len(sample)]
+        vector = _vectors(rng, 1, dim).tolist()
+        start = time.perf_counter()
+        collection.query(
+            query_embeddings=vector,
+            n_results=k,
+            where={TENANT_KEY: tenant_value(user)},
+            include=["documents", "metadatas"]
+        )
+        query_ms.append((time.perf_counter() - start) * 1000)
+    release_client(client)
+    return open_ms, query_ms
+
+
+def summarize(name, root, build_s, open_ms, query_ms):
+    size, files = dir_footprint(root)
+    return {
+        "layout": name,
+        "build_s": round(build_s, 2),
+        "disk_mb": round(size / 1e6, 2),
+        "files": files,
+        "open_first_query_ms_p50": round(statistics.median(open_ms), 2),
+        "query_ms_p50": round(statistics.median(query_ms), 2),
+        "query_ms_p95": round(_percentile(query_ms, 95), 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-user vs shared vectorstore layouts")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--chunks-per-user", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Build here instead of a temporary directory")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated stores")
+    parser.add_argument("--json-out")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ragit_layouts_")
+    per_user_root = os.path.join(workdir, "per_user")
+    shared_root = os.path.join(workdir, "shared")
+    os.makedirs(per_user_root, exist_ok=True)
+    users = list(range(1, args.users + 1))
+
+    try:
+        start = time.perf_counter()
+        build_per_user(per_user_root, users, args.chunks_per_user, args.dim, args.seed)
+        per_user_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        build_shared(shared_root, users, args.chunks_per_user, args.dim, args.seed)
+        shared_build = time.perf_counter() - start
+
+        results = [
+            summarize("per_user", per_user_root, per_user_build,
+                      *bench_per_user(per_user_root, users, args.queries, args.k, args.dim, args.seed)),
+            summarize("shared", shared_root, shared_build,
+                      *bench_shared(shared_root, users, args.queries, args.k, args.dim, args.seed))
+        ]
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.users} users x {args.chunks_per_user} chunks, dim={args.dim}, k={args.k}")
+    print(f"{'layout':<9} {'build s':>8} {'disk MB':>8} {'files':>7} {'open+1st ms':>12} {'query p50':>10} {'query p95':>10}")
+    for row in results:
+        print(
+            f"{row['layout']:<9} {row['build_s']:>8.2f} {row['disk_mb']:>8.2f} {row['files']:>7} "
+            f"{row['open_first_query_ms_p50']:>12.2f} {row['query_ms_p50']:>10.2f} {row['query_ms_p95']:>10.2f}"
+        )
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
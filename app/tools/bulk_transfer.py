@@ -0,0 +1,503 @@
+"""
+Bulk export/import of users, chats and vector data, e.g. to move tenants
+between environments or restore one without replaying ragit_db_backup.sql.
+
+    python -m tools.bulk_transfer export backups/2026-10 --workers 4
+    python -m tools.bulk_transfer export backups/tenant-12 --users 12 --format csv
+    python -m tools.bulk_transfer import backups/2026-10 --users 12 57 --replace --workers 8
+
+Layout of an export directory:
+
+    manifest.json                 format, columns and row counts per table, users
+    tables/<table>.bin|.csv       Postgres COPY output (binary by default)
+    vectors/user_<id>.npz         ids, float32 embeddings, documents and metadata
+    vectors/user_<id>.lexical.jsonl   the user's BM25 log (chunk ids are kept)
+
+Tables are exported from one REPEATABLE READ snapshot with COPY and
+streamed straight to/from disk. On import they are COPYed into temporary
+tables, filtered to --users and inserted in one transaction (users keep
+their ids; --replace deletes the selected users first, cascading to their
+rows). Vector snapshots are columnar: an embeddings matrix plus UTF-8
+blobs with offsets for ids, texts and metadata, so restoring them never
+calls the embeddings API. Stores are rebuilt next to the live one and
+swapped in, in parallel across users, for either VECTORSTORE_MODE.
+Uploaded PDFs under pdf/ are not part of the export.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from psycopg2 import errors as pg_errors
+
+from config import VECTORSTORE_MODE, SHARED_VECTORSTORE_PATH, SHARED_COLLECTION_NAME
+from chroma_clients import open_client, release_client, store_lock
+from db.connection import create_connection
+from db.queries.chats import bump_chat_history_version_query, raise_chat_history_version_query
+from lexical_index import INDEX_FILENAME
+from tenant_store import TENANT_KEY, tenant_value, tenant_filter
+from tools.migrate_vectorstores import VECTORSTORES_DIR, SOURCE_COLLECTION, APP_DIR, stream_chunks
+
+# Import order (foreign keys point at users)
+TABLES = [
+    ("users", "id"),
+    ("chat_history_versions", "user_id"),
+    ("documents", "user_id"),
+    ("chats", "user_id"),
+]
+SERIAL_TABLES = ["users", "documents", "chats"]
+EXTENSIONS = {"binary": "bin", "csv": "csv"}
+
+
+def _mb(size_bytes):
+    return size_bytes / 1e6
+
+
+def _rate(count, seconds):
+    return count / seconds if seconds else 0.0
+
+
+## Tables
+
+def table_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (name,))
+    return cur.fetchone()["present"]
+
+
+def table_columns(cur, name):
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (name,)
+    )
+    return [row["column_name"] for row in cur.fetchall()]
+
+
+def _copy_options(fmt):
+    return "FORMAT binary" if fmt == "binary" else "FORMAT csv, HEADER true"
+
+
+def export_tables(conn, out_dir, fmt, users=None):
+    """COPY each table (rows of the selected users only) to out_dir/tables; returns manifest entries"""
+    os.makedirs(os.path.join(out_dir, "tables"), exist_ok=True)
+    conn.autocommit = False
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    entries = {}
+    try:
+        with conn.cursor() as cur:
+            for table, key in TABLES:
+                if not table_exists(cur, table):
+                    continue
+                columns = table_columns(cur, table)
+                select = f"SELECT {', '.join(columns)} FROM {table}"
+                if users:
+                    select += cur.mogrify(f" WHERE {key} = ANY(%s)", (users,)).decode()
+                path = os.path.join(out_dir, "tables", f"{table}.{EXTENSIONS[fmt]}")
+
+                start = time.perf_counter()
+                with open(path, "wb") as f:
+                    cur.copy_expert(f"COPY ({select}) TO STDOUT WITH ({_copy_options(fmt)})", f)
+                elapsed = time.perf_counter() - start
+                cur.execute(f"SELECT COUNT(*) AS rows FROM ({select}) AS selected")
+                rows = cur.fetchone()["rows"]
+                size = os.path.getsize(path)
+                entries[table] = {"file": os.path.relpath(path, out_dir), "columns": columns, "rows": rows, "bytes": size}
+                print(
+                    f"  {table:<22} {rows:>10} rows {_mb(size):>9.2f} MB in {elapsed:6.2f}s "
+                    f"({_rate(rows, elapsed):,.0f} rows/s, {_rate(_mb(size), elapsed):.1f} MB/s)"
+                )
+        conn.commit()
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+    return entries
+
+
+def import_tables(conn, in_dir, manifest, users, replace=False):
+    """Load the exported tables in one transaction; returns {table: rows inserted}"""
+    fmt = manifest["format"]
+    inserted = {}
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            # Versions workers may have cached; the restored ones must end up above them
+            live_versions = []
+            if table_exists(cur, "chat_history_versions"):
+                cur.execute("SELECT user_id, version FROM chat_history_versions WHERE user_id = ANY(%s)", (users,))
+                live_versions = [(row["user_id"], row["version"]) for row in cur.fetchall()]
+            if replace:
+                cur.execute("DELETE FROM users WHERE id = ANY(%s)", (users,))
+                print(f"  removed {cur.rowcount} existing users (and their rows)")
+
+            for table, key in TABLES:
+                entry = manifest["tables"].get(table)
+                if entry is None:
+                    continue
+                if not table_exists(cur, table):
+                    print(f"  {table:<22} skipped (no such table in the target database)")
+                    continue
+                columns = ", ".join(entry["columns"])
+                staging = f"import_{table}"
+
+                start = time.perf_counter()
+                cur.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+                with open(os.path.join(in_dir, entry["file"]), "rb") as f:
+                    cur.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH ({_copy_options(fmt)})", f)
+                cur.execute(
+                    f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} WHERE {key} = ANY(%s)",
+                    (users,)
+                )
+                inserted[table] = cur.rowcount
+                elapsed = time.perf_counter() - start
+                print(
+                    f"  {table:<22} {cur.rowcount:>10} rows {_mb(entry['bytes']):>9.2f} MB in {elapsed:6.2f}s "
+                    f"({_rate(cur.rowcount, elapsed):,.0f} rows/s, {_rate(_mb(entry['bytes']), elapsed):.1f} MB/s)"
+                )
+
+            for user_id, version in live_versions:
+                cur.execute(raise_chat_history_version_query(), (version, user_id))
+
+            # New rows created after the import must not collide with imported ids
+            for table in SERIAL_TABLES:
+                if table in inserted:
+                    cur.execute(
+                        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(MAX(id), 1)) FROM {table}",
+                        (table,)
+                    )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+    # Workers may have cached histories of replaced users: every version is
+    # now GREATEST(live, imported) + 1, above anything they hold
+    with conn.cursor() as cur:
+        for user_id in users:
+            cur.execute(bump_chat_history_version_query(), (user_id, user_id))
+    return inserted
+
+
+## Vectors
+
+def _pack_strings(values):
+    """UTF-8 blob plus end offsets: a compact column of variable-length strings"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    starts = np.concatenate(([0], offsets[:-1]))
+    return [data[start:end].decode("utf-8") for start, end in zip(starts.tolist(), offsets.tolist())]
+
+
+def write_snapshot(path, ids, embeddings, documents, metadatas, compress=False):
+    columns = {"embeddings": embeddings}
+    for name, values in (("ids", ids), ("documents", documents), ("metadatas", [json.dumps(m) for m in metadatas])):
+        columns[name], columns[f"{name}_offsets"] = _pack_strings(values)
+    (np.savez_compressed if compress else np.savez)(path, **columns)
+
+
+def read_snapshot(path):
+    """(ids, embeddings, documents, metadatas) from a snapshot file"""
+    with np.load(path) as data:
+        ids = _unpack_strings(data["ids"], data["ids_offsets"])
+        documents = _unpack_strings(data["documents"], data["documents_offsets"])
+        metadatas = [json.loads(m) for m in _unpack_strings(data["metadatas"], data["metadatas_offsets"])]
+        return ids, data["embeddings"], documents, metadatas
+
+
+def user_store_path(stores_dir, user_id):
+    return os.path.join(stores_dir, f"user_{user_id}_vectorstore")
+
+
+def user_lexical_path(mode, stores_dir, shared_dir, user_id):
+    if mode == "shared":
+        return os.path.join(shared_dir, "lexical", f"user_{user_id}", INDEX_FILENAME)
+    return os.path.join(user_store_path(stores_dir, user_id), INDEX_FILENAME)
+
+
+def _read_chunks(collection, batch_size, where=None):
+    ids, embeddings, documents, metadatas = [], [], [], []
+    if where is None:
+        batches = stream_chunks(collection, batch_size)
+    else:
+        batches = _stream_where(collection, batch_size, where)
+    for batch in batches:
+        ids.extend(batch["ids"])
+        embeddings.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        documents.extend(text or "" for text in batch["documents"])
+        # The tenant key is added back on import into a shared collection
+        metadatas.extend({k: v for k, v in (m or {}).items() if k != TENANT_KEY} for m in batch["metadatas"])
+    matrix = np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    return ids, matrix, documents, metadatas
+
+
+def _stream_where(collection, batch_size, where):
+    offset = 0
+    while True:
+        batch = collection.get(
+            where=where,
+            limit=batch_size,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not batch["ids"]:
+            return
+        yield batch
+        offset += len(batch["ids"])
+
+
+def export_user_vectors(user_id, out_dir, mode, stores_dir, shared, shared_dir, batch_size, compress):
+    """Snapshot one user's chunks; returns a manifest entry (chunks 0 when they have none)"""
+    start = time.perf_counter()
+    collection_metadata = None
+    if mode == "shared":
+        ids, matrix, documents, metadatas = _read_chunks(shared, batch_size, where=tenant_filter(user_id))
+    else:
+        path = user_store_path(stores_dir, user_id)
+        if not os.path.isdir(path):
+            return {"user_id": user_id, "chunks": 0}
+        client = open_client(path)
+        try:
+            try:
+                collection = client.get_collection(SOURCE_COLLECTION)
+            except Exception:
+                return {"user_id": user_id, "chunks": 0}
+            collection_metadata = collection.metadata
+            ids, matrix, documents, metadatas = _read_chunks(collection, batch_size)
+        finally:
+            release_client(client)
+
+    entry = {"user_id": user_id, "chunks": len(ids), "collection_metadata": collection_metadata}
+    if ids:
+        snapshot = os.path.join(out_dir, "vectors", f"user_{user_id}.npz")
+        write_snapshot(snapshot, ids, matrix, documents, metadatas, compress)
+        entry.update(file=os.path.relpath(snapshot, out_dir), dimension=int(matrix.shape[1]), bytes=os.path.getsize(snapshot))
+
+    lexical = user_lexical_path(mode, stores_dir, shared_dir, user_id)
+    if os.path.exists(lexical):
+        target = os.path.join(out_dir, "vectors", f"user_{user_id}.lexical.jsonl")
+        shutil.copy2(lexical, target)
+        entry["lexical_file"] = os.path.relpath(target, out_dir)
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def _add_batches(collection, ids, matrix, documents, metadatas, batch_size):
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        collection.upsert(
+            ids=ids[start:end],
+            embeddings=matrix[start:end].tolist(),
+            documents=documents[start:end],
+            metadatas=[m or None for m in metadatas[start:end]]
+        )
+
+
+def import_user_vectors(entry, in_dir, mode, stores_dir, shared, shared_dir, batch_size, replace):
+    """Restore one user's snapshot; returns (status, chunks)"""
+    user_id = entry["user_id"]
+    ids, matrix, documents, metadatas = read_snapshot(os.path.join(in_dir, entry["file"]))
+
+    if mode == "shared":
+        if not replace and shared.get(where=tenant_filter(user_id), limit=1, include=[])["ids"]:
+            return "exists (use --replace)", 0
+        shared.delete(where=tenant_filter(user_id))
+        metadatas = [{**m, TENANT_KEY: tenant_value(user_id)} for m in metadatas]
+        _add_batches(shared, ids, matrix, documents, metadatas, batch_size)
+    else:
+        path = user_store_path(stores_dir, user_id)
+        if os.path.isdir(path) and os.listdir(path) and not replace:
+            return "exists (use --replace)", 0
+        # Build next to the live store and swap it in; the server reopens the
+        # client when it sees the new sqlite file (chroma_clients.get_store_client)
+        staging = path.rstrip("/") + ".restore"
+        shutil.rmtree(staging, ignore_errors=True)
+        client = open_client(staging)
+        try:
+            collection = client.create_collection(
+                SOURCE_COLLECTION, metadata=entry.get("collection_metadata"), embedding_function=None
+            )
+            _add_batches(collection, ids, matrix, documents, metadatas, batch_size)
+        finally:
+            release_client(client)
+        retired = path.rstrip("/") + ".old"
+        shutil.rmtree(retired, ignore_errors=True)
+        with store_lock(path, exclusive=True):
+            if os.path.exists(path):
+                os.rename(path, retired)
+            os.rename(staging, path)
+        shutil.rmtree(retired, ignore_errors=True)
+
+    if entry.get("lexical_file"):
+        target = user_lexical_path(mode, stores_dir, shared_dir, user_id)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Replace rather than overwrite, so running workers see a new log and reload it
+        shutil.copy2(os.path.join(in_dir, entry["lexical_file"]), target + ".tmp")
+        os.replace(target + ".tmp", target)
+    return "restored", len(ids)
+
+
+def _open_shared(shared_dir, create=False):
+    client = open_client(shared_dir)
+    if create:
+        # Same collection settings as langchain_chroma, so scores match
+        return client, client.get_or_create_collection(SHARED_COLLECTION_NAME, embedding_function=None)
+    return client, client.get_collection(SHARED_COLLECTION_NAME)
+
+
+def _run_parallel(fn, items, workers):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, items))
+
+
+## Commands
+
+def run_export(args):
+    os.makedirs(os.path.join(args.directory, "vectors"), exist_ok=True)
+    conn = create_connection()
+    manifest = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "format": args.format,
+        "vectorstore_mode": args.mode,
+        "users": None,
+        "tables": {},
+        "vectors": []
+    }
+    try:
+        with conn.cursor() as cur:
+            if args.users:
+                cur.execute("SELECT id FROM users WHERE id = ANY(%s) ORDER BY id", (args.users,))
+            else:
+                cur.execute("SELECT id FROM users ORDER BY id")
+            users = [row["id"] for row in cur.fetchall()]
+        manifest["users"] = users
+
+        if not args.skip_tables:
+            print(f"Exporting tables ({args.format}) for {len(users)} users")
+            manifest["tables"] = export_tables(conn, args.directory, args.format, args.users and users)
+    finally:
+        conn.close()
+
+    if not args.skip_vectors:
+        print(f"Exporting vectors ({args.mode}) with {args.workers} workers")
+        shared_client = shared = None
+        if args.mode == "shared":
+            shared_client, shared = _open_shared(args.shared_dir)
+        start = time.perf_counter()
+        try:
+            manifest["vectors"] = _run_parallel(
+                lambda user_id: export_user_vectors(
+                    user_id, args.directory, args.mode, args.stores_dir, shared, args.shared_dir,
+                    args.batch_size, args.compress
+                ),
+                users,
+                args.workers
+            )
+        finally:
+            if shared_client is not None:
+                release_client(shared_client)
+        _report_vectors(manifest["vectors"], time.perf_counter() - start, "Exported")
+
+    with open(os.path.join(args.directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return 0
+
+
+def run_import(args):
+    with open(os.path.join(args.directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    users = manifest["users"]
+    if args.users:
+        missing = sorted(set(args.users) - set(users))
+        if missing:
+            print(f"❌ Users not in this export: {missing}")
+            return 1
+        users = [user_id for user_id in users if user_id in set(args.users)]
+
+    if not args.skip_tables and manifest["tables"]:
+        print(f"Importing tables ({manifest['format']}) for {len(users)} users")
+        conn = create_connection()
+        try:
+            import_tables(conn, args.directory, manifest, users, args.replace)
+        except pg_errors.UniqueViolation as e:
+            print(f"❌ Rows already exist in the target ({e.diag.constraint_name}); nothing was imported. Use --replace to overwrite")
+            return 1
+        finally:
+            conn.close()
+
+    if not args.skip_vectors:
+        wanted = set(users)
+        entries = [entry for entry in manifest["vectors"] if entry["user_id"] in wanted and entry.get("file")]
+        print(f"Restoring vectors ({args.mode}) for {len(entries)} users with {args.workers} workers")
+        shared_client = shared = None
+        if args.mode == "shared":
+            os.makedirs(args.shared_dir, exist_ok=True)
+            shared_client, shared = _open_shared(args.shared_dir, create=True)
+        start = time.perf_counter()
+        try:
+            results = _run_parallel(
+                lambda entry: import_user_vectors(
+                    entry, args.directory, args.mode, args.stores_dir, shared, args.shared_dir,
+                    args.batch_size, args.replace
+                ),
+                entries,
+                args.workers
+            )
+        finally:
+            if shared_client is not None:
+                release_client(shared_client)
+        for entry, (status, _) in zip(entries, results):
+            if status != "restored":
+                print(f"  user {entry['user_id']}: {status}")
+        restored = [dict(entry, chunks=chunks) for entry, (status, chunks) in zip(entries, results) if status == "restored"]
+        _report_vectors(restored, time.perf_counter() - start, "Restored")
+    return 0
+
+
+def _report_vectors(entries, elapsed, verb):
+    chunks = sum(entry["chunks"] for entry in entries)
+    size = sum(entry.get("bytes", 0) for entry in entries)
+    users = sum(1 for entry in entries if entry["chunks"])
+    print(
+        f"  {verb} {chunks} chunks for {users} users ({_mb(size):.2f} MB) in {elapsed:.2f}s "
+        f"({_rate(chunks, elapsed):,.0f} chunks/s, {_rate(_mb(size), elapsed):.1f} MB/s)"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export/import of users, chats and vectorstores")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory", help="Export directory (written by export, read by import)")
+    parser.add_argument("--users", type=int, nargs="+", help="Only these user ids")
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default="binary", help="COPY format (export)")
+    parser.add_argument("--mode", choices=["per_user", "shared"], default=VECTORSTORE_MODE, help="Vectorstore layout")
+    parser.add_argument("--stores-dir", default=VECTORSTORES_DIR, help="Directory holding user_*_vectorstore stores")
+    parser.add_argument("--shared-dir", default=os.path.join(APP_DIR, SHARED_VECTORSTORE_PATH))
+    parser.add_argument("--workers", type=int, default=4, help="Users exported/restored in parallel")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Chunks per Chroma read/write")
+    parser.add_argument("--compress", action="store_true", help="Compress vector snapshots (smaller, slower)")
+    parser.add_argument("--replace", action="store_true", help="Overwrite users and stores that already exist (import)")
+    parser.add_argument("--skip-tables", action="store_true")
+    parser.add_argument("--skip-vectors", action="store_true")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    status = run_export(args) if args.command == "export" else run_import(args)
+    print(f"\n{'✅' if status == 0 else '❌'} {args.command} finished in {time.perf_counter() - start:.1f}s")
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
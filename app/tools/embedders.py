@@ -0,0 +1,150 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embedder for offline runs (no network, no model).
+
+    Tokens are hashed into a fixed number of signed buckets and the vector is
+    L2-normalised, so cosine similarity approximates lexical overlap.
+    """
+
+    def __init__(self, dimensions=1536):
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimensions
+        for token in _TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = -1.0 if value >> 63 else 1.0
+            vector[value % self.dimensions] += sign
+
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            vector = [v / norm for v in vector]
+        return vector
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrap a real embedder with an on-disk SQLite cache keyed by (model, text).
+
+    Repeated evaluation runs over the same corpus and questions only pay for
+    the embedding API once.
+    """
+
+    def __init__(self, embedder, cache_path, namespace="default"):
+        self.embedder = embedder
+        self.namespace = namespace
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    found[key] = array("f", row[0]).tolist()
+        return found
+
+    def _store(self, items):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._db.commit()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(set(keys))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text)
+        cached = self._lookup([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+
+        self.misses += 1
+        vector = self.embedder.embed_query(text)
+        self._store([(key, vector)])
+        return vector
+
+
+def make_embedder(name, cache_path=None):
+    """
+    Build an embedder for offline tools.
+
+    "fake"  -> HashingEmbeddings (no network)
+    "azure" -> the production Azure embedder behind an on-disk cache
+    """
+    if name == "fake":
+        return HashingEmbeddings()
+
+    if name == "azure":
+        from langchain_openai import AzureOpenAIEmbeddings
+        from config import (
+            AZURE_OPENAI_EMBEDDINGS_API_KEY,
+            AZURE_OPENAI_EMBEDDINGS_ENDPOINT,
+            AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME
+        )
+
+        embedder = AzureOpenAIEmbeddings(
+            azure_endpoint=AZURE_OPENAI_EMBEDDINGS_ENDPOINT,
+            api_key=AZURE_OPENAI_EMBEDDINGS_API_KEY,
+            azure_deployment=AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME,
+            model="text-embedding-3-small",
+            openai_api_version="2024-05-01-preview"
+        )
+        if cache_path is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            cache_path = os.path.join(current_dir, "..", "db", "embedding_cache.sqlite3")
+        return CachedEmbeddings(embedder, cache_path, namespace="text-embedding-3-small")
+
+    raise ValueError(f"Unknown embedder: {name}")
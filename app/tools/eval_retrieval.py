@@ -0,0 +1,347 @@
+"""
+Offline retrieval evaluation: recall@k, MRR and per-query latency.
+
+Runs against a *copy* of a user vectorstore, never the live directory.
+
+Usage (from the app/ directory):
+
+    python -m tools.eval_retrieval \\
+        --store db/vectorstores/user_3_vectorstore \\
+        --labels eval/user_3.jsonl \\
+        --k 3 --embedder fake --chunk-size 1000 --chunk-overlap 200
+
+    # the same questions against the token chunker (sizes in tokens)
+    python -m tools.eval_retrieval --store ... --labels ... --splitter token --chunk-size 256 --chunk-overlap 48
+
+Labels file (JSON list or JSONL), one entry per question:
+
+    {"question": "What is Wintermute?",
+     "relevant": ["Wintermute is a local, low-code"],   # text snippets
+     "relevant_ids": ["<chroma id>"]}                    # optional
+
+A retrieved chunk matches a snippet when it contains it (case-insensitive),
+so labels survive re-chunking with different splitter settings.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import chromadb
+from chromadb.config import Settings
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from tools.embedders import make_embedder
+
+PDF_SEPARATORS = ["\n\n## ", "\n##", "\n#", "\n\n", "\n", "  ", " ", ""]
+COLLECTION_NAME = "langchain"
+
+
+def load_labels(path):
+    """Load labeled questions from a JSON list or a JSONL file"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+
+    if text.startswith("["):
+        labels = json.loads(text)
+    else:
+        labels = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    for label in labels:
+        label.setdefault("relevant", [])
+        label.setdefault("relevant_ids", [])
+    return labels
+
+
+def copy_store(store_path):
+    """Copy a persisted vectorstore into a temp dir so evaluation never touches the original"""
+    target = tempfile.mkdtemp(prefix="ragit_eval_")
+    shutil.copytree(store_path, os.path.join(target, "store"))
+    return os.path.join(target, "store")
+
+
+def read_store_chunks(persist_dir, collection_name=COLLECTION_NAME):
+    """Read every chunk (id, text, metadata) from a persisted Chroma store in insertion order"""
+    client = chromadb.PersistentClient(
+        path=persist_dir, settings=Settings(anonymized_telemetry=False)
+    )
+    collection = client.get_collection(collection_name)
+    result = collection.get(include=["documents", "metadatas"])
+    return list(zip(result["ids"], result["documents"], result["metadatas"]))
+
+
+def _merge_overlapping(previous, current, max_overlap):
+    """Append `current` to `previous`, dropping the prefix that repeats the tail of `previous`"""
+    limit = min(max_overlap, len(previous), len(current))
+    for size in range(limit, 0, -1):
+        if previous.endswith(current[:size]):
+            return previous + current[size:]
+    return previous + "\n\n" + current
+
+
+def reconstruct_sources(chunks, chunk_overlap=200):
+    """
+    Rebuild whole source documents from stored chunks so they can be re-split
+    with different settings. Overlapping regions are stitched back together.
+    """
+    texts = {}
+    metadata = {}
+    for _, text, meta in chunks:
+        meta = meta or {}
+        source = meta.get("source", "unknown")
+        if source in texts:
+            texts[source] = _merge_overlapping(texts[source], text, chunk_overlap)
+        else:
+            texts[source] = text
+            metadata[source] = dict(meta)
+
+    return [Document(page_content=texts[source], metadata=metadata[source]) for source in texts]
+
+
+def split_documents(documents, splitter, chunk_size, chunk_overlap):
+    """
+    Re-split documents with the legacy character splitter ("recursive") or the
+    token chunker ("token", where chunk_size/chunk_overlap count tokens)
+    """
+    if splitter == "token":
+        from chunking import chunk_documents
+        return chunk_documents(documents, chunk_size, chunk_overlap)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=PDF_SEPARATORS
+    ).split_documents(documents)
+
+
+def build_store(documents, embedder, chunk_size, chunk_overlap, persist_dir, hnsw=None, splitter="recursive"):
+    """Re-split the documents and index them into a fresh Chroma store"""
+    split_docs = split_documents(documents, splitter, chunk_size, chunk_overlap)
+
+    vectorstore = Chroma(
+        collection_name=COLLECTION_NAME,
+        persist_directory=persist_dir,
+        embedding_function=embedder,
+        collection_metadata=hnsw or None,
+        client_settings=Settings(anonymized_telemetry=False, is_persistent=True, persist_directory=persist_dir)
+    )
+    if split_docs:
+        vectorstore.add_documents(split_docs)
+    return vectorstore, len(split_docs)
+
+
+def make_exact_search(vectorstore, embedder):
+    """Brute-force cosine search over every stored vector (ground truth for HNSW tuning)"""
+    import numpy as np
+
+    stored = vectorstore._collection.get(include=["embeddings", "documents", "metadatas"])
+    matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+    if len(matrix):
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+
+    def search(question, k):
+        if not len(matrix):
+            return []
+        query = np.asarray(embedder.embed_query(question), dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-12
+        scores = matrix @ query
+        top = np.argsort(-scores)[:k]
+        return [
+            Document(
+                id=stored["ids"][i],
+                page_content=stored["documents"][i],
+                metadata=stored["metadatas"][i] or {}
+            )
+            for i in top
+        ]
+
+    return search
+
+
+def is_relevant(doc, label):
+    """A chunk is relevant if its id is labeled or it contains a labeled snippet"""
+    if getattr(doc, "id", None) and doc.id in label["relevant_ids"]:
+        return True
+    text = doc.page_content.lower()
+    return any(snippet.lower() in text for snippet in label["relevant"])
+
+
+def score_query(docs, label, k):
+    """Return (recall@k, reciprocal rank) for one query"""
+    targets = [("id", value) for value in label["relevant_ids"]]
+    targets += [("text", value.lower()) for value in label["relevant"]]
+
+    found = set()
+    for doc in docs[:k]:
+        text = doc.page_content.lower()
+        for kind, value in targets:
+            if kind == "id" and getattr(doc, "id", None) == value:
+                found.add((kind, value))
+            elif kind == "text" and value in text:
+                found.add((kind, value))
+
+    recall = len(found) / len(targets) if targets else 0.0
+
+    reciprocal_rank = 0.0
+    for rank, doc in enumerate(docs[:k], start=1):
+        if is_relevant(doc, label):
+            reciprocal_rank = 1.0 / rank
+            break
+
+    return recall, reciprocal_rank
+
+
+def evaluate(search, labels, k):
+    """Run every labeled question through `search(question, k)` and collect metrics"""
+    rows = []
+    for label in labels:
+        start = time.perf_counter()
+        docs = search(label["question"], k)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        recall, reciprocal_rank = score_query(docs, label, k)
+        rows.append({
+            "question": label["question"],
+            "recall": recall,
+            "reciprocal_rank": reciprocal_rank,
+            "latency_ms": latency_ms,
+            "retrieved_ids": [getattr(doc, "id", None) for doc in docs]
+        })
+
+    latencies = sorted(row["latency_ms"] for row in rows)
+    summary = {
+        "queries": len(rows),
+        "k": k,
+        "recall_at_k": statistics.fmean(row["recall"] for row in rows) if rows else 0.0,
+        "mrr": statistics.fmean(row["reciprocal_rank"] for row in rows) if rows else 0.0,
+        "latency_p50_ms": _percentile(latencies, 50),
+        "latency_p95_ms": _percentile(latencies, 95),
+        "latency_max_ms": latencies[-1] if latencies else 0.0
+    }
+    return rows, summary
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def print_report(rows, summary, settings):
+    print("\nSettings: " + ", ".join(f"{key}={value}" for key, value in settings.items()))
+    print(f"\n{'latency ms':>10}  {'recall':>6}  {'RR':>5}  question")
+    for row in rows:
+        print(f"{row['latency_ms']:>10.2f}  {row['recall']:>6.2f}  {row['reciprocal_rank']:>5.2f}  {row['question'][:70]}")
+
+    print(
+        f"\nrecall@{summary['k']}={summary['recall_at_k']:.3f}  MRR={summary['mrr']:.3f}  "
+        f"p50={summary['latency_p50_ms']:.2f}ms  p95={summary['latency_p95_ms']:.2f}ms  "
+        f"max={summary['latency_max_ms']:.2f}ms  ({summary['queries']} queries)"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality vs latency on a copy of a user vectorstore")
+    parser.add_argument("--store", required=True, help="Path to a user_N_vectorstore directory")
+    parser.add_argument("--labels", required=True, help="Labeled questions (JSON list or JSONL)")
+    parser.add_argument("--k", type=int, default=3, help="Number of chunks retrieved per query")
+    parser.add_argument("--embedder", choices=["fake", "azure"], default="fake",
+                        help="fake = offline hashing embedder, azure = production embedder with on-disk cache")
+    parser.add_argument("--cache-path", default=None, help="SQLite embedding cache for --embedder azure")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Re-split and re-embed the store's content (implied by --embedder fake)")
+    parser.add_argument("--splitter", choices=["recursive", "token"], default="recursive",
+                        help="recursive: character splitter; token: chunking.py (sizes in tokens)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Default 1000 characters (recursive) or CHUNK_TOKENS (token)")
+    parser.add_argument("--chunk-overlap", type=int, default=None,
+                        help="Default 200 characters (recursive) or CHUNK_OVERLAP_TOKENS (token)")
+    parser.add_argument("--source-overlap", type=int, default=200,
+                        help="chunk_overlap the store was originally built with (used to stitch sources back together)")
+    parser.add_argument("--backend", choices=["hnsw", "exact"], default="hnsw")
+    parser.add_argument("--hnsw-space", default=None, help="hnsw:space for rebuilt stores (l2, cosine, ip)")
+    parser.add_argument("--hnsw-m", type=int, default=None)
+    parser.add_argument("--hnsw-construction-ef", type=int, default=None)
+    parser.add_argument("--hnsw-search-ef", type=int, default=None)
+    parser.add_argument("--json-out", default=None, help="Write per-query rows and summary as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.splitter == "token":
+        from config import CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+        default_size, default_overlap = CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+    else:
+        default_size, default_overlap = 1000, 200
+    args.chunk_size = args.chunk_size if args.chunk_size is not None else default_size
+    args.chunk_overlap = args.chunk_overlap if args.chunk_overlap is not None else default_overlap
+    labels = load_labels(args.labels)
+    embedder = make_embedder(args.embedder, args.cache_path)
+
+    rebuild = args.rebuild or args.embedder == "fake"
+    if args.embedder == "fake" and not args.rebuild:
+        print("Note: --embedder fake cannot query stored production vectors, re-embedding the copy")
+
+    workdir = copy_store(args.store)
+    try:
+        if rebuild:
+            hnsw = {}
+            if args.hnsw_space:
+                hnsw["hnsw:space"] = args.hnsw_space
+            if args.hnsw_m:
+                hnsw["hnsw:M"] = args.hnsw_m
+            if args.hnsw_construction_ef:
+                hnsw["hnsw:construction_ef"] = args.hnsw_construction_ef
+            if args.hnsw_search_ef:
+                hnsw["hnsw:search_ef"] = args.hnsw_search_ef
+
+            sources = reconstruct_sources(read_store_chunks(workdir), args.source_overlap)
+            rebuilt_dir = os.path.join(os.path.dirname(workdir), "rebuilt")
+            build_start = time.perf_counter()
+            vectorstore, chunk_count = build_store(
+                sources, embedder, args.chunk_size, args.chunk_overlap, rebuilt_dir, hnsw, args.splitter
+            )
+            print(f"Rebuilt {len(sources)} sources into {chunk_count} chunks in {time.perf_counter() - build_start:.2f}s")
+        else:
+            vectorstore = Chroma(
+                collection_name=COLLECTION_NAME,
+                persist_directory=workdir,
+                embedding_function=embedder,
+                client_settings=Settings(anonymized_telemetry=False, is_persistent=True, persist_directory=workdir)
+            )
+
+        if args.backend == "exact":
+            search = make_exact_search(vectorstore, embedder)
+        else:
+            search = lambda question, k: vectorstore.similarity_search(question, k=k)
+
+        rows, summary = evaluate(search, labels, args.k)
+
+        settings = {
+            "store": args.store,
+            "embedder": args.embedder,
+            "rebuild": rebuild,
+            "splitter": args.splitter if rebuild else "stored",
+            "chunk_size": args.chunk_size if rebuild else "stored",
+            "chunk_overlap": args.chunk_overlap if rebuild else "stored",
+            "backend": args.backend
+        }
+        print_report(rows, summary, settings)
+
+        if args.json_out:
+            with open(args.json_out, "w", encoding="utf-8") as f:
+                json.dump({"settings": settings, "summary": summary, "queries": rows}, f, indent=2)
+
+        return summary
+    finally:
+        shutil.rmtree(os.path.dirname(workdir), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Move per-user Chroma stores into the shared multi-tenant collection.
+
+    python -m tools.migrate_vectorstores --batch-size 500
+    python -m tools.migrate_vectorstores --users 12 57 --remove-source
+
+Stored embeddings are copied as-is (nothing is re-embedded) and each store
+is streamed in batches. Chunk ids are kept, so each user's lexical index
+file is copied next to the shared store unchanged. Upserts are idempotent,
+so an interrupted run can simply be restarted. Switch the server over with
+VECTORSTORE_MODE=shared once the run reports every user as verified.
+"""
+import argparse
+import os
+import re
+import shutil
+import time
+
+from config import VECTORSTORES_DIR as STORES_DIR, SHARED_VECTORSTORE_PATH, SHARED_COLLECTION_NAME
+from lexical_index import INDEX_FILENAME
+from tenant_store import TENANT_KEY, tenant_value
+from chroma_clients import open_client, release_client
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VECTORSTORES_DIR = os.path.join(APP_DIR, STORES_DIR)
+USER_STORE_RE = re.compile(r"^user_(.+)_vectorstore$")
+SOURCE_COLLECTION = "langchain"  # langchain_chroma's default collection name
+
+
+def iter_user_stores(root, users=None):
+    """Yield (user_id, path) for every per-user store under root"""
+    wanted = {str(u) for u in users} if users else None
+    for name in sorted(os.listdir(root)):
+        match = USER_STORE_RE.match(name)
+        path = os.path.join(root, name)
+        if not match or not os.path.isdir(path):
+            continue
+        if wanted is not None and match.group(1) not in wanted:
+            continue
+        yield match.group(1), path
+
+
+def stream_chunks(collection, batch_size):
+    """Page through a collection with its stored embeddings"""
+    offset = 0
+    while True:
+        batch = collection.get(
+            limit=batch_size,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not batch["ids"]:
+            return
+        yield batch
+        offset += len(batch["ids"])
+
+
+def count_tenant(shared, user_id):
+    return len(shared.get(where={TENANT_KEY: tenant_value(user_id)}, include=[])["ids"])
+
+
+def migrate_user(user_id, path, shared, shared_root, batch_size, dry_run=False):
+    """Copy one user's chunks into the shared collection; returns (source count, copied)"""
+    client = open_client(path)
+    try:
+        try:
+            collection = client.get_collection(SOURCE_COLLECTION)
+        except Exception:
+            return 0, 0
+
+        source_count = collection.count()
+        copied = 0
+        for batch in stream_chunks(collection, batch_size):
+            metadatas = [
+                {**(metadata or {}), TENANT_KEY: tenant_value(user_id)}
+                for metadata in batch["metadatas"]
+            ]
+            if not dry_run:
+                shared.upsert(
+                    ids=batch["ids"],
+                    embeddings=batch["embeddings"],
+                    documents=batch["documents"],
+                    metadatas=metadatas
+                )
+            copied += len(batch["ids"])
+    finally:
+        release_client(client)
+
+    lexical_source = os.path.join(path, INDEX_FILENAME)
+    lexical_target_dir = os.path.join(shared_root, "lexical", f"user_{user_id}")
+    if not dry_run and os.path.exists(lexical_source) and not os.path.exists(os.path.join(lexical_target_dir, INDEX_FILENAME)):
+        os.makedirs(lexical_target_dir, exist_ok=True)
+        shutil.copy2(lexical_source, lexical_target_dir)
+
+    return source_count, copied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate per-user vectorstores into the shared collection")
+    parser.add_argument("--source", default=VECTORSTORES_DIR, help="Directory holding user_*_vectorstore stores")
+    parser.add_argument("--target", default=os.path.join(APP_DIR, SHARED_VECTORSTORE_PATH))
+    parser.add_argument("--collection", default=SHARED_COLLECTION_NAME)
+    parser.add_argument("--users", nargs="+", help="Only migrate these user ids")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Read the sources without writing")
+    parser.add_argument("--remove-source", action="store_true", help="Delete each per-user store once verified")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.target, exist_ok=True)
+    shared_client = open_client(args.target)
+    # Same collection settings as langchain_chroma, so scores match the per-user stores
+    shared = shared_client.get_or_create_collection(args.collection, embedding_function=None)
+
+    start = time.perf_counter()
+    totals = {"users": 0, "chunks": 0, "verified": 0, "mismatched": 0}
+    for user_id, path in iter_user_stores(args.source, args.users):
+        user_start = time.perf_counter()
+        source_count, copied = migrate_user(user_id, path, shared, args.target, args.batch_size, args.dry_run)
+        totals["users"] += 1
+        totals["chunks"] += copied
+
+        status = "dry run"
+        if not args.dry_run:
+            stored = count_tenant(shared, user_id)
+            if stored >= source_count:
+                totals["verified"] += 1
+                status = "verified"
+                if args.remove_source:
+                    shutil.rmtree(path)
+                    status = "verified, source removed"
+            else:
+                totals["mismatched"] += 1
+                status = f"MISMATCH ({stored} in shared collection)"
+
+        print(f"user {user_id}: {copied}/{source_count} chunks in {time.perf_counter() - user_start:.2f}s ({status})")
+
+    elapsed = time.perf_counter() - start
+    rate = totals["chunks"] / elapsed if elapsed else 0.0
+    print(
+        f"\nMigrated {totals['chunks']} chunks for {totals['users']} users in {elapsed:.1f}s "
+        f"({rate:.0f} chunks/s); verified={totals['verified']} mismatched={totals['mismatched']}"
+    )
+    return 1 if totals["mismatched"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,141 @@
+"""
+Convert the existing chats table into the partitioned layout from
+db/schema/chats_partitioned_table.sql.
+
+    python -m tools.partition_chats --dry-run
+    python -m tools.partition_chats --batch-size 20000
+    python -m tools.partition_chats --drop-legacy      # once the new table is verified
+
+Runs in one transaction: the old table is renamed to chats_legacy, the
+partitioned table is created with a monthly partition for every month that
+has messages (plus CHATS_PARTITIONS_AHEAD months), and rows are copied in
+id ranges of --batch-size. Writers wait on the rename until the copy
+commits, so run it in a quiet window. Any error rolls everything back.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from config import CHATS_PARTITIONS_AHEAD
+from db.connection import create_connection
+from retention import ensure_partitions, is_partitioned, month_start, next_month
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(APP_DIR, "db", "schema", "chats_partitioned_table.sql")
+LEGACY_TABLE = "chats_legacy"
+
+
+def table_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (name,))
+    return cur.fetchone()["present"]
+
+
+def copy_rows(cur, batch_size):
+    """Copy chats_legacy into chats in id ranges; returns rows copied"""
+    cur.execute(f"SELECT MIN(id) AS low, MAX(id) AS high FROM {LEGACY_TABLE}")
+    bounds = cur.fetchone()
+    if bounds["low"] is None:
+        return 0
+
+    copied = 0
+    lower = bounds["low"]
+    while lower <= bounds["high"]:
+        upper = lower + batch_size
+        cur.execute(
+            f"""
+            INSERT INTO chats (id, user_id, message_text, sender, created_at, message_order)
+            SELECT id, user_id, message_text, sender, COALESCE(created_at, CURRENT_TIMESTAMP), message_order
+            FROM {LEGACY_TABLE}
+            WHERE id >= %s AND id < %s
+            """,
+            (lower, upper)
+        )
+        copied += cur.rowcount
+        lower = upper
+    return copied
+
+
+def migrate(conn, batch_size, partitions_ahead, dry_run=False):
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            if is_partitioned(conn):
+                print("chats is already partitioned, nothing to do")
+                conn.rollback()
+                return 0
+            if table_exists(cur, LEGACY_TABLE):
+                raise RuntimeError(f"{LEGACY_TABLE} already exists; drop it or finish the previous migration first")
+
+            cur.execute("LOCK TABLE chats IN ACCESS EXCLUSIVE MODE")
+            cur.execute("SELECT COUNT(*) AS row_count, MIN(created_at) AS oldest FROM chats")
+            source = cur.fetchone()
+
+            # Free the names the partitioned table reuses; the sequence outlives the old table
+            cur.execute(f"ALTER TABLE chats RENAME TO {LEGACY_TABLE}")
+            cur.execute(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT chats_pkey TO {LEGACY_TABLE}_pkey")
+            cur.execute("ALTER INDEX IF EXISTS idx_chats_user_id_order RENAME TO idx_chats_legacy_user_id_order")
+            cur.execute("ALTER INDEX IF EXISTS idx_chats_created_at RENAME TO idx_chats_legacy_created_at")
+            cur.execute(f"ALTER TABLE {LEGACY_TABLE} ALTER COLUMN id DROP DEFAULT")
+            cur.execute("ALTER SEQUENCE chats_id_seq OWNED BY NONE")
+
+            with open(SCHEMA_PATH) as f:
+                cur.execute(f.read())
+
+            now = datetime.now()
+            oldest = source["oldest"] or now
+            end = next_month(month_start(now) + timedelta(days=31 * partitions_ahead))
+            created = ensure_partitions(conn, oldest, end)
+            print(f"Created {len(created)} monthly partitions ({created[0]} .. {created[-1]})" if created else "No partitions created")
+
+            start = time.perf_counter()
+            copied = copy_rows(cur, batch_size)
+            elapsed = time.perf_counter() - start
+            print(f"Copied {copied}/{source['row_count']} rows in {elapsed:.1f}s")
+            if copied != source["row_count"]:
+                raise RuntimeError(f"row count mismatch ({copied} copied, {source['row_count']} in the source)")
+
+            cur.execute("SELECT setval('chats_id_seq', GREATEST((SELECT COALESCE(MAX(id), 0) FROM chats), 1))")
+
+        if dry_run:
+            conn.rollback()
+            print("Dry run: rolled back")
+        else:
+            conn.commit()
+            print(f"✅ chats is now partitioned; the old rows remain in {LEGACY_TABLE} until --drop-legacy")
+        return 0
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+
+def drop_legacy(conn):
+    with conn.cursor() as cur:
+        if not is_partitioned(conn):
+            raise RuntimeError("chats is not partitioned yet; run the migration first")
+        cur.execute(f"DROP TABLE IF EXISTS {LEGACY_TABLE}")
+    print(f"Dropped {LEGACY_TABLE}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the chats table to monthly partitions")
+    parser.add_argument("--batch-size", type=int, default=20000, help="Rows per copy statement (by id range)")
+    parser.add_argument("--partitions-ahead", type=int, default=CHATS_PARTITIONS_AHEAD)
+    parser.add_argument("--dry-run", action="store_true", help="Run the whole migration, then roll it back")
+    parser.add_argument("--drop-legacy", action="store_true", help=f"Drop {LEGACY_TABLE} after a migration")
+    args = parser.parse_args(argv)
+
+    conn = create_connection()
+    try:
+        if args.drop_legacy:
+            return drop_legacy(conn)
+        return migrate(conn, args.batch_size, args.partitions_ahead, args.dry_run)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
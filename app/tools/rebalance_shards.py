@@ -0,0 +1,144 @@
+"""
+Move users' vectorstores between nodes when the shard ring changes.
+
+    # 1. copy every user whose owner changes to their new node
+    python -m tools.rebalance_shards --old "a=http://10.0.0.1:8123,b=http://10.0.0.2:8123" \\
+        --new "a=http://10.0.0.1:8123,b=http://10.0.0.2:8123,c=http://10.0.0.3:8123"
+    # 2. restart the nodes and the router with SHARD_NODES set to the new list
+    # 3. remove the moved stores from their old nodes
+    python -m tools.rebalance_shards --old ... --new ... --cleanup
+
+Stores move as vector snapshots through the nodes' /internal endpoints
+(INTERNAL_TOKEN), so nothing is re-embedded; the lexical index is rebuilt
+on the new node at first use. Copies replace whatever the new node holds
+for the user, so step 1 can be re-run; writes a user makes between steps 1
+and 2 stay on the old node. Old nodes refuse --cleanup for users they still
+own. Uploaded PDFs are not moved. Users are read from the database unless
+--users is given.
+"""
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from config import INTERNAL_TOKEN, SHARD_VNODES
+from db.connection import create_connection
+from sharding import HashRing, parse_nodes
+
+TIMEOUT_SECONDS = 600
+
+
+def _headers(extra=None):
+    return {"X-Internal-Token": INTERNAL_TOKEN, **(extra or {})}
+
+
+def list_user_ids():
+    conn = create_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM users ORDER BY id")
+            return [row["id"] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def copy_user(session, user_id, source_url, target_url):
+    """Copy one user's snapshot; returns (status, chunks, bytes)"""
+    with tempfile.TemporaryFile() as snapshot:
+        with session.get(f"{source_url}/internal/users/{user_id}/store", headers=_headers(), stream=True, timeout=TIMEOUT_SECONDS) as response:
+            if response.status_code == 404:
+                return "no vectors", 0, 0
+            response.raise_for_status()
+            expected = int(response.headers["X-Chunk-Count"])
+            metadata = response.headers.get("X-Collection-Metadata", "null")
+            for block in response.iter_content(1024 * 1024):
+                snapshot.write(block)
+        size = snapshot.tell()
+        snapshot.seek(0)
+
+        response = session.put(
+            f"{target_url}/internal/users/{user_id}/store",
+            data=snapshot,
+            headers=_headers({"X-Collection-Metadata": metadata, "Content-Type": "application/octet-stream"}),
+            timeout=TIMEOUT_SECONDS
+        )
+        response.raise_for_status()
+    restored = response.json()["chunks"]
+    if restored != expected:
+        return f"MISMATCH ({restored} of {expected} chunks restored)", restored, size
+    return "copied", restored, size
+
+
+def cleanup_user(session, user_id, source_url):
+    response = session.delete(f"{source_url}/internal/users/{user_id}/store", headers=_headers(), timeout=TIMEOUT_SECONDS)
+    if response.status_code == 409:
+        return "kept (old node still owns the user; switch SHARD_NODES first)", 0, 0
+    response.raise_for_status()
+    return ("removed" if response.json()["removed"] else "nothing to remove"), 0, 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move vectorstores to their owners after the shard ring changed")
+    parser.add_argument("--old", required=True, help="Previous SHARD_NODES")
+    parser.add_argument("--new", required=True, help="New SHARD_NODES")
+    parser.add_argument("--vnodes", type=int, default=SHARD_VNODES)
+    parser.add_argument("--users", type=int, nargs="+", help="Only these user ids")
+    parser.add_argument("--cleanup", action="store_true", help="Remove moved stores from their old nodes")
+    parser.add_argument("--workers", type=int, default=4, help="Users moved in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the users that move")
+    args = parser.parse_args(argv)
+
+    if not INTERNAL_TOKEN and not args.dry_run:
+        print("❌ INTERNAL_TOKEN is not set (it must match the nodes')")
+        return 1
+
+    old_ring = HashRing(parse_nodes(args.old), args.vnodes)
+    new_ring = HashRing(parse_nodes(args.new), args.vnodes)
+    user_ids = args.users or list_user_ids()
+    moves = [
+        (user_id, old_ring.node_for(user_id), new_ring.node_for(user_id))
+        for user_id in user_ids
+        if old_ring.node_for(user_id) != new_ring.node_for(user_id)
+    ]
+    print(f"{len(moves)} of {len(user_ids)} users change owner ({len(moves) / max(len(user_ids), 1):.0%})")
+    if args.dry_run:
+        for user_id, source, target in moves:
+            print(f"  user {user_id}: {source} -> {target}")
+        return 0
+
+    session = requests.Session()
+
+    def run(move):
+        user_id, source, target = move
+        try:
+            if args.cleanup:
+                return cleanup_user(session, user_id, old_ring.nodes[source])
+            return copy_user(session, user_id, old_ring.nodes[source], new_ring.nodes[target])
+        except requests.RequestException as e:
+            return f"FAILED ({e})", 0, 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(run, moves))
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    for (user_id, source, target), (status, chunks, size) in zip(moves, results):
+        if status.startswith(("FAILED", "MISMATCH", "kept")):
+            failed += 1
+        print(f"  user {user_id}: {source} -> {target} {status}" + (f", {chunks} chunks" if chunks else ""))
+
+    chunks = sum(result[1] for result in results)
+    size = sum(result[2] for result in results)
+    rate = chunks / elapsed if elapsed else 0.0
+    print(
+        f"\n{'Cleaned up' if args.cleanup else 'Copied'} {len(moves) - failed}/{len(moves)} users, "
+        f"{chunks} chunks ({size / 1e6:.1f} MB) in {elapsed:.1f}s ({rate:.0f} chunks/s)"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
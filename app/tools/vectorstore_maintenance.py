@@ -0,0 +1,456 @@
+"""
+Vectorstore maintenance: compaction, orphan cleanup and per-size HNSW tuning.
+
+    python -m tools.vectorstore_maintenance                  # every store, report + fix
+    python -m tools.vectorstore_maintenance --dry-run        # report only
+    python -m tools.vectorstore_maintenance --stores db/vectorstores/user_3_vectorstore
+    python -m tools.vectorstore_maintenance --loop --interval-hours 24   # scheduled
+
+For each store (per-user directories and the shared store, if present):
+
+1. Vacuum: purge write-ahead-log entries already applied to every segment,
+   then VACUUM chroma.sqlite3 (what `chroma utils vacuum` does).
+2. Orphans: delete UUID directories that no VECTOR segment references.
+3. HNSW: measure recall@k against exact search and query latency. The index
+   is rebuilt when it is bloated by deleted entries, misses the target
+   recall, or uses M/construction_ef from the wrong size tier. search_ef is
+   chosen per collection as the smallest value that meets --target-recall.
+
+A rebuild copies ids, embeddings, documents and metadata into a fresh
+directory and swaps it in under the store lock the server's writers also
+take (chroma_clients.store_lock); the server notices the new sqlite file
+and reopens the store. A store that changes while it is being read or
+copied (its write-ahead log moves) is left alone until the next run.
+"""
+import argparse
+import json
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import hnswlib
+import numpy as np
+from chromadb.db.impl.sqlite import SqliteDB
+from chromadb.ingest.impl.utils import trigger_vector_segments_max_seq_id_migration
+from chromadb.segment import SegmentManager
+
+from config import VECTORSTORES_DIR as STORES_DIR, SHARED_VECTORSTORE_PATH
+from chroma_clients import SQLITE_FILENAME, open_client, release_client, dir_footprint, store_lock
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VECTORSTORES_DIR = os.path.join(APP_DIR, STORES_DIR)
+UUID_DIR_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+HNSW_METADATA_FILE = "index_metadata.pickle"
+REBUILD_SUFFIX = ".rebuild"
+EF_CANDIDATES = (10, 16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512)
+
+# (max collection size, M, construction_ef): bigger collections need denser graphs
+SIZE_TIERS = (
+    (10_000, 12, 100),
+    (100_000, 16, 128),
+    (500_000, 24, 200),
+    (None, 32, 256),
+)
+
+
+def tier_params(count):
+    for max_size, m, construction_ef in SIZE_TIERS:
+        if max_size is None or count <= max_size:
+            return {"hnsw:M": m, "hnsw:construction_ef": construction_ef}
+
+
+def find_stores(root, shared_path):
+    stores = []
+    if os.path.isdir(root):
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if os.path.isfile(os.path.join(path, SQLITE_FILENAME)):
+                stores.append(path)
+    if os.path.isfile(os.path.join(shared_path, SQLITE_FILENAME)) and shared_path not in stores:
+        stores.append(shared_path)
+    return stores
+
+
+def _vector_segments(store_path):
+    """{segment id: collection id} for the store's VECTOR segments"""
+    db = sqlite3.connect(f"file:{os.path.join(store_path, SQLITE_FILENAME)}?mode=ro", uri=True)
+    try:
+        return dict(db.execute("SELECT id, collection FROM segments WHERE scope = 'VECTOR'").fetchall())
+    finally:
+        db.close()
+
+
+def remove_orphan_segments(store_path, dry_run=False):
+    """Delete segment directories not referenced by chroma.sqlite3; returns (dirs, bytes)"""
+    live = set(_vector_segments(store_path))
+    removed, reclaimed = [], 0
+    for name in os.listdir(store_path):
+        path = os.path.join(store_path, name)
+        if os.path.isdir(path) and UUID_DIR_RE.match(name) and name not in live:
+            reclaimed += dir_footprint(path)[0]
+            removed.append(name)
+            if not dry_run:
+                shutil.rmtree(path)
+    return removed, reclaimed
+
+
+def vacuum_store(store_path, dry_run=False):
+    """Purge applied WAL entries and VACUUM the sqlite file; returns bytes reclaimed"""
+    before = dir_footprint(store_path)[0]
+    if dry_run:
+        return 0
+    client = open_client(store_path)
+    try:
+        system = client._system
+        db = system.instance(SqliteDB)
+        trigger_vector_segments_max_seq_id_migration(db, system.instance(SegmentManager))
+        for collection in client.list_collections():
+            db.purge_log(collection_id=collection.id)
+        db.vacuum()
+        config = db.config
+        config.set_parameter("automatically_purge", True)
+        db.set_config(config)
+    finally:
+        release_client(client)
+    return before - dir_footprint(store_path)[0]
+
+
+def hnsw_elements_added(store_path, segment_id):
+    """Entries ever added to the HNSW index (deleted ones still occupy the graph)"""
+    path = os.path.join(store_path, segment_id, HNSW_METADATA_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f).total_elements_added
+
+
+def read_collection(collection, batch_size=1000):
+    ids, vectors, documents, metadatas = [], [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(
+            limit=batch_size,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        vectors.extend(batch["embeddings"])
+        documents.extend(batch["documents"])
+        metadatas.extend(batch["metadatas"])
+        offset += len(batch["ids"])
+    matrix = np.asarray(vectors, dtype=np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return ids, matrix, documents, metadatas
+
+
+def exact_neighbours(matrix, queries, k, space):
+    """Indices of the exact top-k rows of matrix for each query"""
+    if space == "l2":
+        scores = -((queries ** 2).sum(1)[:, None] - 2 * queries @ matrix.T + (matrix ** 2).sum(1)[None, :])
+    elif space == "cosine":
+        norms = np.linalg.norm(matrix, axis=1) + 1e-12
+        scores = (queries @ matrix.T) / norms[None, :] / (np.linalg.norm(queries, axis=1)[:, None] + 1e-12)
+    else:
+        scores = queries @ matrix.T
+    k = min(k, matrix.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+def sample_queries(matrix, count, seed):
+    """Stored vectors plus a little noise, so queries look like real near-duplicates"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(matrix.shape[0], size=min(count, matrix.shape[0]), replace=False)
+    queries = matrix[rows].copy()
+    scale = float(np.abs(matrix).mean()) * 0.1
+    return queries + rng.normal(0, scale, size=queries.shape).astype(np.float32)
+
+
+def tune_search_ef(matrix, queries, truth, k, space, params, target_recall):
+    """Smallest search_ef whose recall@k meets the target on an in-memory replica"""
+    index = hnswlib.Index(space=space, dim=matrix.shape[1])
+    index.init_index(max_elements=matrix.shape[0], M=params["hnsw:M"], ef_construction=params["hnsw:construction_ef"])
+    index.add_items(matrix, np.arange(matrix.shape[0]))
+
+    k = min(k, matrix.shape[0])
+    recall = 0.0
+    for ef in EF_CANDIDATES:
+        if ef < k:
+            continue
+        index.set_ef(ef)
+        labels, _ = index.knn_query(queries, k=k)
+        recall = statistics.mean(len(set(row) & expected) / k for row, expected in zip(labels, truth))
+        if recall >= target_recall:
+            return ef, recall
+    return EF_CANDIDATES[-1], recall
+
+
+def measure(collection, ids, queries, truth, k):
+    """Recall@k against exact search and per-query latency through Chroma"""
+    k = min(k, len(ids))
+    position = {doc_id: i for i, doc_id in enumerate(ids)}
+    recalls, latencies = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {position[doc_id] for doc_id in result["ids"][0] if doc_id in position}
+        recalls.append(len(found & expected) / k)
+    latencies.sort()
+    return {
+        "recall": round(statistics.mean(recalls), 4),
+        "latency_ms_p50": round(latencies[len(latencies) // 2], 3),
+        "latency_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+    }
+
+
+def _wal_position(store_path):
+    db = sqlite3.connect(f"file:{os.path.join(store_path, SQLITE_FILENAME)}?mode=ro", uri=True)
+    try:
+        return db.execute("SELECT COALESCE(MAX(seq_id), 0) FROM embeddings_queue").fetchone()[0]
+    finally:
+        db.close()
+
+
+def rebuild_store(store_path, collection_name, metadata, data, wal_position, batch_size=1000):
+    """
+    Copy a collection into a new directory with new HNSW metadata and swap it
+    in. Returns False, leaving the store alone, when its write-ahead log has
+    moved past wal_position (the position `data` was read at) by swap time.
+    """
+    ids, matrix, documents, metadatas = data
+    target = store_path.rstrip("/") + REBUILD_SUFFIX
+    shutil.rmtree(target, ignore_errors=True)
+
+    client = open_client(target)
+    try:
+        collection = client.create_collection(collection_name, metadata=metadata, embedding_function=None)
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.add(
+                ids=ids[start:end],
+                embeddings=matrix[start:end].tolist(),
+                documents=documents[start:end],
+                metadatas=[m or None for m in metadatas[start:end]]
+            )
+    finally:
+        release_client(client)
+
+    # Writers (rag_chain) hold the store lock shared, so nothing is written
+    # between the last check and the swap
+    with store_lock(store_path, exclusive=True):
+        # Writes that landed while the copy was filled would be lost by the swap
+        if _wal_position(store_path) != wal_position:
+            shutil.rmtree(target, ignore_errors=True)
+            return False
+
+        # Move non-Chroma entries (lexical indexes) across at the last moment so
+        # appends made while the copy was running are kept
+        for name in os.listdir(store_path):
+            if name != SQLITE_FILENAME and not UUID_DIR_RE.match(name):
+                os.rename(os.path.join(store_path, name), os.path.join(target, name))
+
+        retired = store_path.rstrip("/") + ".old"
+        shutil.rmtree(retired, ignore_errors=True)
+        os.rename(store_path, retired)
+        os.rename(target, store_path)
+    shutil.rmtree(retired)
+    return True
+
+
+def maintain_collection(store_path, collection, args):
+    """Report on one collection's HNSW index and rebuild it when needed"""
+    segments = _vector_segments(store_path)
+    segment_id = next((s for s, c in segments.items() if c == str(collection.id)), None)
+    current = dict(collection.metadata or {})
+    space = current.get("hnsw:space", "l2")
+
+    wal_before = _wal_position(store_path)
+    data = read_collection(collection)
+    ids, matrix = data[0], data[1]
+    count = len(ids)
+    added = hnsw_elements_added(store_path, segment_id) if segment_id else None
+    report = {
+        "collection": collection.name,
+        "count": count,
+        "hnsw_elements": added,
+        "bloat": round(1 - count / added, 3) if added else 0.0,
+        "params_before": {key: value for key, value in current.items() if key.startswith("hnsw:")}
+    }
+    if count < args.min_size:
+        report["action"] = f"skipped (fewer than {args.min_size} vectors, searched exhaustively)"
+        return report
+
+    queries = sample_queries(matrix, args.queries, args.seed)
+    truth = exact_neighbours(matrix, queries, args.k, space)
+    report["before"] = measure(collection, ids, queries, truth, args.k)
+
+    params = tier_params(count)
+    search_ef, tuned_recall = tune_search_ef(matrix, queries, truth, args.k, space, params, args.target_recall)
+    params["hnsw:search_ef"] = search_ef
+    report["params_after"] = params
+    report["tuned_recall"] = round(tuned_recall, 4)
+
+    reasons = []
+    if report["bloat"] >= args.bloat_threshold:
+        reasons.append(f"bloat {report['bloat']:.0%}")
+    if report["before"]["recall"] < args.target_recall:
+        reasons.append(f"recall {report['before']['recall']:.3f} < {args.target_recall}")
+    if any(current.get(key, default) != params[key] for key, default in (("hnsw:M", 16), ("hnsw:construction_ef", 100))):
+        reasons.append("size tier changed")
+
+    if not reasons:
+        report["action"] = "kept"
+        return report
+    if args.dry_run:
+        report["action"] = "would rebuild: " + ", ".join(reasons)
+        return report
+    return {**report, "rebuild": reasons, "_data": data, "_params": {**params, "hnsw:space": space},
+            "_queries": (queries, truth), "_wal": wal_before}
+
+
+def maintain_store(store_path, args):
+    """
+    Maintain one store. A dry run works on a temporary copy, since merely
+    opening a store with Chroma can write to it (segment files are persisted).
+    """
+    store_start = time.perf_counter()
+    bytes_before = dir_footprint(store_path)[0]
+    report = {"store": os.path.relpath(store_path, APP_DIR) if store_path.startswith(APP_DIR) else store_path}
+
+    original_path = store_path
+    if args.dry_run:
+        store_path = os.path.join(tempfile.mkdtemp(prefix="ragit_maintenance_"), "store")
+        shutil.copytree(original_path, store_path)
+    try:
+        _maintain_store(store_path, args, report)
+    finally:
+        if args.dry_run:
+            shutil.rmtree(os.path.dirname(store_path), ignore_errors=True)
+
+    report["bytes_before"] = bytes_before
+    report["bytes_after"] = dir_footprint(original_path)[0]
+    report["bytes_reclaimed"] = bytes_before - report["bytes_after"]
+    report["seconds"] = round(time.perf_counter() - store_start, 2)
+    return report
+
+
+def _maintain_store(store_path, args, report):
+    orphans, orphan_bytes = remove_orphan_segments(store_path, args.dry_run)
+    report["orphans_removed"] = orphans
+    report["vacuum_reclaimed_bytes"] = vacuum_store(store_path, args.dry_run)
+
+    client = open_client(store_path)
+    pending = []
+    try:
+        report["collections"] = []
+        for collection in client.list_collections():
+            result = maintain_collection(store_path, collection, args)
+            if "_data" in result:
+                pending.append(result)
+            report["collections"].append(result)
+    finally:
+        release_client(client)
+
+    for result in pending:
+        data = result.pop("_data")
+        params = result.pop("_params")
+        queries, truth = result.pop("_queries")
+        wal_position = result.pop("_wal")
+        if _wal_position(store_path) != wal_position:
+            result["action"] = "skipped rebuild (store changed while reading, retry next run)"
+            continue
+        if len(report["collections"]) > 1:
+            result["action"] = "skipped rebuild (store holds several collections)"
+            continue
+        if not rebuild_store(store_path, result["collection"], params, data, wal_position):
+            result["action"] = "skipped rebuild (store changed while copying, retry next run)"
+            continue
+        client = open_client(store_path)
+        try:
+            result["after"] = measure(client.get_collection(result["collection"]), data[0], queries, truth, args.k)
+        finally:
+            release_client(client)
+        result["action"] = "rebuilt: " + ", ".join(result.pop("rebuild"))
+
+    report["orphan_bytes"] = orphan_bytes
+
+
+def print_store_report(report):
+    print(f"\n{report['store']}: {report['bytes_before'] / 1e6:.2f} MB -> {report['bytes_after'] / 1e6:.2f} MB "
+          f"(reclaimed {report['bytes_reclaimed'] / 1e6:.2f} MB, {len(report['orphans_removed'])} orphan segment dirs) "
+          f"in {report['seconds']:.1f}s")
+    for collection in report.get("collections", []):
+        line = f"  {collection['collection']}: {collection['count']} vectors, bloat {collection['bloat']:.0%} -> {collection['action']}"
+        print(line)
+        if "before" in collection:
+            before = collection["before"]
+            print(f"    before: recall@k={before['recall']:.3f} p50={before['latency_ms_p50']:.2f}ms "
+                  f"p95={before['latency_ms_p95']:.2f}ms params={collection['params_before']}")
+        if "after" in collection:
+            after = collection["after"]
+            print(f"    after:  recall@k={after['recall']:.3f} p50={after['latency_ms_p50']:.2f}ms "
+                  f"p95={after['latency_ms_p95']:.2f}ms params={collection['params_after']}")
+
+
+def run_once(args):
+    stores = args.stores or find_stores(args.root, os.path.join(APP_DIR, SHARED_VECTORSTORE_PATH))
+    reports = []
+    for store_path in stores:
+        store_path = os.path.abspath(store_path)
+        shutil.rmtree(store_path.rstrip("/") + REBUILD_SUFFIX, ignore_errors=True)  # leftovers of a crashed run
+        try:
+            report = maintain_store(store_path, args)
+        except Exception as e:
+            print(f"❌ Maintenance failed for {store_path}: {e}")
+            continue
+        print_store_report(report)
+        reports.append(report)
+
+    total = sum(r["bytes_reclaimed"] for r in reports)
+    rebuilt = sum(1 for r in reports for c in r.get("collections", []) if c["action"].startswith("rebuilt"))
+    print(f"\n{len(reports)} stores, {total / 1e6:.2f} MB reclaimed, {rebuilt} indexes rebuilt"
+          + (" (dry run)" if args.dry_run else ""))
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(reports, f, indent=2, default=str)
+    return reports
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compact, clean up and tune Chroma vectorstores")
+    parser.add_argument("--root", default=VECTORSTORES_DIR, help="Directory of per-user stores")
+    parser.add_argument("--stores", nargs="+", help="Only these store directories")
+    parser.add_argument("--dry-run", action="store_true", help="Report without changing anything")
+    parser.add_argument("--k", type=int, default=10, help="k for recall@k")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--bloat-threshold", type=float, default=0.3, help="Rebuild when this share of the index is deleted entries")
+    parser.add_argument("--min-size", type=int, default=1000, help="Leave smaller collections' HNSW settings alone")
+    parser.add_argument("--queries", type=int, default=100, help="Sample queries per collection")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--loop", action="store_true", help="Run forever, every --interval-hours")
+    parser.add_argument("--interval-hours", type=float, default=24)
+    parser.add_argument("--json-out")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    while True:
+        started = time.time()
+        print(f"Vectorstore maintenance run at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        run_once(args)
+        if not args.loop:
+            return
+        time.sleep(max(0, args.interval_hours * 3600 - (time.time() - started)))
+
+
+if __name__ == "__main__":
+    main()
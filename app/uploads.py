@@ -0,0 +1,158 @@
+"""
+Streaming, content-addressed PDF upload storage.
+
+Uploaded files are written straight from the multipart parser into the
+user's upload folder and hashed on the way (UploadRequest), so each byte is
+read from the socket and written to disk once. A finished upload is moved to
+pdf/user_<id>/<sha256>.pdf: identical content is stored once per user, and
+users never overwrite each other's files. Content the user has already
+ingested short-circuits before any parsing or embedding.
+"""
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+
+from db.connection import execute_query
+from db.queries.documents import (
+    get_document_by_hash_query,
+    get_document_by_source_query,
+    count_documents_by_file_path_query
+)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PDF_MAGIC = b"%PDF-"
+INCOMING_PREFIX = ".incoming-"
+
+
+class UploadRejected(Exception):
+    """An uploaded file that cannot be stored (reported per file)"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def get_user_upload_dir(user_id):
+    """Per-user folder for uploaded PDFs (created on demand)"""
+    path = os.path.join(APP_DIR, "pdf", f"user_{user_id}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class HashingFileStream:
+    """Writable temp file in the upload folder that hashes bytes as they are written"""
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=INCOMING_PREFIX, suffix=".pdf")
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, tell, flush, close, ... as werkzeug's FileStorage expects
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """
+    Request whose uploaded files stream into request.upload_dir when a route
+    sets it before reading request.files (other routes keep werkzeug's default)
+    """
+
+    upload_dir = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_dir is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = HashingFileStream(self.upload_dir)
+        self.upload_streams = getattr(self, "upload_streams", []) + [stream]
+        return stream
+
+
+def discard_incoming(request):
+    """Remove temp files of a request that were not stored (rejected or failed uploads)"""
+    for stream in getattr(request, "upload_streams", []):
+        stream.close()
+        if os.path.exists(stream.path):
+            os.remove(stream.path)
+
+
+def store_upload(file):
+    """
+    Move a streamed upload to its content-addressed path.
+    Returns (content_hash, size_bytes, file_path).
+    """
+    stream = file.stream
+    if not isinstance(stream, HashingFileStream):
+        raise UploadRejected("Upload was not streamed to the upload folder")
+
+    stream.flush()
+    stream.seek(0)
+    if stream.read(len(PDF_MAGIC)) != PDF_MAGIC:
+        raise UploadRejected("File is not a valid PDF")
+    stream.close()
+
+    content_hash = stream.hexdigest()
+    file_path = os.path.join(os.path.dirname(stream.path), f"{content_hash}.pdf")
+    if os.path.exists(file_path):
+        os.remove(stream.path)
+    else:
+        os.replace(stream.path, file_path)
+    return content_hash, stream.size, file_path
+
+
+def _remove_if_unreferenced(file_path):
+    remaining = execute_query(count_documents_by_file_path_query(), params=(file_path,), fetch_one=True)
+    if remaining and remaining["document_count"] == 0 and os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def ingest_upload(user_id, filename, content_hash, size_bytes, file_path):
+    """
+    Ingest a stored upload unless the user already has this content.
+    Returns a per-file result dict with status "added", "updated",
+    "unchanged" (same name, same content), "duplicate" (same content under
+    another name) or "failed".
+    """
+    result = {"filename": filename, "content_hash": content_hash, "size_bytes": size_bytes}
+
+    existing = execute_query(get_document_by_hash_query(), params=(user_id, content_hash), fetch_one=True)
+    if existing:
+        result["status"] = "unchanged" if existing["source"] == filename else "duplicate"
+        result["document_id"] = existing["id"]
+        if existing["source"] != filename:
+            result["duplicate_of"] = existing["source"]
+        return result
+
+    previous = execute_query(get_document_by_source_query(), params=(user_id, filename), fetch_one=True)
+
+    from pdf_converter import add_pdf_to_vectorstore
+    success = add_pdf_to_vectorstore(
+        file_path, filename, user_id, content_hash=content_hash, size_bytes=size_bytes
+    )
+    if not success:
+        result["status"] = "failed"
+        # Nothing references content that failed to ingest
+        _remove_if_unreferenced(file_path)
+        return result
+
+    result["status"] = "updated" if previous else "added"
+    # A new version under the same name replaces the old file
+    if previous and previous["file_path"] and previous["file_path"] != file_path:
+        _remove_if_unreferenced(previous["file_path"])
+
+    record = execute_query(get_document_by_source_query(), params=(user_id, filename), fetch_one=True)
+    if record:
+        result["document_id"] = record["id"]
+        result["chunk_count"] = record["chunk_count"]
+    return result
@@ -1,30 +1,312 @@
-from tavily import TavilyClient
-from config import TAVILY_API_KEY
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
 
-# initialize the tavily client with the api key
-client = TavilyClient(api_key=TAVILY_API_KEY)
+import requests
+from defusedxml import DefusedXmlException, ElementTree as ET
+from quota import get_quota, is_rate_limited, retry_after_seconds, TAVILY_KEY, BACKGROUND
+from config import (
+    TAVILY_API_KEY,
+    TAVILY_EXTRACT_URL,
+    CRAWL_EXTRACT_BATCH_SIZE,
+    CRAWL_CONCURRENCY,
+    CRAWL_CACHE_TTL_SECONDS,
+    CRAWL_MAX_REDIRECTS,
+    CRAWL_MAX_RESPONSE_BYTES
+)
+
+# tavily client, initialized with the api key on first use
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        from tavily import TavilyClient
+        client = TavilyClient(api_key=TAVILY_API_KEY)
+    return client
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+crawl_cache_path = os.path.join(current_dir, "db", "crawl_cache")
+
+def _extract(urls):
+    if TAVILY_EXTRACT_URL:
+        # Local/fake extract service speaking the same request/response shape
+        response = requests.post(
+            TAVILY_EXTRACT_URL,
+            json={"urls": urls, "api_key": TAVILY_API_KEY},
+            timeout=120
+        )
+        response.raise_for_status()
+        return response.json()
+    return get_client().extract(urls=urls)
+
+def _url_key(url):
+    """What is left of a URL once Tavily's usual normalisation is undone"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host, parts.path.rstrip("/"), parts.query
+
+def _match_requested(urls, results):
+    """
+    {requested url: content} from {returned url: content}. Tavily may return
+    a page under another URL (trailing slash, scheme, redirect target):
+    exact matches first, then normalised ones, then a single leftover pair.
+    """
+    contents = {}
+    unmatched = {}
+    for returned, content in results.items():
+        if returned in urls and returned not in contents:
+            contents[returned] = content
+        else:
+            unmatched[returned] = content
+
+    by_key = {}
+    for url in urls:
+        if url not in contents:
+            by_key.setdefault(_url_key(url), url)
+    for returned, content in list(unmatched.items()):
+        url = by_key.pop(_url_key(returned or ""), None)
+        if url is not None:
+            contents[url] = content
+            del unmatched[returned]
+
+    missing = [url for url in urls if url not in contents]
+    if len(missing) == 1 and len(unmatched) == 1:
+        contents[missing[0]] = next(iter(unmatched.values()))
+    return contents
+
+def extract_batch(urls):
+    """
+    Extract raw content for a list of URLs in one Tavily call.
+    Returns {url: content}, keyed by the requested URLs, for the URLs that
+    produced content.
+    """
+    # Extraction is ingestion work, so it waits behind interactive calls
+    get_quota().acquire(TAVILY_KEY, priority=BACKGROUND)
+    try:
+        response = _extract(urls)
+    except Exception as e:
+        if is_rate_limited(e):
+            get_quota().throttle(TAVILY_KEY, retry_after_seconds(e))
+        raise
+
+    results = {}
+    # Based on the GitHub docs, response has a "results" key with extracted content
+    if isinstance(response, dict) and "results" in response:
+        for result in response["results"]:
+            content = result.get("raw_content", "")
+            if content:
+                results[result.get("url")] = content
+
+    # Fallback: try to get content directly if structure is different
+    elif isinstance(response, str) and len(urls) == 1:
+        results[urls[0]] = response
+
+    return _match_requested(urls, results)
 
 def webcrawl(url):
     try:
-        # Use the extract method with urls parameter (expects a list)
-        response = client.extract(urls=[url])
-        
-        # Based on the GitHub docs, response has a "results" key with extracted content
-        if isinstance(response, dict) and "results" in response:
-            results = response["results"]
-            if results and len(results) > 0:
-                # Get the first result (since we only passed one URL)
-                first_result = results[0]
-                # Extract the raw_content from the result
-                content = first_result.get("raw_content", "")
-                return content if content else None
-        
-        # Fallback: try to get content directly if structure is different
-        elif isinstance(response, str):
-            return response
-        
-        return None
-        
+        return extract_batch([url]).get(url)
     except Exception as e:
         print(f"An error occurred while crawling the URL {url}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+class CrawlCache:
+    """
+    On-disk cache of extracted page content keyed by URL.
+
+    Entries are fresh for `ttl` seconds. After that they are revalidated
+    against the origin with If-None-Match / If-Modified-Since when the page
+    sent validators, and re-extracted otherwise.
+    """
+
+    def __init__(self, path=crawl_cache_path, ttl=CRAWL_CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, url):
+        return os.path.join(self.path, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            with open(self._file(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, content, etag=None, last_modified=None):
+        entry = {
+            "url": url,
+            "content": content,
+            "content_hash": hashlib.sha256(content.encode("utf-8")).hexdigest(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time()
+        }
+        tmp_path = self._file(url) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._file(url))
+        return entry
+
+    def touch(self, entry):
+        return self.put(entry["url"], entry["content"], entry.get("etag"), entry.get("last_modified"))
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get("fetched_at", 0) < self.ttl
+
+class UnsafeURL(ValueError):
+    """A user-supplied URL that the server must not fetch itself"""
+
+
+def check_public_url(url):
+    """
+    Raise UnsafeURL unless url is http(s) and every address its host resolves
+    to is public (no loopback, private, link-local, metadata or reserved)
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeURL(f"Only http(s) URLs can be fetched: {url}")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)}
+    except (OSError, ValueError) as e:
+        raise UnsafeURL(f"Cannot resolve {parts.hostname}: {e}") from e
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise UnsafeURL(f"{parts.hostname} resolves to a non-public address ({ip})")
+
+
+def fetch_public(method, url, headers=None, timeout=10):
+    """
+    Send a request to a user-supplied URL, following redirects by hand so
+    that every hop is checked with check_public_url. The response is
+    streamed: read it with read_capped.
+    """
+    for _ in range(CRAWL_MAX_REDIRECTS + 1):
+        check_public_url(url)
+        response = requests.request(method, url, headers=headers, timeout=timeout, stream=True, allow_redirects=False)
+        location = response.headers.get("Location")
+        if not response.is_redirect or not location:
+            return response
+        response.close()
+        url = urljoin(url, location)
+    raise requests.TooManyRedirects(f"More than {CRAWL_MAX_REDIRECTS} redirects")
+
+
+def read_capped(response, max_bytes=CRAWL_MAX_RESPONSE_BYTES):
+    """The response body, refusing bodies over max_bytes"""
+    if int(response.headers.get("Content-Length") or 0) > max_bytes:
+        raise ValueError(f"Response larger than {max_bytes} bytes")
+    body = bytearray()
+    for block in response.iter_content(64 * 1024):
+        body += block
+        if len(body) > max_bytes:
+            raise ValueError(f"Response larger than {max_bytes} bytes")
+    return bytes(body)
+
+
+def _fetch_validators(url):
+    """HEAD the origin for ETag / Last-Modified (None, None if unavailable)"""
+    try:
+        with fetch_public("HEAD", url) as response:
+            return response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except (requests.RequestException, UnsafeURL):
+        return None, None
+
+def _is_unchanged(entry):
+    """Conditional GET against the origin; True on 304 Not Modified"""
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    if not headers:
+        return False
+    try:
+        # Only the status is needed; the body is never read
+        with fetch_public("GET", entry["url"], headers=headers) as response:
+            return response.status_code == 304
+    except (requests.RequestException, UnsafeURL):
+        return False
+
+def webcrawl_many(urls, cache=None, batch_size=CRAWL_EXTRACT_BATCH_SIZE, concurrency=CRAWL_CONCURRENCY):
+    """
+    Extract many URLs: cached pages are reused (revalidated when stale), the
+    rest are extracted in batched Tavily calls with bounded concurrency.
+
+    Returns {url: {"content", "content_hash", "cached"}}; failed URLs are absent.
+    """
+    cache = cache or CrawlCache()
+    results = {}
+    to_fetch = []
+    to_revalidate = []
+
+    for url in dict.fromkeys(urls):
+        entry = cache.get(url)
+        if entry and cache.is_fresh(entry):
+            results[url] = dict(entry, cached=True)
+        elif entry and (entry.get("etag") or entry.get("last_modified")):
+            to_revalidate.append(entry)
+        else:
+            to_fetch.append(url)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for entry, unchanged in zip(to_revalidate, executor.map(_is_unchanged, to_revalidate)):
+            if unchanged:
+                results[entry["url"]] = dict(cache.touch(entry), cached=True)
+            else:
+                to_fetch.append(entry["url"])
+
+        batches = [to_fetch[i:i + batch_size] for i in range(0, len(to_fetch), batch_size)]
+        validator_futures = {url: executor.submit(_fetch_validators, url) for url in to_fetch}
+
+        def run_batch(batch):
+            try:
+                return extract_batch(batch)
+            except Exception as e:
+                print(f"An error occurred while extracting {len(batch)} URLs: {e}")
+                return {}
+
+        for contents in executor.map(run_batch, batches):
+            for url, content in contents.items():
+                etag, last_modified = (None, None)
+                if url in validator_futures:
+                    etag, last_modified = validator_futures[url].result()
+                results[url] = dict(cache.put(url, content, etag, last_modified), cached=False)
+
+    return results
+
+def fetch_sitemap_urls(sitemap_url, limit=200, max_depth=2):
+    """Collect page URLs from a sitemap (following nested sitemap indexes)"""
+    namespace = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+    urls = []
+    pending = [(sitemap_url, 0)]
+
+    while pending and len(urls) < limit:
+        current, depth = pending.pop(0)
+        try:
+            with fetch_public("GET", current, timeout=15) as response:
+                response.raise_for_status()
+                body = read_capped(response)
+            root = ET.fromstring(body)
+        except (requests.RequestException, ValueError, ET.ParseError, DefusedXmlException) as e:
+            print(f"Failed to read sitemap {current}: {e}")
+            continue
+
+        if root.tag == f"{namespace}sitemapindex":
+            if depth < max_depth:
+                pending.extend((loc.text.strip(), depth + 1) for loc in root.iter(f"{namespace}loc") if loc.text)
+        else:
+            urls.extend(loc.text.strip() for loc in root.iter(f"{namespace}loc") if loc.text)
+
+    return urls[:limit]